@@ -0,0 +1,288 @@
+"""
+benchmark
+timing benchmarks of calcimpy with reference accuracy gates.
+startup   : wall time of calcimpy.py for a tiny mensur over bare python importing
+            numpy and scipy.special, must be within STARTUP_BUDGET.
+parse     : read_mensur_array of synthetic bores.
+sweep     : input_impedance_array of synthetic bores, cold caches.
+pressure  : calc_pressure_array of synthetic bores at a few frequencies.
+backends  : sweep of taper and nest bores by every available backend ( numpy, jit if numba
+            is installed, aot if built ), with speed up and max relative difference to numpy.
+reference : results must agree with stored reference files (REFERENCES).
+Synthetic bores are taper ( n cells of cone ), straight ( n slices of cylinder )
+and nest ( n levels of INSERT group with SPLIT and BRANCH/MERGE in each ).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+import xmensur as xmn
+import imped
+import impbackend
+
+STARTUP_BUDGET = 0.15  # seconds of overhead allowed for calcimpy.py startup
+SIZES = {'taper': (100, 1000, 10000), 'straight': (100, 1000, 10000), 'nest': (4, 16, 64)}
+NFREQ = (801, 8001)  # frequency counts of sweep ( 0 to 2000 Hz )
+BACKEND_BORES = (('taper', 1000), ('nest', 64))  # bores of backends benchmark
+RTOL = 1.0e-9  # relative tolerance of reference gates
+# (mensur, reference of freq, imp.real, imp.imag, imp.mag), calculated at 24 celsius, PIPE
+REFERENCES = (('sample/simple.xmen', 'sample/simple_python.imp'),
+              ('sample/split.xmen', 'sample/split_python.imp'),
+              ('sample/branch.xmen', 'sample/branch_python.imp'),
+              ('sample/simple.xmen', 'sample/simple.imp'),
+              ('sample/split.xmen', 'sample/split.imp'),
+              ('sample/branch.xmen', 'sample/branch.imp'))
+# (diameter, reference of freq, radimp real, imag), PIPE, 24 celsius, (f = 0 is skipped)
+RADIMP_REFERENCES = ((0.25, 'radimp_text_python.txt', 1.0e-12),
+                     (0.25, 'radimp_test.txt', 1.0e-6))  # printed by %f
+
+_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def wall_time(cmd, repeat):
+    """Minimum wall time of running cmd repeat times"""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best
+
+
+def measure(func, repeat):
+    """Minimum time of func() in repeat runs and peak traced memory (bytes) of one more run"""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def bore_text(kind, n):
+    """XMEN text of synthetic bore"""
+    lines = ['[']
+    if kind == 'taper':
+        d = np.linspace(10, 30, n + 1)
+        lines += ['{0!r},{1!r},{2!r},'.format(float(d[k]), float(d[k + 1]), 1000.0/n) for k in range(n)]
+        lines += ['30,30,0,', ']']
+    elif kind == 'straight':
+        lines += ['10,10,1,']*n + ['10,10,0,', ']']
+    elif kind == 'nest':
+        lines += ['10,10,100,', 'INSERT,G1', '10,10,100,', 'OPEN_END', ']']
+        for k in range(1, n + 1):
+            lines += ['{,G%d' % k, '10,10,20,', '|,H%d,0.5,' % k, '10,10,20,',
+                      '<,V%d,0.5,' % k, '10,10,30,', '>,V%d,0.5,' % k, '10,10,20,']
+            if k < n:
+                lines += ['INSERT,G%d' % (k + 1)]
+            lines += ['}', '{,H%d' % k, '8,8,5,', 'OPEN_END', '}', '{,V%d' % k, '10,10,60,', 'OPEN_END', '}']
+    else:
+        raise ValueError('unknown bore : ' + kind)
+    return '\n'.join(lines) + '\n'
+
+
+def read_bore(path):
+    return xmn.read_mensur_file(path)
+
+
+def bench_startup(repeat=5):
+    """Returns dict of wall time of calcimpy.py 'cli', bare imports 'base' and 'overhead'"""
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'tiny.xmen')
+        with open(path, 'w') as f:
+            f.write('[\n10,10,100,\n10,10,0,\n]\n')
+        cli = wall_time([sys.executable, os.path.join(_dir, 'calcimpy.py'), '-M', '100', '-o', os.devnull, path], repeat)
+    base = wall_time([sys.executable, '-c', 'import numpy, scipy.special'], repeat)
+
+    return {'cli': cli, 'base': base, 'overhead': cli - base}
+
+
+def bench_bores(bench, repeat=3, quick=False):
+    """Run bench ('parse', 'sweep' or 'pressure') for every synthetic bore and size.
+    quick : only two smaller sizes and smallest frequency count.
+    Returns list of dict of results.
+    """
+    ctx = imped.calc_context(24.0, 'PIPE')
+    res = []
+    with tempfile.TemporaryDirectory() as d:
+        for kind, sizes in SIZES.items():
+            for n in sizes[:2] if quick else sizes:
+                path = os.path.join(d, '{0}{1}.xmen'.format(kind, n))
+                with open(path, 'w') as f:
+                    f.write(bore_text(kind, n))
+                ma = xmn.read_mensur_array(path)
+                ncell = len(ma)
+                if bench == 'parse':
+                    t, peak = measure(lambda: xmn.read_mensur_array(path), repeat)
+                    res.append({'bench': bench, 'bore': kind, 'size': n, 'cells': ncell,
+                                'time': t, 'peak': peak, 'rate': ncell/t})
+                elif bench == 'sweep':
+                    for nf in NFREQ[:1] if quick else NFREQ:
+                        wf = np.pi*2*np.linspace(0, 2000, nf)
+
+                        def sweep():
+                            imped.clear_tm_cache()
+                            imped.clear_radimp_cache()
+                            imped.input_impedance_array(wf, ma, ctx)
+                        t, peak = measure(sweep, repeat)
+                        res.append({'bench': bench, 'bore': kind, 'size': n, 'cells': ncell, 'nfreq': nf,
+                                    'time': t, 'peak': peak, 'rate': ncell*nf/t})
+                elif bench == 'pressure':
+                    wf = np.pi*2*np.array([100.0, 500.0, 1000.0, 1500.0])
+
+                    def pressure():
+                        for w in wf:
+                            imped.calc_pressure_array(w, ma, 1.0, False, ctx)
+                    t, peak = measure(pressure, repeat)
+                    res.append({'bench': bench, 'bore': kind, 'size': n, 'cells': ncell, 'nfreq': len(wf),
+                                'time': t, 'peak': peak, 'rate': ncell*len(wf)/t})
+    return res
+
+
+def available_backends():
+    """Backends which can be loaded here, numpy first"""
+    names = ['numpy']
+    if impbackend.has_numba():
+        names.append('jit')
+    if impbackend.aot_module() is not None:
+        names.append('aot')
+    return names
+
+
+def bench_backends(repeat=3, quick=False, backend=None):
+    """Sweep of BACKEND_BORES by every available backend, compiled routines are loaded
+    before timing. backend is restored after. Returns list of dict of results."""
+    ctx = imped.calc_context(24.0, 'PIPE')
+    res = []
+    nf = NFREQ[0] if quick else NFREQ[-1]
+    wf = np.pi*2*np.linspace(0, 2000, nf)
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            for kind, n in BACKEND_BORES:
+                path = os.path.join(d, '{0}{1}.xmen'.format(kind, n))
+                with open(path, 'w') as f:
+                    f.write(bore_text(kind, n))
+                ma = xmn.read_mensur_array(path)
+                base = None
+                for name in available_backends():
+                    imped.set_backend(name)
+
+                    def sweep():
+                        imped.clear_tm_cache()
+                        imped.clear_radimp_cache()
+                        return imped.input_impedance_array(wf, ma, ctx)
+                    z = sweep()  # compile or load jit routines
+                    t, peak = measure(sweep, repeat)
+                    if base is None:
+                        base = (t, z)
+                    ok = np.isfinite(base[1])
+                    diff = float(np.max(np.abs(z[ok] - base[1][ok]))/np.max(np.abs(base[1][ok])))
+                    res.append({'bench': 'backends', 'backend': name, 'bore': kind, 'size': n, 'cells': len(ma),
+                                'nfreq': nf, 'time': t, 'peak': peak, 'rate': len(ma)*nf/t,
+                                'speedup': base[0]/t, 'diff': diff})
+    finally:
+        imped.set_backend(backend)
+    return res
+
+
+def check_references():
+    """Compare results with REFERENCES and RADIMP_REFERENCES.
+    Returns list of (reference, max relative error, passed).
+    """
+    ctx = imped.calc_context(24.0, 'PIPE')
+    res = []
+    for xmen, ref in REFERENCES:
+        rf = np.genfromtxt(os.path.join(_dir, ref), delimiter=',', skip_header=1)
+        men = read_bore(os.path.join(_dir, xmen))
+        s = men.df*men.df*np.pi/4
+        zz = s*imped.input_impedance_array(np.pi*2*rf[:, 0], xmn.compile_mensur(men), ctx)
+        zr = rf[:, 1] + rf[:, 2]*1j
+        err = np.max(np.abs(zz - zr))/np.max(np.abs(zr))
+        res.append((ref, err, bool(err <= RTOL)))
+    for dia, ref, tol in RADIMP_REFERENCES:
+        rf = np.genfromtxt(os.path.join(_dir, ref), delimiter=',')[1:]
+        zz = imped.radimp_array(np.pi*2*rf[:, 0], dia, ctx)
+        zr = rf[:, 1] + rf[:, 2]*1j
+        err = np.max(np.abs(zz - zr)/np.abs(zr))
+        res.append((ref, err, bool(err <= tol)))
+    return res
+
+
+def compare(res, base, tol):
+    """Results of res slower than base by factor tol. Returns list of (key, time, base time)."""
+    def key(r):
+        return tuple(r.get(k) for k in ('bench', 'backend', 'bore', 'size', 'nfreq'))
+    bt = {key(r): r['time'] for r in base}
+    return [(key(r), r['time'], bt[key(r)]) for r in res if key(r) in bt and r['time'] > bt[key(r)]*tol]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark : timing of calcimpy with reference accuracy gates')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='number of runs, minimum time is used, default 3.')
+    parser.add_argument('-q', '--quick', action='store_true', help='smaller bores and frequency count only.')
+    parser.add_argument('-o', '--output', default='', help='save results to JSON file.')
+    parser.add_argument('-c', '--compare', default='', help='JSON file of earlier results, fails if slower than it by --tolerance.')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed ratio of time to earlier results, default 1.5.')
+    parser.add_argument('-B', '--backend', choices=impbackend.BACKENDS, default=None,
+                        help='backend of core routines, default CALCIMPY_BACKEND or auto ( jit runs compiled parallel kernel ).')
+    parser.add_argument('bench', nargs='*', choices=['all', 'startup', 'parse', 'sweep', 'pressure', 'backends',
+                                                     'reference'],
+                        default='all', help='benchmarks to run, default all.')
+    args = parser.parse_args()
+    imped.set_backend(args.backend)
+
+    benches = ['startup', 'parse', 'sweep', 'pressure', 'backends', 'reference'] if 'all' in args.bench else args.bench
+    res = []
+    failed = False
+    for bench in benches:
+        if bench == 'startup':
+            r = bench_startup(max(args.repeat, 5))
+            print('startup  cli {cli:.3f}s  base {base:.3f}s  overhead {overhead:.3f}s'.format(**r))
+            if r['overhead'] > STARTUP_BUDGET:
+                print('  FAILED  startup overhead exceeds budget {0:.3f}s'.format(STARTUP_BUDGET))
+                failed = True
+            res.append(dict(r, bench=bench, time=r['cli']))
+        elif bench == 'backends':
+            for r in bench_backends(args.repeat, args.quick, args.backend):
+                print('{bench:9s} {backend:6s} {bore:8s} {size:6d} {cells:7d} cells {nfreq:5d} freq {time:9.4f}s '
+                      '{rate:10.3e} cells*freq/s  x{speedup:5.2f}  diff {diff:.1e}'.format(**r))
+                res.append(r)
+        elif bench == 'reference':
+            for ref, err, ok in check_references():
+                print('{0:9s} {1:28s} max rel err {2:.2e}{3}'.format(bench, ref, err, '' if ok else '  FAILED'))
+                failed = failed or not ok
+        else:
+            for r in bench_bores(bench, args.repeat, args.quick):
+                print('{bench:9s} {bore:8s} {size:6d} {cells:7d} cells {nf:>5s} freq {time:9.4f}s '
+                      '{rate:10.3e} {unit:12s} peak {mb:8.2f} MB'.format(
+                          nf=str(r.get('nfreq', '')), unit='cells*freq/s' if 'nfreq' in r else 'cells/s',
+                          mb=r['peak']/2**20, **r))
+                res.append(r)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'numpy': np.__version__,
+                       'backend': imped.impcore.name, 'results': res}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            for k, t, bt in compare(res, json.load(f)['results'], args.tolerance):
+                print('  SLOWER  {0} {1:.4f}s, was {2:.4f}s'.format(' '.join(str(v) for v in k if v is not None), t, bt))
+                failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,65 +3,535 @@ calcimpy
 Input impedance calculation program for air column ( wind instruments ).
 """
 import argparse
+import json
 import sys
 import os.path
+import glob
+import time
+import traceback
+import zipfile
+import concurrent.futures
 import numpy as np
-import pandas as pd
 
 import xmensur as xmn
 import imped
+import impbackend
+import impprof
+import impstate
+import mencache
+import mensimplify
+import resonance
 
 __version__ = '1.1.0'
 
 
+FORMATS = {'csv': '.imp', 'npy': '.npy', 'npz': '.npz', 'bin': '.bin'}  # output format and default extension
+CHUNK = 4096  # number of frequencies calculated and written at once
+GRID_POINTS = 2**16  # number of temperature x frequency points calculated at once
+BIN_MAGIC = b'CIMPBIN1'
+REC_DTYPE = np.dtype([('freq', '<f8'), ('imp', '<c16')])  # record of npy and bin format
+SIMPLIFY_POINTS = 1024  # max number of frequencies used to evaluate impedance error of --simplify-error
+CHECKPOINT_SUFFIX = '.done'  # sidecar of --checkpoint output, removed when all chunks are written
+
+
+def parse_temperatures(s):
+    """Temperatures of --temperature, a value "24", list "10,20,30" or range "start:stop:step" ( stop included )"""
+    if ':' in s:
+        start, stop, step = (float(v) for v in s.split(':'))
+        return np.linspace(start, stop, int(round((stop - start)/step)) + 1)
+    return np.array([float(v) for v in s.split(',')])
+
+
+def is_sweep(s):
+    """--temperature s is a list or range"""
+    return ':' in s or ',' in s
+
+
+def magnitude_db(zz):
+    """20*log10(abs(zz)), 0 for zz = 0"""
+    az = np.abs(zz)
+    mg = np.zeros(az.shape)
+    nz = az != 0
+    mg[nz] = 20*np.log10(az[nz])
+    return mg
+
+
+def csv_lines(cols):
+    """CSV text of float columns, same as pandas to_csv ( shortest repr, empty for nan )"""
+    rows = np.column_stack(cols).tolist()
+    return ''.join(','.join(repr(v) if v == v else '' for v in row) + '\n' for row in rows)
+
+
+def write_header(fout, fmt, nn):
+    """Header of npy or bin file of nn records of REC_DTYPE"""
+    if fmt == 'npy':
+        np.lib.format.write_array_header_1_0(fout, {'descr': np.lib.format.dtype_to_descr(REC_DTYPE),
+                                                    'fortran_order': False, 'shape': (nn,)})
+    else:
+        fout.write(BIN_MAGIC + np.array(nn, dtype='<u8').tobytes())
+
+
+class ImpWriter(object):
+    """Write impedance spectrum of nn frequencies chunk by chunk.
+    csv : text of freq, imp.real, imp.imag, imp.mag (dB).
+    npy : structured array of REC_DTYPE.
+    npz : arrays 'freq' (float64) and 'imp' (complex128).
+    bin : BIN_MAGIC, number of records (uint64 little endian) and records of REC_DTYPE.
+    npy, npz and bin are written without holding whole spectrum, and npy or bin can be
+    memory mapped by load_result.
+    """
+    def __init__(self, fout, fmt, ff):
+        self.fout = fout
+        self.fmt = fmt
+        nn = len(ff)
+        if fmt == 'csv':
+            fout.write('freq,imp.real,imp.imag,imp.mag\n')
+        elif fmt in ('npy', 'bin'):
+            write_header(fout, fmt, nn)
+        elif fmt == 'npz':
+            self.zf = zipfile.ZipFile(fout, 'w')
+            with self.zf.open('freq.npy', 'w') as f:
+                np.lib.format.write_array(f, np.asarray(ff, dtype='<f8'))
+            self.fimp = self.zf.open('imp.npy', 'w', force_zip64=True)
+            np.lib.format.write_array_header_1_0(self.fimp, {'descr': '<c16', 'fortran_order': False, 'shape': (nn,)})
+
+    def write(self, ff, zz):
+        if self.fmt == 'csv':
+            self.fout.write(csv_lines((ff, np.real(zz), np.imag(zz), magnitude_db(zz))))
+        elif self.fmt == 'npz':
+            self.fimp.write(np.asarray(zz, dtype='<c16').tobytes())
+        else:
+            rec = np.empty(len(ff), dtype=REC_DTYPE)
+            rec['freq'] = ff
+            rec['imp'] = zz
+            self.fout.write(rec.tobytes())
+        self.fout.flush()
+
+    def close(self):
+        if self.fmt == 'npz':
+            self.fimp.close()
+            self.zf.close()
+        self.fout.flush()
+
+
+class GridWriter(object):
+    """Write impedance of temperature x frequency grid, block of temperatures at once.
+    csv : text of temp, freq, imp.real, imp.imag, imp.mag (dB), temperature major.
+    npz : arrays 'temperature', 'freq' (float64) and 'imp' (complex128) of shape
+    (len(temperature), len(freq)).
+    """
+    def __init__(self, fout, fmt, temps, ff):
+        self.fout = fout
+        self.fmt = fmt
+        if fmt == 'csv':
+            fout.write('temp,freq,imp.real,imp.imag,imp.mag\n')
+        elif fmt == 'npz':
+            self.zf = zipfile.ZipFile(fout, 'w')
+            with self.zf.open('temperature.npy', 'w') as f:
+                np.lib.format.write_array(f, np.asarray(temps, dtype='<f8'))
+            with self.zf.open('freq.npy', 'w') as f:
+                np.lib.format.write_array(f, np.asarray(ff, dtype='<f8'))
+            self.fimp = self.zf.open('imp.npy', 'w', force_zip64=True)
+            np.lib.format.write_array_header_1_0(self.fimp, {'descr': '<c16', 'fortran_order': False,
+                                                             'shape': (len(temps), len(ff))})
+        else:
+            raise ValueError('temperature grid is written in csv or npz format')
+
+    def write(self, tc, ff, zz):
+        """zz : impedance of temperatures tc x frequencies ff"""
+        if self.fmt == 'csv':
+            zz = zz.ravel()
+            self.fout.write(csv_lines((np.repeat(tc, len(ff)), np.tile(ff, len(tc)),
+                                       np.real(zz), np.imag(zz), magnitude_db(zz))))
+        else:
+            self.fimp.write(np.asarray(zz, dtype='<c16').tobytes())
+        self.fout.flush()
+
+    def close(self):
+        if self.fmt == 'npz':
+            self.fimp.close()
+            self.zf.close()
+        self.fout.flush()
+
+
+def load_result(path, mmap=True):
+    """Read result written by calcimpy in npy, npz or bin format.
+    Returns (freq, imp). Arrays are memory mapped when mmap is True (npy and bin).
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.npz':
+        with np.load(path) as d:
+            return d['freq'], d['imp']
+    if ext == '.bin':
+        with open(path, 'rb') as f:
+            if f.read(len(BIN_MAGIC)) != BIN_MAGIC:
+                raise ValueError('not a calcimpy binary file : ' + path)
+            nn = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            off = f.tell()
+        if mmap:
+            rec = np.memmap(path, dtype=REC_DTYPE, mode='r', offset=off, shape=(nn,))
+        else:
+            rec = np.fromfile(path, dtype=REC_DTYPE, count=nn, offset=off)
+    else:
+        rec = np.load(path, mmap_mode='r' if mmap else None)
+
+    return rec['freq'], rec['imp']
+
+
+def freq_chunk(mf, Mf, nn, k, n):
+    """ff[k:k + n] of ff = np.linspace(mf, Mf, nn), without whole array"""
+    fc = np.arange(k, min(k + n, nn))*((Mf - mf)/max(nn - 1, 1)) + mf
+    if nn > 1 and k + len(fc) == nn:
+        fc[-1] = Mf
+    return fc
+
+
+def record_offset(path, fmt, nn):
+    """Offset of records in npy or bin file path of nn records, None if it is not such a file"""
+    try:
+        if fmt == 'npy':
+            rec = np.load(path, mmap_mode='r')
+            return rec.offset if rec.dtype == REC_DTYPE and rec.shape == (nn,) else None
+        with open(path, 'rb') as f:
+            head = f.read(len(BIN_MAGIC) + 8)
+            size = f.seek(0, os.SEEK_END)
+        if head[:len(BIN_MAGIC)] != BIN_MAGIC or np.frombuffer(head[len(BIN_MAGIC):], dtype='<u8')[0] != nn:
+            return None
+        off = len(head)
+        return off if size == off + nn*REC_DTYPE.itemsize else None
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def read_checkpoint(path, params):
+    """Start indices of chunks recorded in sidecar path, None if it is missing or made with other params"""
+    try:
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    try:
+        if not lines or json.loads(lines[0]) != params:
+            return None
+    except ValueError:
+        return None
+    done = set()
+    for ln in lines[1:]:
+        wd = ln.split()
+        if len(wd) == 2 and wd[0].isdigit() and wd[1].isdigit():  # last line may be cut by interruption
+            done.add(int(wd[0]))
+    return done
+
+
+def write_checkpointed(output, calc, nn, args, key):
+    """Write spectrum of nn frequencies to output in npy or bin format through memory map.
+    calc(wff) returns impedance of angular frequencies wff.
+    The file is allocated first and filled chunk by chunk, each chunk is flushed and recorded in
+    sidecar output + CHECKPOINT_SUFFIX. Run with the same parameters, simplification, backend
+    and source ( key ) writes only chunks not recorded, otherwise it starts over.
+    Only one chunk is held in memory, caches of imped are cleared after each chunk.
+    """
+    params = {'nn': nn, 'minfreq': imped._mf, 'maxfreq': imped._Mf, 'stepfreq': imped._sf,
+              'temperature': imped._tp, 'radiation': args.radiation, 'legacy': args.legacy,
+              'format': args.format, 'chunk': CHUNK, 'source': key, 'simplify': args.simplify,
+              'simplify_error': args.simplify_error, 'backend': dict(imped.impcore.backends)}
+    side = output + CHECKPOINT_SUFFIX
+    done = read_checkpoint(side, params)
+    off = record_offset(output, args.format, nn) if done is not None else None
+    if off is None:
+        with open(output, 'wb') as f:
+            write_header(f, args.format, nn)
+            off = f.tell()
+            f.truncate(off + nn*REC_DTYPE.itemsize)
+        with open(side, 'w') as f:
+            f.write(json.dumps(params, sort_keys=True) + '\n')
+        done = set()
+    with open(side, 'a') as fs:
+        for k in range(0, nn, CHUNK):
+            if k in done:
+                continue
+            fc = freq_chunk(imped._mf, imped._Mf, nn, k, CHUNK)
+            zz = calc(np.pi*2*fc)
+            with impprof.phase('write'):
+                rec = np.memmap(output, dtype=REC_DTYPE, mode='r+', offset=off + k*REC_DTYPE.itemsize,
+                                shape=(len(fc),))
+                rec['freq'] = fc
+                rec['imp'] = zz
+                rec.flush()
+                del rec
+                fs.write('{0} {1}\n'.format(k, k + len(fc)))
+                fs.flush()
+                os.fsync(fs.fileno())
+            # frequencies of later chunks differ, cached matrices of this chunk are not used again
+            imped.clear_tm_cache()
+            imped.clear_radimp_cache()
+    os.remove(side)
+
+
+def calc_file(path, output, args):
+    """Calculate input impedance of mensur file path and write it to output.
+    output : filename, stdout is used when "-", default *.imp ( *.peak for --peaks,
+    extension of args.format for binary formats ) when "".
+    args : parsed command line arguments.
+    With args.profile, profiling report is written as a JSON line to args.profile_output.
+    """
+    imped.set_backend(args.backend)
+    if not args.profile:
+        write_impedance(path, output, args)
+        return
+    impprof.enable()
+    try:
+        write_impedance(path, output, args)
+    finally:
+        impprof.disable()
+        impprof.write_report(args.profile_output, file=path)
+
+
+def write_impedance(path, output, args):
+    """Body of calc_file"""
+    # read mensur file here, array form is built directly unless legacy per frequency
+    if args.legacy and not args.peaks:
+        mentop = xmn.read_mensur_file(path)
+        s = mentop.df*mentop.df*np.pi/4  # section area
+    else:
+        ma = mencache.load(path) if args.cache else xmn.read_mensur_array(path)
+        s = ma.df[0]*ma.df[0]*np.pi/4  # section area
+    # set calculation conditions, first temperature of sweep
+    temps = parse_temperatures(args.temperature)
+    imped.set_params(temperature=float(temps[0]), minfreq=float(args.minfreq),
+                     maxfreq=float(args.maxfreq), stepfreq=float(args.stepfreq), rad=args.radiation)
+
+    nn = int(round((imped._Mf - imped._mf)/imped._sf)) + 1
+    if args.simplify or args.simplify_error:
+        ma = simplify_mensur(path, ma, nn, args)
+
+    def calc(wff):
+        if args.legacy:
+            return s * np.array([imped.input_impedance(frq, mentop) for frq in wff], dtype=complex)
+        return s * imped.input_impedance_array(wff, ma)
+
+    if args.checkpoint:
+        with open(path, 'rb') as f:
+            key = mencache.source_key(f.read())
+        write_checkpointed(output or os.path.splitext(path)[0] + FORMATS[args.format], calc, nn, args, key)
+        return
+    ff = np.linspace(imped._mf, imped._Mf, nn, endpoint=True)
+    if args.states:
+        write_states(path, output, ma, s, ff, args)
+        return
+    if is_sweep(args.temperature):
+        write_grid(output, ma, s, temps, ff, args, path)
+        return
+    fmt = 'csv' if args.peaks else args.format
+    # set file output
+    mode = 'w' if fmt == 'csv' else 'wb'
+    if output == '-':
+        fout = sys.stdout if fmt == 'csv' else sys.stdout.buffer
+    elif output == '':
+        # default *.imp
+        rt, ext = os.path.splitext(path)
+        fout = open(rt + ('.peak' if args.peaks else FORMATS[fmt]), mode)
+    else:
+        fout = open(output, mode)
+
+    if args.peaks:
+        # resonance table refined from the coarse frequency grid
+        import pandas as pd
+        pk = resonance.find_peaks(ff, ma, ftol=float(args.ftol), min_prominence=float(args.prominence))
+        zz = s * pk['imp']
+        dt = pd.DataFrame()
+        dt['freq'] = pk['freq']
+        dt['type'] = np.where(pk['type'] > 0, 'max', 'min')
+        dt['imp.real'] = np.real(zz)
+        dt['imp.imag'] = np.imag(zz)
+        dt['imp.mag'] = 20*np.log10(np.abs(zz))
+        dt['Q'] = pk['Q']
+        with impprof.phase('write'):
+            dt.to_csv(fout, index=False)
+        if fout is not sys.stdout:
+            fout.close()
+        return
+
+    wr = ImpWriter(fout, fmt, ff)
+    for k in range(0, nn, CHUNK):
+        fc = ff[k:k + CHUNK]
+        zz = calc(np.pi*2*fc)
+        with impprof.phase('write'):
+            wr.write(fc, zz)
+    wr.close()
+    if fout not in (sys.stdout, sys.stdout.buffer):
+        fout.close()
+
+
+def simplify_mensur(path, ma, nn, args):
+    """Simplify ma by --simplify ( diameter tolerance in mm ) or --simplify-error ( impedance
+    error evaluated on up to SIMPLIFY_POINTS frequencies of the range ), report to stderr"""
+    if args.simplify_error:
+        wf = np.pi*2*np.linspace(imped._mf, imped._Mf, min(nn, SIMPLIFY_POINTS))
+        ma, info = mensimplify.simplify_impedance(ma, wf, float(args.simplify_error))
+    else:
+        ma, info = mensimplify.simplify(ma, float(args.simplify)*0.001)
+    msg = '{0}: {1} cells ( {2} removed ), diameter error {3:.3g} mm'.format(path, info.cells, info.removed,
+                                                                              info.error*1000)
+    if info.imp_error is not None:
+        msg += ', impedance error {0:.3g}'.format(info.imp_error)
+    print(msg, file=sys.stderr)
+    return ma
+
+
+def write_states(path, output, ma, s, ff, args):
+    """Write one spectrum per state of table args.states ( see impstate.read_states ),
+    to files "root.label.ext" next to output ( or path when output is "" )."""
+    states = impstate.read_states(args.states)
+    impstate.check_states(ma, [st for label, st in states])
+    rt, ext = os.path.splitext(output or path)
+    outs = []
+    try:
+        for label, st in states:
+            fout = open('{0}.{1}{2}'.format(rt, label, FORMATS[args.format]), 'w' if args.format == 'csv' else 'wb')
+            outs.append((fout, ImpWriter(fout, args.format, ff)))
+        for k in range(0, len(ff), CHUNK):
+            fc = ff[k:k + CHUNK]
+            si = impstate.StateImpedance(np.pi*2*fc, ma)
+            for (fout, wr), (label, st) in zip(outs, states):
+                zz = s * si.impedance(st)
+                with impprof.phase('write'):
+                    wr.write(fc, zz)
+        for fout, wr in outs:
+            wr.close()
+    finally:
+        for fout, wr in outs:
+            fout.close()
+
+
+def write_grid(output, ma, s, temps, ff, args, path):
+    """Write impedance of temperatures temps x frequencies ff to output ( see calc_file ),
+    calculated by imped.input_impedance_grid for blocks of temperatures."""
+    mode = 'w' if args.format == 'csv' else 'wb'
+    if output == '-':
+        fout = sys.stdout if args.format == 'csv' else sys.stdout.buffer
+    else:
+        fout = open(output or os.path.splitext(path)[0] + FORMATS[args.format], mode)
+    wr = GridWriter(fout, args.format, temps, ff)
+    wff = np.pi*2*ff
+    nt = max(1, GRID_POINTS//len(ff))
+    for k in range(0, len(temps), nt):
+        tc = temps[k:k + nt]
+        zz = s * imped.input_impedance_grid(wff, ma, tc)
+        with impprof.phase('write'):
+            wr.write(tc, ff, zz)
+    wr.close()
+    if fout not in (sys.stdout, sys.stdout.buffer):
+        fout.close()
+
+
+def batch_file(path, args):
+    """Calculate one file of batch. Never raises.
+    Returns (path, elapsed time, error message or None)
+    """
+    t0 = time.perf_counter()
+    try:
+        calc_file(path, '', args)
+        err = None
+    except Exception:
+        err = traceback.format_exc(limit=1).strip().splitlines()[-1]
+
+    return path, time.perf_counter() - t0, err
+
+
+def calc_batch(paths, args):
+    """Calculate all paths using args.jobs worker processes.
+    Prints summary to stderr and returns number of failed files.
+    """
+    t0 = time.perf_counter()
+    if args.jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as ex:
+            results = list(ex.map(batch_file, paths, [args]*len(paths)))
+    else:
+        results = [batch_file(path, args) for path in paths]
+
+    nfail = 0
+    for path, t, err in results:
+        if err is None:
+            print('{0:8.3f}s  {1}'.format(t, path), file=sys.stderr)
+        else:
+            nfail += 1
+            print('  FAILED  {0} : {1}'.format(path, err), file=sys.stderr)
+    print('{0} files, {1} failed, {2:.3f}s total'.format(
+          len(results), nfail, time.perf_counter() - t0), file=sys.stderr)
+
+    return nfail
+
+
 def main():
     parser = argparse.ArgumentParser(description='calcimpy : input impedance calculation for air column')
     parser.add_argument('-v', '--version', action='version', version='%(prog)s {}'.format(__version__))
     parser.add_argument('-m', '--minfreq', default='0.0', help='minimum frequency to calculate, default 0 Hz.')
     parser.add_argument('-M', '--maxfreq', default='2000.0', help='maximum frequency to calculate, default 2000 Hz.')
     parser.add_argument('-s', '--stepfreq', default='2.5', help='step frequency for calculation, default 2.5 Hz.')
-    parser.add_argument('-t', '--temperature', default='24.0', help='air temperature, default 24 celsius.')
+    parser.add_argument('-t', '--temperature', default='24.0', help='air temperature, default 24 celsius. List "10,20,30" or range "10:35:0.5" writes impedance of all temperatures x frequencies ( csv or npz ).')
     parser.add_argument('-R', '--radiation', choices=['PIPE', 'BAFFLE', 'NONE'], default='PIPE', help='type of calculation of radiation, default PIPE.')
+    parser.add_argument('-f', '--format', choices=sorted(FORMATS), default='csv', help='output format, csv (*.imp), npy, npz or bin, default csv.')
     parser.add_argument('-o', '--output', default='', help='output filename, stdout is used when "-"')
-    parser.add_argument('filepath')
+    parser.add_argument('-K', '--checkpoint', action='store_true', help='write npy or bin output through memory map chunk by chunk, '
+                        'recording written chunks in *.done. Rerun with the same arguments resumes an interrupted run.')
+    parser.add_argument('-L', '--legacy', action='store_true', help='calculate each frequency one by one (slow), default false.')
+    parser.add_argument('-P', '--peaks', action='store_true', help='output table of impedance maxima and minima (freq, magnitude, Q) instead of spectrum.')
+    parser.add_argument('-S', '--states', default='', help='CSV table of c_ratio of child groups ( fingerings, valves ), one spectrum is written per row as *.label.imp.')
+    parser.add_argument('--ftol', default='0.001', help='frequency tolerance of --peaks, default 0.001 Hz.')
+    parser.add_argument('--prominence', default=str(resonance.PROMINENCE),
+                        help='least prominence of --peaks, default {0} dB.'.format(resonance.PROMINENCE))
+    parser.add_argument('--simplify', default='', metavar='TOL', help='merge adjacent cells into cones within diameter tolerance TOL mm before calculation.')
+    parser.add_argument('--simplify-error', default='', metavar='E', help='merge cells by the largest tolerance whose impedance differs at most E '
+                        '( relative to max |Z| over the frequency range ).')
+    parser.add_argument('-C', '--cache', action='store_true', help='keep parsed mensurs in on-disk cache ( CALCIMPY_CACHE or ~/.cache/calcimpy ).')
+    parser.add_argument('-B', '--backend', choices=impbackend.BACKENDS, default=None, help='backend of core routines, default CALCIMPY_BACKEND or auto. '
+                        'jit runs plain cells by compiled kernel in parallel ( NUMBA_NUM_THREADS ).')
+    parser.add_argument('--profile', action='store_true', help='write profile of calculation phases as a JSON line.')
+    parser.add_argument('--profile-output', default='-', help='file to append profile, stderr is used when "-" ( default ).')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes for multiple files, '
+                        'or worker threads of --serve, default 1.')
+    parser.add_argument('--serve', default='', metavar='ADDRESS', help='run calculation server on "host:port", "port" '
+                        '( localhost ) or "unix:/path/to/socket" instead of calculating files ( see impserver.py ).')
+    parser.add_argument('filepath', nargs='*', help='XMEN files or glob patterns. *.imp is written next to each file.')
 
     args = parser.parse_args()
+    if args.serve:
+        import impserver  # imported only for server
+        imped.set_backend(args.backend)
+        impserver.serve(args.serve, max(1, args.jobs))
+        return
+    if not args.filepath:
+        parser.error('the following arguments are required: filepath')
+    if args.peaks and args.format != 'csv':
+        parser.error('--peaks is written only in csv format')
+    if args.states and (args.peaks or args.legacy or args.output == '-'):
+        parser.error('--states can not be used with --peaks, --legacy or stdout')
+    if (args.simplify or args.simplify_error) and args.legacy:
+        parser.error('--simplify can not be used with --legacy')
+    if args.checkpoint and (args.format not in ('npy', 'bin') or args.output == '-' or args.peaks
+                            or args.states or is_sweep(args.temperature)):
+        parser.error('--checkpoint writes a file in npy or bin format, without --peaks, --states or temperature sweep')
+    if is_sweep(args.temperature) and (args.peaks or args.legacy or args.states or args.format not in ('csv', 'npz')):
+        parser.error('temperature sweep is written in csv or npz format, without --peaks, --legacy or --states')
 
-    path = args.filepath
-    if path:
-        # read mensur file here
-        mentop = xmn.read_mensur_file(path)
-        # set calculation conditions
-        imped.set_params(temperature=float(args.temperature), minfreq=float(args.minfreq),
-                         maxfreq=float(args.maxfreq), stepfreq=float(args.stepfreq), rad=args.radiation)
-
-        nn = (imped._Mf - imped._mf)/imped._sf + 1
-        ff = np.linspace(imped._mf, imped._Mf, nn, endpoint=True)
-        wff = np.pi*2*ff
-        # set file output
-        if args.output == '-':
-            fout = sys.stdout
-        elif args.output == '':
-            # default *.imp
-            rt, ext = os.path.splitext(path)
-            fout = open(rt + '.imp', 'w')
-        else:
-            fout = open(args.output, 'w')
-
-        s = mentop.df*mentop.df*np.pi/4  # section area
-        zz = [s * imped.input_impedance(frq, mentop) for frq in wff]
-        zr = np.real(zz)
-        zi = np.imag(zz)
-        mg = [0 if z == 0 else 20*np.log10(np.abs(z)) for z in zz]
+    paths = []
+    for p in args.filepath:
+        paths.extend(sorted(glob.glob(p)) or [p])
 
-        dt = pd.DataFrame()
-        dt['freq'] = ff
-        dt['imp.real'] = zr
-        dt['imp.imag'] = zi
-        dt['imp.mag'] = mg
+    if len(paths) == 1 and args.jobs == 1:
+        try:
+            calc_file(paths[0], args.output, args)
+        except BrokenPipeError:
+            # reader of stdout has gone ( e.g. head )
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+    else:
+        if args.output:
+            parser.error('--output can not be used with multiple files')
+        if calc_batch(paths, args):
+            sys.exit(1)
 
-        dt.to_csv(fout, index=False)
-        fout.close()
 
 if __name__ == "__main__":
         main()
@@ -9,18 +9,70 @@ import numpy as np
 
 import xmensur
 import imped
+import impprof
 
-__version__ = '1.0.0'
+__version__ = '1.1.0'
+
+
+def parse_freqs(s):
+    """Frequencies of --freq, a value "440", list "220,440,880" or range "start:stop:step" ( stop included )"""
+    if ':' in s:
+        start, stop, step = (float(v) for v in s.split(':'))
+        return np.linspace(start, stop, int(round((stop - start)/step)) + 1)
+    return np.array([float(v) for v in s.split(',')])
+
+
+def write_pressure(fout, ma, pr, j=0):
+    """Write L, D, dBSPL of frequency j of PressureProfile pr, same as xmensur.print_pressure of sliced mensur"""
+    def db(p):
+        return 20*np.log10(np.abs(p)/2e-5)
+    s = 'L,D,dBSPL'
+    fout.write(s + '\n')
+    for k in range(len(pr.cell)):
+        p = db(pr.pi[j, k])
+        ss = '{0:.3f},{1:.3f},{2:.3f}'.format(pr.x[k]*1000, pr.df[k]*1000, p)
+        if s != ss:
+            fout.write(ss + '\n')
+            s = ss
+        if ma.child[pr.cell[k]] >= 0 and (k == 0 or pr.cell[k - 1] != pr.cell[k]):
+            fout.write('{0:.3f},0,{1:.3f}\n'.format(pr.x[k]*1000, p))
+            fout.write(ss + '\n')
+    # pressure at output end
+    ss = '{0:.3f},{1:.3f},{2:.3f}'.format((pr.x[-1] + pr.r[-1])*1000, pr.df[-1]*1000, db(pr.po[j, -1]))
+    if s != ss:
+        fout.write(ss + '\n')
+
+
+def write_map_csv(fout, pr, ff):
+    """Write pressure map as text, L, D and dBSPL of each frequency at input of each slice and output end"""
+    x = np.append(pr.x, pr.x[-1] + pr.r[-1])
+    d = np.append(pr.df, pr.db[-1])
+    with np.errstate(divide='ignore'):
+        db = 20*np.log10(np.abs(np.column_stack((pr.pi, pr.po[:, -1])))/2e-5)
+    fout.write('L,D,' + ','.join(repr(float(f)) for f in ff) + '\n')
+    for k in range(len(x)):
+        fout.write('{0:.3f},{1:.3f},'.format(x[k]*1000, d[k]*1000) + ','.join('{0:.3f}'.format(v) for v in db[:, k]) + '\n')
+
+
+def write_map_npz(fout, pr, ff):
+    """Write pressure map as npz, arrays freq, cell ( cell index of each slice ), x, df, db, r ( m )
+    and complex pi, ui, po, uo of shape (freq, slice)"""
+    np.savez(fout, freq=ff, **pr._asdict())
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='pressure calculation for air column')
     parser.add_argument('-v', '--version', action='version', version='%(prog)s {}'.format(__version__))
-    parser.add_argument('-f', '--freq', default='440.0', help='frequency to calculate, default 440 Hz.')
+    parser.add_argument('-f', '--freq', default='440.0', help='frequency to calculate, default 440 Hz. '
+                        'list "220,440" or range "100:2000:2.5" calculates a map of all of them.')
     parser.add_argument('-p', '--pressure', default='60.0', help='pressure at starting point, default 60dBSPL.')
     parser.add_argument('-T', '--from_tail', action='store_true', help='calculate from tail if true, default false.')
     parser.add_argument('-o', '--output', default='', help='output filename, stdout is used when "-"')
-    parser.add_argument('-s', '--step', default='1', help='slice mensur by step, default 1mm.')
+    parser.add_argument('-F', '--format', choices=['csv', 'npz'], default='csv',
+                        help='output format of map, csv (*.prs) or npz of complex arrays, default csv.')
+    parser.add_argument('-s', '--step', default='1', help='evaluate pressure at every step inside cells, default 1mm. 0 for cell ends only.')
+    parser.add_argument('--profile', action='store_true', help='write profile of calculation phases as a JSON line.')
+    parser.add_argument('--profile-output', default='-', help='file to append profile, stderr is used when "-" ( default ).')
     parser.add_argument('filepath')
 
     args = parser.parse_args()
@@ -28,36 +80,43 @@ if __name__ == "__main__":
     path = args.filepath
 
     if path:
-        mentop = xmensur.read_mensur_file(path)
+        if args.profile:
+            impprof.enable()
+        ma = xmensur.read_mensur_array(path)
 
         stp = float(args.step)/1000.0  # mm unit
-        xmensur.slice_mensur(mentop, stp)
-
-        # calc impedance first
-        fq = float(args.freq)
-        wf = np.pi*2*fq
+        ff = parse_freqs(args.freq)
         p0 = 2.0e-5  # 20 micro Pa is a basic pressure for dBSPL
-        imped.input_impedance(wf, mentop)
-
         pdB = float(args.pressure)
         p = p0 * np.power(10.0, pdB/20.0)  # dBSPL -> Pa
 
-        # calc pressure from end position
-        imped.calc_pressure(wf, mentop, endp=p, from_tail=args.from_tail)
+        # calc pressure from end position, slices by step are not made but evaluated on the fly
+        pr = imped.pressure_profile(np.pi*2*ff, ma, p, stp, from_tail=args.from_tail)
 
         # set file output
+        mode = 'w' if args.format == 'csv' else 'wb'
         if args.output == '-':
-            fout = sys.stdout
+            fout = sys.stdout if args.format == 'csv' else sys.stdout.buffer
         elif args.output == '':
             # default *.prs
             rt, ext = os.path.splitext(path)
-            fout = open(rt + '.prs', 'w')
+            fout = open(rt + ('.prs' if args.format == 'csv' else '.npz'), mode)
         else:
-            fout = open(args.output, 'w')
+            fout = open(args.output, mode)
 
-        sys.stdout = fout
+        with impprof.phase('write'):
+            if args.format == 'csv':
+                fout.write('#{0}, freq: {1}(Hz), p: {2}(dBSPL), from_tail: {3}\n'.format(
+                           path, args.freq, args.pressure, args.from_tail))
+                if len(ff) == 1:
+                    write_pressure(fout, ma, pr)
+                else:
+                    write_map_csv(fout, pr, ff)
+            else:
+                write_map_npz(fout, pr, ff)
+        if fout not in (sys.stdout, sys.stdout.buffer):
+            fout.close()
 
-        # print pressure
-        print('#{0}, freq: {1}(Hz), p: {2}(dBSPL), from_tail: {3}'.format(
-               path, args.freq, args.pressure, args.from_tail))
-        xmensur.print_pressure(mentop)
+        if args.profile:
+            impprof.disable()
+            impprof.write_report(args.profile_output, file=path)
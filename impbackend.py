@@ -0,0 +1,166 @@
+"""
+impbackend
+selection of compute backend for impcore routines.
+
+aot   : module compiled by "python impcore.py" (numba.pycc)
+jit   : numba.njit(cache=True), compiled on first call
+numpy : plain python/numpy source of impcore.py
+auto  : aot if compiled module exists, otherwise numpy. Scalar routines are not jit
+        compiled automatically, importing numba and loading its cache take about
+        two seconds, more than short jobs spend in these routines. KERNEL_ROUTINES
+        are taken from jit when numba is installed and its cache is warm ( after a run
+        with jit, see jit_cache_warm ), and imped uses them only for chains of at
+        least kernel_min_work cells*frequencies, so short jobs never import numba.
+        auto therefore rarely uses them: the cache is warm only after a run with
+        jit and while impcore.py is unchanged, and a chain needs about 500 cells
+        at 8001 frequencies.
+Backends apply to scalar routines used by per frequency calculation. Array routines
+are always numpy; they are already vectorized, and compiled versions raise on
+complex division by zero at wf = 0.
+KERNEL_ROUTINES run whole chains of cells in native code. jit compiles them with
+parallel loops over frequencies ( NUMBA_NUM_THREADS threads ), aot has them serial if
+the module was built with them. They are None for numpy, and imped uses arrays instead.
+Runs of fewer than kernel_min_cells distinct cells between joints are left to the
+cached matrices of numpy, they were slower by the kernel ( benchmark.py backends,
+nest bore 0.89x of numpy before, about even now; taper x2.3 ).
+Environment variable CALCIMPY_BACKEND gives the default.
+"""
+import os
+import sys
+import importlib.machinery
+import importlib.util
+import types
+
+BACKENDS = ('auto', 'aot', 'jit', 'numpy')
+SCALAR_ROUTINES = ('calc_transmission', 'zo2zi')
+ARRAY_ROUTINES = ('calc_transmission_array', 'zo2zi_array', 'calc_transmission_grad_array')
+KERNEL_ROUTINES = ('propagate_kernel',)
+KERNEL_MIN_WORK = 4000000  # cells*frequencies of a chain worth loading jit kernel by auto, about 2 s of numpy
+KERNEL_MIN_CELLS = 4  # distinct cells between joints given to kernel, fewer are faster by cached matrices
+
+_dir = os.path.dirname(os.path.abspath(__file__))
+_loaded = {}  # backend name -> namespace
+
+
+def source_module():
+    """impcore.py loaded as source, even if compiled module shadows it"""
+    if 'source' not in _loaded:
+        spec = importlib.util.spec_from_file_location('impcore_source', os.path.join(_dir, 'impcore.py'))
+        mod = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = mod  # numba cache refers to the module by name
+        spec.loader.exec_module(mod)
+        _loaded['source'] = mod
+    return _loaded['source']
+
+
+def aot_module():
+    """compiled impcore module next to impcore.py, None if not built"""
+    if 'aot_module' not in _loaded:
+        mod = None
+        for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+            path = os.path.join(_dir, 'impcore' + suffix)
+            if os.path.exists(path):
+                loader = importlib.machinery.ExtensionFileLoader('impcore', path)
+                spec = importlib.util.spec_from_loader('impcore', loader)
+                mod = importlib.util.module_from_spec(spec)
+                loader.exec_module(mod)
+                break
+        _loaded['aot_module'] = mod
+    return _loaded['aot_module']
+
+
+def has_numba():
+    return importlib.util.find_spec('numba') is not None
+
+
+def jit_cache_warm():
+    """True if numba cache of every KERNEL_ROUTINES is in __pycache__ next to impcore.py
+    and newer than it, so jit loads them without compiling"""
+    src = source_module()
+    tag = 'py{0}{1}'.format(*sys.version_info[:2])
+    try:
+        mtime = os.path.getmtime(src.__file__)
+        for rn in KERNEL_ROUTINES:
+            index = 'impcore.{0}-{1}.{2}.nbi'.format(rn, getattr(src, rn).__code__.co_firstlineno, tag)
+            if os.path.getmtime(os.path.join(_dir, '__pycache__', index)) < mtime:
+                return False
+    except OSError:
+        return False
+    return True
+
+
+class LazyJit(object):
+    """Routine compiled by numba on first call.
+    Compiled function replaces this object in namespace ns, so later calls have no overhead.
+    """
+    def __init__(self, ns, name, func, parallel=False):
+        self.ns = ns
+        self.name = name
+        self.func = func
+        self.parallel = parallel
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args):
+        import numba
+        if self.parallel:
+            # copy of the routine whose globals see numba.prange, impcore source module is unchanged
+            func = self.func
+            glb = dict(func.__globals__, prange=numba.prange)
+            func = types.FunctionType(func.__code__, glb, func.__name__, func.__defaults__, func.__closure__)
+            func.__qualname__, func.__doc__ = self.func.__qualname__, self.func.__doc__
+            jitted = numba.njit(cache=True, parallel=True, nogil=True)(func)
+        else:
+            jitted = numba.njit(cache=True)(self.func)
+        setattr(self.ns, self.name, jitted)
+        return jitted(*args)
+
+
+def load(name=None):
+    """Namespace of impcore routines by backend name (see BACKENDS).
+    Attribute 'name' tells selected backend and 'backends' the one used for each routine,
+    'kernel_min_work' the least cells*frequencies of a chain given to KERNEL_ROUTINES,
+    'kernel_min_cells' the least distinct cells between joints given to them.
+    Routines missing in an old compiled module are taken from the source.
+    """
+    if name is None:
+        name = os.environ.get('CALCIMPY_BACKEND', 'auto')
+    if name not in BACKENDS:
+        raise ValueError('unknown backend : {0}, one of {1}'.format(name, ', '.join(BACKENDS)))
+    if name in _loaded:
+        return _loaded[name]
+    key = name
+
+    src = source_module()
+    aot = aot_module() if name in ('auto', 'aot') else None
+    if name == 'aot' and aot is None:
+        raise ImportError('compiled impcore module is not found, run "python impcore.py" in ' + _dir)
+    if name == 'jit' and not has_numba():
+        raise ImportError('numba is required for jit backend')
+    warm = False
+    if name == 'auto':
+        name = 'aot' if aot is not None else 'numpy'
+        warm = name == 'numpy' and has_numba() and jit_cache_warm()
+
+    ns = types.SimpleNamespace(name=name, backends={}, kernel_min_work=KERNEL_MIN_WORK if warm else 0,
+                               kernel_min_cells=KERNEL_MIN_CELLS)
+    for rn in SCALAR_ROUTINES + ARRAY_ROUTINES:
+        if rn in ARRAY_ROUTINES or name == 'numpy' or (name == 'aot' and not hasattr(aot, rn)):
+            func, kind = getattr(src, rn), 'numpy'
+        elif name == 'aot':
+            func, kind = getattr(aot, rn), 'aot'
+        else:
+            func, kind = LazyJit(ns, rn, getattr(src, rn)), 'jit'
+        setattr(ns, rn, func)
+        ns.backends[rn] = kind
+    for rn in KERNEL_ROUTINES:
+        if name == 'jit' or warm:
+            func, kind = LazyJit(ns, rn, getattr(src, rn), parallel=True), 'jit'
+        elif name == 'aot' and hasattr(aot, rn):
+            func, kind = getattr(aot, rn), 'aot'
+        else:
+            func, kind = None, 'numpy'
+        setattr(ns, rn, func)
+        ns.backends[rn] = kind
+    _loaded[key] = ns
+
+    return ns
@@ -1,22 +1,33 @@
 """
 impcore.py
 core calculation routines for imped
+Run this file to build the compiled module of scalar routines by numba.pycc.
+Array routines are vectorized by numpy and not compiled ( numba raises on complex
+division by zero at wf = 0 ). imped uses these routines through impbackend.
+propagate_kernel is the exception, it skips wf = 0 and runs a whole chain of cells
+for each frequency in native code, in parallel over frequencies when compiled by jit.
 """
 
 import numpy as np
-from numba import c16, f8
-from numba.pycc import CC
 
-cc = CC('impcore')
-cc.verbose = True
+if __name__ == '__main__':
+    from numba.pycc import CC
+    cc = CC('impcore')
+    cc.verbose = True
+    export = cc.export
+else:
+    def export(name, sig):
+        """numba is imported only for building"""
+        return lambda func: func
 
 GMM = 1.4  # specific head ratio
 PR = 0.72  # Prandtl number
 PI = np.pi
 Wdmp = (1+(GMM-1)/np.sqrt(PR))
+prange = range  # numba.prange in the copy of propagate_kernel compiled in parallel ( impbackend.LazyJit )
 
 
-@cc.export('calc_transmission', 'c16[:,:](f8,f8,f8,f8,f8,f8,f8)')
+@export('calc_transmission', 'c16[:,:](f8,f8,f8,f8,f8,f8,f8)')
 def calc_transmission(wf, df, db, r, c0, rhoc0, nu):
     """Calculate transmission matrix for a given mensur cell.
     Always call with r > 0.
@@ -28,7 +39,7 @@ def calc_transmission(wf, df, db, r, c0, rhoc0, nu):
     cc = np.cos(x)
     ss = np.sin(x)
 
-    tm = np.empty((2, 2), dtype=c16)
+    tm = np.empty((2, 2), dtype=np.complex128)
 
     if df != db:
         # taper
@@ -50,7 +61,7 @@ def calc_transmission(wf, df, db, r, c0, rhoc0, nu):
     return tm
 
 
-@cc.export('zo2zi', 'c16(c16[:,:],c16)')
+@export('zo2zi', 'c16(c16[:,:],c16)')
 def zo2zi(tm, zo):
     if not np.isinf(zo):
         zi = (tm[0, 0]*zo + tm[0, 1])/(tm[1, 0]*zo + tm[1, 1])
@@ -62,5 +73,156 @@ def zo2zi(tm, zo):
 
     return zi
 
+
+def calc_transmission_array(wf, df, db, r, c0, rhoc0, nu):
+    """Calculate transmission matrices of a mensur cell for frequency array wf.
+    Returns array of shape (len(wf), 2, 2). Always call with r > 0.
+    """
+    d = (df + db)*0.5
+    aa = Wdmp * np.sqrt(2*wf*nu)/c0/d  # wall dumping factor
+    k = np.sqrt((wf/c0)*(wf/c0 - 2*(-1+1j)*aa))  # complex wave number including wall dumping
+    x = k * r
+    cc = np.cos(x)
+    ss = np.sin(x)
+
+    tm = np.empty((wf.shape[0], 2, 2), dtype=np.complex128)
+
+    if df != db:
+        # taper
+        r1 = df*0.5
+        r2 = db*0.5
+        dr = r2-r1
+
+        tm[:, 0, 0] = (r2*x*cc - dr*ss)/(r1*x)
+        tm[:, 0, 1] = 1j*rhoc0*ss/(PI*r1*r2)
+        tm[:, 1, 0] = -1j*PI*(dr*dr*x*cc - (dr*dr + x*x*r1*r2)*ss)/(x*x*rhoc0)
+        tm[:, 1, 1] = (r1*x*cc + dr*ss)/(r2*x)
+    else:
+        # straight
+        s1 = PI/4*df*df
+        tm[:, 0, 0] = cc
+        tm[:, 1, 1] = cc
+        tm[:, 0, 1] = 1j*rhoc0*ss/s1
+        tm[:, 1, 0] = 1j*s1*ss/rhoc0
+
+    return tm
+
+
+def zo2zi_array(tm, zo):
+    """Array version of zo2zi. tm has shape (n, 2, 2), zo has shape (n,)."""
+    zi = np.empty(zo.shape[0], dtype=np.complex128)
+    inf = np.isinf(zo)
+    fin = ~inf
+    zf = zo[fin]
+    zi[fin] = (tm[fin, 0, 0]*zf + tm[fin, 0, 1])/(tm[fin, 1, 0]*zf + tm[fin, 1, 1])
+    t00 = tm[inf, 0, 0]
+    t10 = tm[inf, 1, 0]
+    zi[inf] = np.where(t10 != 0, t00/np.where(t10 != 0, t10, 1), np.inf)
+
+    return zi
+
+
+@export('propagate_kernel', 'c16[:](f8[:],f8[:],f8[:],f8[:],i8[:],c16[:],f8[:],f8[:],f8[:])')
+def propagate_kernel(wf, df, db, r, n, zo, c0, rhoc0, nu):
+    """Input impedance of chain of cells df, db, r ( r > 0, in order from input end ),
+    each repeated n times, with output impedance zo, for frequency array wf.
+    c0, rhoc0 and nu are arrays along wf.
+    Calculated frequency by frequency through all cells without temporary arrays,
+    loop of frequencies is parallel when compiled with numba.prange. zi is 0 at wf = 0.
+    """
+    nf = wf.shape[0]
+    zi = np.empty(nf, dtype=np.complex128)
+    for k in prange(nf):
+        w = wf[k]
+        if w == 0:
+            zi[k] = 0
+            continue
+        kw = w/c0[k]
+        cw = Wdmp*np.sqrt(2*w*nu[k])/c0[k]
+        z = zo[k]
+        for i in range(r.shape[0] - 1, -1, -1):
+            aa = cw*2/(df[i] + db[i])  # wall dumping factor
+            x = np.sqrt(kw*(kw - 2*(-1+1j)*aa))*r[i]
+            m = n[i]
+            if df[i] == db[i]:
+                x *= m  # repeated straight cells are one cell of total length
+                m = 1
+            cc = np.cos(x)
+            ss = np.sin(x)
+            if df[i] != db[i]:
+                # taper
+                r1 = df[i]*0.5
+                r2 = db[i]*0.5
+                dr = r2-r1
+                t00 = (r2*x*cc - dr*ss)/(r1*x)
+                t01 = 1j*rhoc0[k]*ss/(PI*r1*r2)
+                t10 = -1j*PI*(dr*dr*x*cc - (dr*dr + x*x*r1*r2)*ss)/(x*x*rhoc0[k])
+                t11 = (r1*x*cc + dr*ss)/(r2*x)
+            else:
+                # straight
+                s1 = PI/4*df[i]*df[i]
+                t00 = cc
+                t11 = cc
+                t01 = 1j*rhoc0[k]*ss/s1
+                t10 = 1j*s1*ss/rhoc0[k]
+            for j in range(m):
+                if not np.isinf(z):
+                    z = (t00*z + t01)/(t10*z + t11)
+                elif t10 != 0:
+                    z = t00/t10
+        zi[k] = z
+    return zi
+
+
+def calc_transmission_grad_array(wf, df, db, r, c0, rhoc0, nu):
+    """Derivatives of transmission matrices of a mensur cell by df, db and r.
+    Returns array of shape (3, len(wf), 2, 2). Always call with r > 0.
+    General taper formula is used, which is also valid for df == db.
+    """
+    r1 = df*0.5
+    r2 = db*0.5
+    dr = r2 - r1
+    d = r1 + r2
+    aa = Wdmp * np.sqrt(2*wf*nu)/c0/d  # wall dumping factor
+    kw = wf/c0
+    k = np.sqrt(kw*(kw - 2*(-1+1j)*aa))
+    x = k * r
+    cc = np.cos(x)
+    ss = np.sin(x)
+    sx = ss/x
+    dsx = (cc - sx)/x  # d(sin(x)/x)/dx
+    ef = cc/x - ss/(x*x)
+    def_ = (-ss*x - cc)/(x*x) - (cc*x - 2*ss)/(x*x*x)  # d(cos(x)/x - sin(x)/x^2)/dx
+    g = -1j*PI/rhoc0
+    h = 1j*rhoc0/PI
+
+    # partial derivatives by r1, r2 (x fixed) and by x
+    t1 = np.empty((wf.shape[0], 2, 2), dtype=np.complex128)
+    t2 = np.empty((wf.shape[0], 2, 2), dtype=np.complex128)
+    tx = np.empty((wf.shape[0], 2, 2), dtype=np.complex128)
+    t1[:, 0, 0] = r2/(r1*r1)*(sx - cc)
+    t2[:, 0, 0] = (cc - sx)/r1
+    tx[:, 0, 0] = -r2/r1*ss - dr/r1*dsx
+    t1[:, 0, 1] = -h*ss/(r1*r1*r2)
+    t2[:, 0, 1] = -h*ss/(r1*r2*r2)
+    tx[:, 0, 1] = h*cc/(r1*r2)
+    t1[:, 1, 0] = g*(-2*dr*ef - r2*ss)
+    t2[:, 1, 0] = g*(2*dr*ef - r1*ss)
+    tx[:, 1, 0] = g*(dr*dr*def_ - r1*r2*cc)
+    t1[:, 1, 1] = (cc - sx)/r2
+    t2[:, 1, 1] = r1/(r2*r2)*(sx - cc)
+    tx[:, 1, 1] = -r1/r2*ss + dr/r2*dsx
+
+    dxd = r*(-1+1j)*kw*aa/(k*d)  # dx/dd, d = r1 + r2
+    gr = np.empty((3, wf.shape[0], 2, 2), dtype=np.complex128)
+    for i in range(2):
+        for j in range(2):
+            gr[0, :, i, j] = 0.5*(t1[:, i, j] + dxd*tx[:, i, j])
+            gr[1, :, i, j] = 0.5*(t2[:, i, j] + dxd*tx[:, i, j])
+            gr[2, :, i, j] = k*tx[:, i, j]
+
+    return gr
+
+
 if __name__ == '__main__':
     cc.compile()
@@ -1,12 +1,16 @@
 """
 xmensur calculation module
 """
+from collections import namedtuple, OrderedDict
+import hashlib
+import threading
+import weakref
 import numpy as np
-from scipy import special
 
 import xmensur
-# from numba import jit, c16, f8
-import impcore
+import impbackend
+
+impcore = impbackend.load()  # core routines of selected backend
 
 __version__ = '1.1.0'
 
@@ -28,46 +32,260 @@ _mu = (18.2 + 0.0456*(_tp - 25)) * 1.0e-6  # viscosity constant. Linear approxim
 _nu = _mu/_rho  # dynamic viscous constant.
 _rad_calc = 'PIPE'  # radiation type
 
+# immutable set of physical constants and radiation type used by calculation routines.
+CalcContext = namedtuple('CalcContext', ['tp', 'c0', 'rho', 'rhoc0', 'mu', 'nu', 'rad_calc'])
+
+
+def calc_context(temperature=24.0, rad='PIPE'):
+    """Make CalcContext for given air temperature and radiation type"""
+    c0 = 331.45 * np.sqrt(temperature / 273.16 + 1)
+    rho = 1.2929 * (273.16 / (273.16 + temperature))
+    mu = (18.2 + 0.0456*(temperature - 25)) * 1.0e-6  # viscosity constant. linear approximation from Scientific Dictionary.
+    return CalcContext(temperature, c0, rho, rho*c0, mu, mu/rho, rad)
+
+
+# default context used when ctx is not given
+_ctx = calc_context(_tp, _rad_calc)
+
+
+def grid_context(temperatures, nf, rad='PIPE'):
+    """CalcContext of temperature x frequency grid flattened to one axis.
+    Constants are read only arrays of len(temperatures)*nf, each temperature repeated nf times,
+    to be used with frequency array tiled len(temperatures) times ( see input_impedance_grid ).
+    """
+    tp = np.repeat(np.asarray(temperatures, dtype=float), nf)
+    tp.setflags(write=False)
+    ctx = calc_context(tp, rad)
+    for a in ctx[1:-1]:
+        a.setflags(write=False)
+    return ctx
+
 
 def set_params(temperature, minfreq, maxfreq, stepfreq, rad):
     """Set parameter and update some constants"""
-    global _tp, _mf, _Mf, _sf, _c0, _rho, _rhoc0, _mu, _nu, _rad_calc
+    global _tp, _mf, _Mf, _sf, _c0, _rho, _rhoc0, _mu, _nu, _rad_calc, _ctx
     _tp = temperature
     _mf = minfreq
     _Mf = maxfreq
     _sf = stepfreq
     _rad_calc = rad
     # calculation follows
-    _c0 = 331.45 * np.sqrt(_tp / 273.16 + 1)
-    _rho = 1.2929 * (273.16 / (273.16 + _tp))
-    _rhoc0 = _rho * _c0
-    _mu = (18.2 + 0.0456*(_tp - 25)) * 1.0e-6  # viscosity constant. linear approximation from Scientific Dictionary.
-    _nu = _mu/_rho  # dynamic viscous constant.
+    _ctx = calc_context(temperature, rad)
+    _c0 = _ctx.c0
+    _rho = _ctx.rho
+    _rhoc0 = _ctx.rhoc0
+    _mu = _ctx.mu
+    _nu = _ctx.nu
 
 
 def get_params():
     return _tp, _mf, _Mf, _sf, _c0, _rho, _rhoc0, _mu, _nu, _rad_calc
 
 
-def radimp(wf, dia):
+def get_context():
+    """Returns default CalcContext set by set_params"""
+    return _ctx
+
+
+def set_backend(name=None):
+    """Select backend of core routines, one of impbackend.BACKENDS.
+    None uses CALCIMPY_BACKEND environment variable or 'auto'.
+    """
+    global impcore
+    impcore = impbackend.load(name)
+
+
+class ArrayCache(object):
+    """Thread safe LRU cache of read only arrays, bounded by total bytes"""
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.items = OrderedDict()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            a = self.items.get(key)
+            if a is not None:
+                self.items.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return a
+
+    def put(self, key, a):
+        a.setflags(write=False)
+        with self.lock:
+            if key not in self.items:
+                self.items[key] = a
+                self.nbytes += a.nbytes
+            while self.nbytes > self.maxbytes and len(self.items) > 1:
+                k, b = self.items.popitem(last=False)
+                self.nbytes -= b.nbytes
+        return a
+
+    def info(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.items), 'bytes': self.nbytes}
+
+
+# digests of read only frequency arrays, id -> (weakref, digest)
+_freq_keys = {}
+
+
+def freq_key(wf):
+    """Digest of frequency array used in cache keys.
+    Digest of read only array is remembered while the array is alive.
+    """
+    ro = not wf.flags.writeable
+    if ro:
+        e = _freq_keys.get(id(wf))
+        if e is not None and e[0]() is wf:
+            return e[1]
+    d = hashlib.sha1(np.ascontiguousarray(wf).data).digest()
+    if ro:
+        i = id(wf)
+        _freq_keys[i] = (weakref.ref(wf, lambda r: _freq_keys.pop(i, None)), d)
+    return d
+
+
+def ctx_key(ctx):
+    """Hashable key of physical constants of ctx used in cache keys.
+    Constants of grid context are arrays, which are keyed by digest of temperatures.
+    """
+    if np.ndim(ctx.tp) > 0:
+        return ('grid', freq_key(ctx.tp))
+    return (ctx.c0, ctx.rhoc0, ctx.nu)
+
+
+# LRU cache of radiation impedance arrays.
+# key is (dia, ctx_key, rad_calc, table step, digest of frequency array)
+RADIMP_CACHE_BYTES = 64 * 2**20
+_radimp_cache = ArrayCache(RADIMP_CACHE_BYTES)
+
+# LRU cache of transmission matrices of mensur cells.
+# key is (df, db, r, ctx_key, power, digest of frequency array)
+TM_CACHE_BYTES = 256 * 2**20
+_tm_cache = ArrayCache(TM_CACHE_BYTES)
+_tm_stats = {'collapsed': 0}  # number of cells saved by matrix powering
+
+
+# ka indexed table of radiation functions, (step, xmax, R(x)/x^2, X(x)/x)
+_rad_table = None
+
+
+def set_radimp_table(step=1.0e-3, xmax=200.0):
+    """Use interpolation table of radiation functions indexed by x = k*dia instead of special functions.
+    R(x)/x^2 and X(x)/x are sampled by step up to xmax and linearly interpolated.
+    Relative error of each of real and imaginary part is less than 0.15*step**2
+    (1.5e-7 for default step). x beyond xmax is calculated directly.
+    step=None disables the table.
+    """
+    global _rad_table
+    from scipy import special
+    if step is None:
+        _rad_table = None
+    else:
+        xt = np.arange(0, xmax + step, step)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g = (1 - special.jn(1, xt)/xt*2)/(xt*xt)
+            h = special.struve(1, xt)/xt*2/xt
+        g[0] = 1/8  # limit at x = 0
+        h[0] = 4/(3*PI)
+        _rad_table = (step, xt[-1], g, h)
+    clear_radimp_cache()
+
+
+def clear_radimp_cache():
+    _radimp_cache.clear()
+
+
+def radimp_cache_info():
+    """Returns dict of hits, misses, size and bytes of radiation impedance cache"""
+    return _radimp_cache.info()
+
+
+def clear_tm_cache():
+    _tm_cache.clear()
+    _tm_stats['collapsed'] = 0
+
+
+def tm_cache_info():
+    """Returns dict of hits, misses, size and bytes of transmission matrix cache,
+    and number of cells collapsed by matrix powering.
+    """
+    return dict(_tm_cache.info(), **_tm_stats)
+
+
+def transmission_array(wf, df, db, r, ctx, power=1):
+    """Transmission matrices (len(wf), 2, 2) of a mensur cell with r > 0, raised to power
+    for a run of identical cells. Results are cached, so returned array is read only.
+    """
+    key = (df, db, r, ctx_key(ctx), power, freq_key(wf))
+    tm = _tm_cache.get(key)
+    if tm is None:
+        if power == 1:
+            tm = impcore.calc_transmission_array(wf, df, db, r, ctx.c0, ctx.rhoc0, ctx.nu)
+        else:
+            tm = np.linalg.matrix_power(transmission_array(wf, df, db, r, ctx), power)
+        tm = _tm_cache.put(key, tm)
+    if power > 1:
+        with _tm_cache.lock:
+            _tm_stats['collapsed'] += power - 1
+    return tm
+
+
+def radiation_functions(x):
+    """Real and imaginary part of baffled piston radiation impedance normalized by rhoc0/s,
+    for array x = k*dia > 0. Interpolation table is used if it is set.
+    """
+    from scipy import special  # imported on demand for fast startup
+    tbl = _rad_table
+    if tbl is None:
+        re = 1 - special.jn(1, x)/x*2  # 1st order bessel function.
+        im = special.struve(1, x)/x*2  # 1st order struve function.
+    else:
+        step, xmax, g, h = tbl
+        xt = np.arange(len(g))*step
+        re = np.interp(x, xt, g)*x*x
+        im = np.interp(x, xt, h)*x
+        out = x > xmax
+        if out.any():
+            xo = x[out]
+            re[out] = 1 - special.jn(1, xo)/xo*2
+            im[out] = special.struve(1, xo)/xo*2
+
+    return re, im
+
+
+def radimp(wf, dia, ctx=None):
     """calculatio radiation impedance for each frequency"""
+    if ctx is None:
+        ctx = _ctx
     if not wf > 0:
         return 0
 
     if dia > 0:
-        if _rad_calc == 'NONE':
+        if ctx.rad_calc == 'NONE':
             return 0  # simple open end impedance
         else:
+            from scipy import special
             s = dia*dia*np.pi/4.0
-            k = wf/_c0
+            k = wf/ctx.c0
             x = k*dia
 
-            re = _rhoc0/s*(1 - special.jn(1, x)/x*2)  # 1st order bessel function.
-            im = _rhoc0/s*special.struve(1, x)/x*2  # 1st order struve function.
+            re = ctx.rhoc0/s*(1 - special.jn(1, x)/x*2)  # 1st order bessel function.
+            im = ctx.rhoc0/s*special.struve(1, x)/x*2  # 1st order struve function.
 
-            if _rad_calc == 'BAFFLE':
+            if ctx.rad_calc == 'BAFFLE':
                 zr = re + im*1j
-            elif _rad_calc == 'PIPE':
+            elif ctx.rad_calc == 'PIPE':
                 # real is about 0.5 times and imaginary is 0.7 times when without frange.
                 zr = 0.5*re + 0.7*im*1j
 
@@ -76,8 +294,32 @@ def radimp(wf, dia):
         return np.inf  # closed end
 
 
-def transmission_matrix(men1, men2):
-    """calculate transmission matrix from men2 -> men1
+class MenResult(object):
+    """Results of Men cells of one calculation, kept out of Men so that parsed mensur
+    is never written and can be shared between threads.
+    zi, zo : impedance at input and output end, tm : transmission matrix ( cells with r > 0 ),
+    mat : transmission matrix of child groups used by joints,
+    pi, ui, po, uo : pressure and volume velocity at both ends ( calc_pressure ).
+    Each is a dict keyed by Men cell, values are scalars or arrays along wf.
+    A group referred by many joints is calculated once per MenResult.
+    """
+    def __init__(self):
+        self.zi = {}
+        self.zo = {}
+        self.tm = {}
+        self.mat = {}
+        self.pi = {}
+        self.ui = {}
+        self.po = {}
+        self.uo = {}
+
+
+_eye = np.eye(2, dtype=complex)
+_eye.setflags(write=False)
+
+
+def transmission_matrix(men1, men2, res):
+    """calculate transmission matrix from men2 -> men1 using matrices of cells in res
     returns matrix"""
     if men2 is None:
         men = xmensur.end_mensur(men1)
@@ -85,67 +327,63 @@ def transmission_matrix(men1, men2):
     else:
         men = men2
 
-    m = np.eye(2, dtype=complex)
+    m = _eye
     while men is not None and men != men1:
-        m = np.dot(men.tm, m)
+        m = np.matmul(res.tm.get(men, _eye), m)  # matmul broadcasts when tm is an (n, 2, 2) array
         men = men.prev
-    m = np.dot(men1.tm, m)
+    m = np.matmul(res.tm.get(men1, _eye), m)
 
     return m
 
 
-def child_impedance(wf, men):
-    """handle impedance connection between child and current"""
+def group_impedance(wf, child, ctx, res, func):
+    """Calculate child group starting at child into res by func ( input_impedance or
+    input_impedance_array ), unless it is already there.
+    """
+    if child not in res.zi:
+        func(wf, child, ctx, res)  # recursive call for input impedance
+
+
+def group_matrix(wf, child, ctx, res, func):
+    """Transmission matrix of child group, calculated once per res as group_impedance"""
+    group_impedance(wf, child, ctx, res, func)
+    if child not in res.mat:
+        res.mat[child] = transmission_matrix(child, None, res)
+    return res.mat[child]
+
+
+def child_impedance(wf, men, res, ctx=None):
+    """handle impedance connection between child and current, output impedance is set to res.
+    Child of closed SPLIT is not calculated.
+    """
+    if ctx is None:
+        ctx = _ctx
     if men.c_type == 'SPLIT':
         # split (tonehole) type.
-        input_impedance(wf, men.child)  # recursive call for input impedance
         if men.c_ratio == 0:
-            men.zo = men.next.zi
+            res.zo[men] = res.zi[men.next]
         else:
-            z1 = men.child.zi / men.c_ratio  # adjust blending ratio
-            z2 = men.next.zi
+            group_impedance(wf, men.child, ctx, res, input_impedance)
+            z1 = res.zi[men.child] / men.c_ratio  # adjust blending ratio
+            z2 = res.zi[men.next]
             if z1 == 0 and z2 == 0:
                 z = 0
             else:
                 z = z1*z2/(z1+z2)
-            men.zo = z
-    elif men.c_type == 'BRANCH' and men.c_ratio > 0:
+            res.zo[men] = z
+    elif men.c_type == 'BRANCH':
         # multiple tube connection
-        input_impedance(wf, men.child)
-        m = transmission_matrix(men.child, None)
+        m = group_matrix(wf, men.child, ctx, res, input_impedance)[None]  # child cells are used by calc_pressure
         jnt = xmensur.joint_mensur(men)
-        n = transmission_matrix(men.next, jnt)
-
-        # section area adjustment
-        if men.c_ratio == 1:
-            m[0, 1] = np.inf
-        else:
-            m[0, 1] /= (1 - men.c_ratio)
-        m[1, 0] *= (1 - men.c_ratio)
-        if men.c_ratio == 0:
-            n[0, 1] = np.inf
-        else:
-            n[0, 1] /= men.c_ratio
-        n[1, 0] *= men.c_ratio
-
-        z2 = jnt.next.zi
-        dv = (m[1, 1]*n[0, 1] + m[0, 1]*n[1, 1] + (
-            (m[0, 1] + n[0, 1])*(m[1, 0] + n[1, 0]) - (m[0, 0] - n[0, 0])*(m[1, 1] - n[1, 1]))*z2)
-        if dv != 0:
-            z = (m[0, 1]*n[0, 1] + (m[0, 1]*n[0, 0] + m[0, 0]*n[0, 1])*z2)/dv
-        else:
-            z = 0
-        men.zo = z
+        n = transmission_matrix(men.next, jnt, res)
+        res.zo[men] = branch_impedance_array(m, n[None], np.array([res.zi[jnt.next]], dtype=complex), men.c_ratio)[0]
     elif men.c_type == 'ADDON' and men.c_ratio > 0:
         # this routine will not called until 'ADDON(LOOP)' type of connection is implemented.
-        input_impedance(wf, men.child)
-        m = transmission_matrix(men.child, None)
+        m = group_matrix(wf, men.child, ctx, res, input_impedance)
         z1 = m[0, 1]/(m[0, 1]*m[1, 0]-(1-m[0, 0])*(1-m[1, 1]))
-        z2 = men.next.zi
-        if men.c_ratio == 0:
-            men.zo = men.next.zi
-        elif men.c_ratio == 1:
-            men.zo = z1
+        z2 = res.zi[men.next]
+        if men.c_ratio == 1:
+            res.zo[men] = z1
         else:
             z1 /= men.c_ratio
             z2 /= (1 - men.c_ratio)
@@ -153,75 +391,625 @@ def child_impedance(wf, men):
                 z = 0
             else:
                 z = z1*z2/(z1+z2)
-            men.zo = z
+            res.zo[men] = z
+    else:
+        # MERGE does not update output impedance
+        res.zo[men] = 0
 
 
-def calc_impedance(wf, men):
-    """calculate impedance and other data for a given mensur cell"""
+def calc_impedance(wf, men, res, ctx=None):
+    """calculate impedance and other data for a given mensur cell into res"""
+    if ctx is None:
+        ctx = _ctx
     if men.child:
-        child_impedance(wf, men)
+        child_impedance(wf, men, res, ctx)
     elif men.next:
-        men.zo = men.next.zi
+        res.zo[men] = res.zi[men.next]
 
     if men.r > 0:
-        men.tm = impcore.calc_transmission(wf, men.df, men.db, men.r, _c0, _rhoc0, _nu)
-        men.zi = impcore.zo2zi(men.tm, men.zo)
+        tm = impcore.calc_transmission(wf, men.df, men.db, men.r, ctx.c0, ctx.rhoc0, ctx.nu)
+        res.tm[men] = tm
+        res.zi[men] = impcore.zo2zi(tm, res.zo[men])
     else:
         # length 0
-        men.zi = men.zo
+        res.zi[men] = res.zo[men]
 
 
-def input_impedance(wf, men):
+def input_impedance(wf, men, ctx=None, res=None):
     """calculate input impedance of given mensur
     wf : wave frequency 2*pi*frq
+    res : MenResult to keep results of all cells ( e.g. for calc_pressure ), Men is not changed.
     """
+    if ctx is None:
+        ctx = _ctx
     # cur.po = 0.02 + 0j # 60dB(SPL) = 20*1e-6 * 10^(60/20)
     # does not need to calculate impedance
 
     if wf == 0:
         return 0
 
+    if isinstance(men, xmensur.MenArray):
+        return input_impedance_array(np.array([wf]), men, ctx)[0]
+
+    if res is None:
+        res = MenResult()
     cur = xmensur.end_mensur(men)
     # end impedance
-    cur.zo = radimp(wf, cur.df)
+    res.zo[cur] = radimp(wf, cur.df, ctx)
 
     while cur != men:
-        calc_impedance(wf, cur)
+        calc_impedance(wf, cur, res, ctx)
         cur = cur.prev
-    calc_impedance(wf, men)
+    calc_impedance(wf, men, res, ctx)
+
+    return res.zi[men]
+
+
+def radimp_array(wf, dia, ctx=None):
+    """array version of radimp. wf is an array of wave frequency.
+    Results are kept in LRU cache, so returned array is read only.
+    """
+    if ctx is None:
+        ctx = _ctx
+    wf = np.asarray(wf, dtype=float)
+    tbl = _rad_table
+    key = (dia, ctx_key(ctx), ctx.rad_calc, tbl and tbl[0], freq_key(wf))
+    zr = _radimp_cache.get(key)
+    if zr is not None:
+        return zr
+
+    zr = np.zeros(len(wf), dtype=complex)
+    if dia > 0:
+        if ctx.rad_calc != 'NONE':
+            pos = wf > 0
+            s = dia*dia*np.pi/4.0
+            # constants of grid context are arrays along wf
+            c0 = np.broadcast_to(ctx.c0, wf.shape)[pos]
+            rhoc0 = np.broadcast_to(ctx.rhoc0, wf.shape)[pos]
+            k = wf[pos]/c0
+            x = k*dia
 
-    return men.zi
+            re, im = radiation_functions(x)
+            re *= rhoc0/s
+            im *= rhoc0/s
 
+            if ctx.rad_calc == 'BAFFLE':
+                zr[pos] = re + im*1j
+            elif ctx.rad_calc == 'PIPE':
+                zr[pos] = 0.5*re + 0.7*im*1j
+    else:
+        zr[wf > 0] = np.inf  # closed end
+
+    return _radimp_cache.put(key, zr)
+
+
+def child_impedance_array(wf, men, res, ctx=None):
+    """array version of child_impedance"""
+    if ctx is None:
+        ctx = _ctx
+    if men.c_type == 'SPLIT':
+        if men.c_ratio == 0:
+            res.zo[men] = res.zi[men.next]
+        else:
+            group_impedance(wf, men.child, ctx, res, input_impedance_array)
+            z1 = res.zi[men.child] / men.c_ratio
+            z2 = res.zi[men.next]
+            z = z1*z2/(z1+z2)
+            z[(z1 == 0) & (z2 == 0)] = 0
+            res.zo[men] = z
+    elif men.c_type == 'BRANCH':
+        m = group_matrix(wf, men.child, ctx, res, input_impedance_array)  # child cells are used by calc_pressure
+        jnt = xmensur.joint_mensur(men)
+        n = transmission_matrix(men.next, jnt, res)
+        res.zo[men] = branch_impedance_array(m, n, res.zi[jnt.next], men.c_ratio)
+    elif men.c_type == 'ADDON' and men.c_ratio > 0:
+        m = group_matrix(wf, men.child, ctx, res, input_impedance_array)
+        z1 = m[:, 0, 1]/(m[:, 0, 1]*m[:, 1, 0]-(1-m[:, 0, 0])*(1-m[:, 1, 1]))
+        if men.c_ratio == 1:
+            res.zo[men] = z1
+        else:
+            z1 /= men.c_ratio
+            z2 = res.zi[men.next] / (1 - men.c_ratio)
+            z = z1*z2/(z1+z2)
+            z[(z1 == 0) & (z2 == 0)] = 0
+            res.zo[men] = z
+    else:
+        # MERGE does not update output impedance
+        res.zo[men] = np.zeros(len(wf), dtype=complex)
+
+
+def calc_impedance_array(wf, men, res, ctx=None):
+    """array version of calc_impedance"""
+    if ctx is None:
+        ctx = _ctx
+    if men.child:
+        child_impedance_array(wf, men, res, ctx)
+    elif men.next:
+        res.zo[men] = res.zi[men.next]
+
+    if men.r > 0:
+        tm = transmission_array(wf, men.df, men.db, men.r, ctx)
+        res.tm[men] = tm
+        res.zi[men] = impcore.zo2zi_array(tm, res.zo[men])
+    else:
+        res.zi[men] = res.zo[men]
+
+
+def chain_matrix_array(wf, ma, top, ctx=None):
+    """transmission matrix of the chain starting at top of MenArray ma,
+    calculated in the same way as transmission_matrix(men, None)"""
+    if ctx is None:
+        ctx = _ctx
+    end = ma.end[top]
+    if end > top:
+        end -= 1  # last cell is not included
+    m = np.broadcast_to(np.eye(2, dtype=complex), (len(wf), 2, 2))
+    for i in range(end, top - 1, -1):
+        if ma.r[i] > 0:
+            m = np.matmul(transmission_array(wf, ma.df[i], ma.db[i], ma.r[i], ctx), m)
+
+    return m.copy()
+
+
+def branch_impedance_array(m, n, z2, c_ratio):
+    """impedance at BRANCH joint, where child chain (transmission matrices m) and
+    main path from next cell to MERGE (n) are parallel and z2 is input impedance after MERGE.
+    c_ratio is connecting ratio of child, 0 is main path only and 1 child only
+    ( doc/calcimpy_basics.md ).
+    """
+    if c_ratio <= 0:
+        return impcore.zo2zi_array(n, z2)
+    if c_ratio >= 1:
+        return impcore.zo2zi_array(m, z2)
+    # section area adjustment, child has share c_ratio and main path 1 - c_ratio
+    m = m.copy()
+    n = n.copy()
+    m[:, 0, 1] /= c_ratio
+    m[:, 1, 0] *= c_ratio
+    n[:, 0, 1] /= (1 - c_ratio)
+    n[:, 1, 0] *= (1 - c_ratio)
+
+    dv = (m[:, 1, 1]*n[:, 0, 1] + m[:, 0, 1]*n[:, 1, 1] + (
+        (m[:, 0, 1] + n[:, 0, 1])*(m[:, 1, 0] + n[:, 1, 0]) - (m[:, 0, 0] - n[:, 0, 0])*(m[:, 1, 1] - n[:, 1, 1]))*z2)
+    z = (m[:, 0, 1]*n[:, 0, 1] + (m[:, 0, 1]*n[:, 0, 0] + m[:, 0, 0]*n[:, 0, 1])*z2)/dv
+    z[dv == 0] = 0
+    return z
+
+
+def group_array(wf, ma, top, kind, ctx, memo):
+    """input impedance ( kind 'z' ) or transmission matrix ( 'm' ) of child chain top of MenArray ma,
+    calculated once per frequency batch when memo ( dict of (kind, top) -> array ) is given"""
+    v = None if memo is None else memo.get((kind, top))
+    if v is None:
+        if kind == 'z':
+            v = chain_impedance_array(wf, ma, top, ctx, memo)
+        else:
+            v = chain_matrix_array(wf, ma, top, ctx)
+        if memo is not None:
+            memo[(kind, top)] = v
+    return v
+
+
+def joint_impedance_array(wf, ma, i, z2, n, ctx=None, c_ratio=None, child=None, memo=None):
+    """calculate output impedance at joint cell i of MenArray ma.
+    z2 is input impedance of next cell,
+    n is transmission matrix from next cell to MERGE for BRANCH type.
+    c_ratio replaces ma.c_ratio[i] if given. child is input impedance ( SPLIT ) or
+    transmission matrix ( BRANCH, ADDON ) of child chain if already known.
+    memo keeps child chains calculated in this batch ( see group_array ), child chains
+    which do not affect the result ( closed SPLIT, BRANCH of main path only ) are skipped.
+    """
+    if ctx is None:
+        ctx = _ctx
+    c_type = xmensur.C_TYPES[ma.c_type[i]]
+    if c_ratio is None:
+        c_ratio = ma.c_ratio[i]
+    ch = ma.child[i]
+    if c_type == 'SPLIT':
+        if c_ratio == 0:
+            z = z2
+        else:
+            z1 = (group_array(wf, ma, ch, 'z', ctx, memo) if child is None else child) / c_ratio
+            z = z1*z2/(z1+z2)
+            z[(z1 == 0) & (z2 == 0)] = 0
+    elif c_type == 'BRANCH':
+        if child is None and c_ratio > 0:
+            child = group_array(wf, ma, ch, 'm', ctx, memo)
+        z = branch_impedance_array(child, n, z2, c_ratio)
+    elif c_type == 'ADDON' and c_ratio > 0:
+        m = group_array(wf, ma, ch, 'm', ctx, memo) if child is None else child
+        z1 = m[:, 0, 1]/(m[:, 0, 1]*m[:, 1, 0]-(1-m[:, 0, 0])*(1-m[:, 1, 1]))
+        if c_ratio == 1:
+            z = z1
+        else:
+            z1 /= c_ratio
+            z2 = z2 / (1 - c_ratio)
+            z = z1*z2/(z1+z2)
+            z[(z1 == 0) & (z2 == 0)] = 0
+    else:
+        z = np.zeros(len(wf), dtype=complex)
 
-def calc_pressure(wf, mensur, endp, from_tail=False):
+    return z
+
+
+def chain_impedance_array(wf, ma, top, ctx=None, memo=None):
+    """input impedance of the chain starting at top of MenArray ma.
+    Nothing is stored into ma. memo keeps child chains calculated for wf ( see group_array ).
+    """
+    if ctx is None:
+        ctx = _ctx
+    if memo is None:
+        memo = {}
+    end = ma.end[top]
+    z = radimp_array(wf, ma.df[end], ctx)
+    joints = {}  # MERGE index -> [input impedance of its next cell, transmission matrix up to MERGE]
+    targets = set(ma.joint[top:end + 1]) - {-1}
+    # same[i] : cell i-1 is a plain cell of the same geometry as cell i
+    df, db, r = ma.df[top:end + 1], ma.db[top:end + 1], ma.r[top:end + 1]
+    same = np.zeros(end + 1 - top, dtype=bool)
+    same[1:] = (df[1:] == df[:-1]) & (db[1:] == db[:-1]) & (r[1:] == r[:-1]) & (ma.child[top:end] < 0)
+    kernel = impcore.propagate_kernel
+    if len(wf)*(end + 1 - top) < impcore.kernel_min_work:
+        kernel = None  # short chain is not worth loading numba ( auto backend )
+    short = end + 1  # cells from short up to a joint are calculated without kernel
+    if kernel is not None:
+        # arguments of compiled kernel, writable arrays along wf
+        kargs = [np.array(np.broadcast_to(v, wf.shape), dtype=float) for v in (wf, ctx.c0, ctx.rhoc0, ctx.nu)]
+    i = end
+    while i >= top:
+        if i in targets:
+            joints[i] = [z, np.broadcast_to(np.eye(2, dtype=complex), (len(wf), 2, 2))]
+        if ma.child[i] >= 0:
+            z2, n = joints.pop(ma.joint[i], (z, None))
+            zo = joint_impedance_array(wf, ma, i, z2, n, ctx, memo=memo)
+        else:
+            zo = z
+        if kernel is not None and not joints and i < short:
+            # plain cells down to next joint or MERGE in one call of compiled kernel,
+            # no matrices are needed while no BRANCH is waiting for them
+            j = i
+            while j > top and ma.child[j - 1] < 0 and (j - 1) not in targets:
+                j -= 1
+            run = np.flatnonzero(ma.r[j:i + 1] > 0) + j
+            # runs of identical cells are given once with number of repeats
+            rdf, rdb, rr = ma.df[run], ma.db[run], ma.r[run]
+            head = np.ones(len(run), dtype=bool)
+            head[1:] = (rdf[1:] != rdf[:-1]) | (rdb[1:] != rdb[:-1]) | (rr[1:] != rr[:-1])
+            h = np.flatnonzero(head)
+            if len(h) >= impcore.kernel_min_cells:
+                rep = np.diff(np.append(h, len(run))).astype(np.int64)
+                z = kernel(kargs[0], rdf[h], rdb[h], rr[h], rep, np.array(zo, dtype=complex), *kargs[1:])
+                i = j - 1
+                continue
+            if len(h) == 0:
+                z = zo
+                i = j - 1
+                continue
+            short = j  # few cells between joints, cached matrices below are faster
+        if ma.r[i] > 0:
+            # collapse run of identical cells into one matrix power
+            k = 1
+            while i - k >= top and same[i - k + 1 - top] and (i - k) not in targets:
+                k += 1
+            tm = transmission_array(wf, ma.df[i], ma.db[i], ma.r[i], ctx, k)
+            z = impcore.zo2zi_array(tm, zo)
+            for v in joints.values():
+                v[1] = np.matmul(tm, v[1])
+            i -= k
+        else:
+            z = zo
+            i -= 1
+
+    return z
+
+
+def input_impedance_array(wff, men, ctx=None, res=None):
+    """calculate input impedance of given mensur for all frequencies in wff at once.
+    wff : array of wave frequency 2*pi*frq
+    men : Men or MenArray.
+    ctx : CalcContext. default context set by set_params is used when None.
+    res : MenResult to keep results of all Men cells as arrays along wff, groups already
+    in it are not calculated again.
+    Neither Men nor MenArray is changed, so they can be shared between threads.
+    """
+    if ctx is None:
+        ctx = _ctx
+    wf = np.array(wff, dtype=float)
+    wf.setflags(write=False)  # private copy, so that its digest can be reused by caches
+
+    if isinstance(men, xmensur.MenArray):
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            zi = chain_impedance_array(wf, men, 0, ctx)
+        return np.where(wf == 0, 0, zi)
+
+    if res is None:
+        res = MenResult()
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        cur = xmensur.end_mensur(men)
+        res.zo[cur] = radimp_array(wf, cur.df, ctx)
+
+        while cur != men:
+            calc_impedance_array(wf, cur, res, ctx)
+            cur = cur.prev
+        calc_impedance_array(wf, men, res, ctx)
+
+    zi = res.zi[men].copy()
+    zi[wf == 0] = 0
+
+    return zi
+
+
+def input_impedance_grid(wff, men, temperatures, rad=None):
+    """input impedance of given mensur for all temperatures x frequencies in one pass.
+    Frequency axis is tiled for each temperature and calculated with grid_context,
+    so mensur walk and cache lookups are done once for the whole grid.
+    rad : radiation type, that of default context when None.
+    Returns array of shape (len(temperatures), len(wff)).
+    """
+    if rad is None:
+        rad = _ctx.rad_calc
+    wff = np.asarray(wff, dtype=float)
+    nt = len(temperatures)
+    ctx = grid_context(temperatures, len(wff), rad)
+    zi = input_impedance_array(np.tile(wff, nt), men, ctx)
+    return zi.reshape(nt, len(wff))
+
+
+def inverse_transmission(tm):
+    """Inverse of transmission matrix tm ( 2x2 or array of them along first axis ).
+    Transmission matrices are unimodular ( det = 1 ), so no general inverse is needed.
+    """
+    ti = np.empty_like(tm)
+    ti[..., 0, 0] = tm[..., 1, 1]
+    ti[..., 0, 1] = -tm[..., 0, 1]
+    ti[..., 1, 0] = -tm[..., 1, 0]
+    ti[..., 1, 1] = tm[..., 0, 0]
+    return ti
+
+
+def calc_pressure(wf, mensur, endp, from_tail=False, ctx=None, res=None):
     """Calculate pressure from end at wave frequency wf.
-    Input_impedance routine must be called before using this.
+    res : MenResult of input_impedance of mensur at wf, calculated here when None.
+    Returns res with pi, ui, po, uo of cells along actual path, Men is not changed.
     """
+    if ctx is None:
+        ctx = _ctx
+    if res is None:
+        res = MenResult()
+        input_impedance(wf, mensur, ctx, res)
     if not from_tail:
         men = mensur
         # closed end at head is supposed. not good for flute like instrument ?
         v = [endp, 0.0]
         while men:
-            men.pi = v[0]
-            men.ui = v[1]
-            ti = np.linalg.inv(men.tm)
-            v = np.dot(ti, v)  # update v
-            men.po = v[0]
-            men.uo = v[1]
+            res.pi[men] = v[0]
+            res.ui[men] = v[1]
+            tm = res.tm.get(men, _eye)
+            # inverse of unimodular ( det = 1 ) transmission matrix
+            v = [tm[1, 1]*v[0] - tm[0, 1]*v[1], tm[0, 0]*v[1] - tm[1, 0]*v[0]]
+            res.po[men] = v[0]
+            res.uo[men] = v[1]
 
             men = xmensur.actual_next_mensur(men)
     else:
         men = xmensur.end_mensur(mensur)
-        z = men.zo
+        z = res.zo[men]
         if z == 0:
-            v = [0, endp/_rhoc0]  # open end with no end correction.
+            v = [0, endp/ctx.rhoc0]  # open end with no end correction.
         else:
             v = [endp, endp/z]
         while men:
-            men.po = v[0]
-            men.uo = v[1]
-            v = np.dot(men.tm, v)
-            men.pi = v[0]
-            men.ui = v[1]
+            res.po[men] = v[0]
+            res.uo[men] = v[1]
+            v = np.dot(res.tm.get(men, _eye), v)
+            res.pi[men] = v[0]
+            res.ui[men] = v[1]
 
             men = xmensur.actual_prev_mensur(men)
+
+    return res
+
+
+def calc_pressure_array(wf, ma, endp, from_tail=False, ctx=None):
+    """Calculate pressure along MenArray ma at wave frequency wf.
+    Returns indices of cells along actual path from head
+    and arrays of pi, ui, po, uo for each of them.
+    Nothing is stored into ma.
+    """
+    if ctx is None:
+        ctx = _ctx
+    path = xmensur.actual_path(ma, from_tail)
+    pui = np.zeros((len(path), 2), dtype=complex)
+    puo = np.zeros((len(path), 2), dtype=complex)
+
+    if not from_tail:
+        # closed end at head is supposed.
+        v = np.array([endp, 0.0], dtype=complex)
+        for k, i in enumerate(path):
+            pui[k] = v
+            if ma.r[i] > 0:
+                tm = impcore.calc_transmission(wf, ma.df[i], ma.db[i], ma.r[i], ctx.c0, ctx.rhoc0, ctx.nu)
+                v = np.dot(inverse_transmission(tm), v)
+            puo[k] = v
+    else:
+        z = radimp(wf, ma.df[path[0]], ctx)
+        if z == 0:
+            v = np.array([0, endp/ctx.rhoc0], dtype=complex)  # open end with no end correction.
+        else:
+            v = np.array([endp, endp/z], dtype=complex)
+        for k, i in enumerate(path):
+            puo[k] = v
+            if ma.r[i] > 0:
+                tm = impcore.calc_transmission(wf, ma.df[i], ma.db[i], ma.r[i], ctx.c0, ctx.rhoc0, ctx.nu)
+                v = np.dot(tm, v)
+            pui[k] = v
+        path = path[::-1]
+        pui = pui[::-1]
+        puo = puo[::-1]
+
+    return path, pui[:, 0], pui[:, 1], puo[:, 0], puo[:, 1]
+
+
+# result of pressure_profile, slice geometry and pressure / volume velocity of (frequency, slice)
+PressureProfile = namedtuple('PressureProfile', ('cell', 'x', 'df', 'db', 'r', 'pi', 'ui', 'po', 'uo'))
+
+
+def partial_transmission_array(wf, ma, i, df, db, r, ctx):
+    """Transmission matrices of a part ( df, db, r ) of cell i of MenArray ma.
+    Whole cells and parts of straight cells are cached by transmission_array,
+    parts of tapers are calculated every time since they seldom repeat.
+    """
+    if (r == ma.r[i] and df == ma.df[i] and db == ma.db[i]) or df == db:
+        return transmission_array(wf, df, db, r, ctx)
+    return impcore.calc_transmission_array(wf, df, db, r, ctx.c0, ctx.rhoc0, ctx.nu)
+
+
+def pressure_profile(wff, ma, endp, step=0, from_tail=False, ctx=None):
+    """Pressure and volume velocity along actual path of MenArray ma at positions of
+    virtual slices by step ( see xmensur.virtual_slices, 0 for whole cells ),
+    for all frequencies in wff at once. ma is not changed.
+    Returns PressureProfile, pi, ui, po, uo at both ends of slices are arrays of shape
+    (len(wff), number of slices).
+    At wf = 0 cells are treated as identity ( uniform pressure ).
+    """
+    if ctx is None:
+        ctx = _ctx
+    wf = np.array(wff, dtype=float)
+    wf.setflags(write=False)
+    path = xmensur.actual_path(ma, from_tail)
+    if from_tail:
+        path = path[::-1]
+    cell, x, sdf, sdb, sr = xmensur.virtual_slices(ma, path, step)
+    nf, ns = len(wf), len(cell)
+    pi = np.zeros((nf, ns), dtype=complex)
+    ui = np.zeros((nf, ns), dtype=complex)
+    po = np.zeros((nf, ns), dtype=complex)
+    uo = np.zeros((nf, ns), dtype=complex)
+    zero = wf == 0
+
+    def matrix(k):
+        tm = partial_transmission_array(wf, ma, cell[k], sdf[k], sdb[k], sr[k], ctx)
+        if zero.any():
+            tm = tm.copy()
+            tm[zero] = np.eye(2)
+        return tm
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if not from_tail:
+            # closed end at head is supposed.
+            p = np.full(nf, endp, dtype=complex)
+            u = np.zeros(nf, dtype=complex)
+            for k in range(ns):
+                pi[:, k] = p
+                ui[:, k] = u
+                if sr[k] > 0:
+                    tm = matrix(k)
+                    p, u = tm[:, 1, 1]*p - tm[:, 0, 1]*u, tm[:, 0, 0]*u - tm[:, 1, 0]*p
+                po[:, k] = p
+                uo[:, k] = u
+        else:
+            z = radimp_array(wf, ma.df[path[-1]], ctx)
+            # open end with no end correction where z == 0
+            p = np.where(z == 0, 0, endp).astype(complex)
+            u = np.where(z == 0, endp/ctx.rhoc0, endp/z).astype(complex)
+            for k in range(ns - 1, -1, -1):
+                po[:, k] = p
+                uo[:, k] = u
+                if sr[k] > 0:
+                    tm = matrix(k)
+                    p, u = tm[:, 0, 0]*p + tm[:, 0, 1]*u, tm[:, 1, 0]*p + tm[:, 1, 1]*u
+                pi[:, k] = p
+                ui[:, k] = u
+
+    return PressureProfile(cell, x, sdf, sdb, sr, pi, ui, po, uo)
+
+
+def pressure_map(wff, ma, endp, from_tail=False, ctx=None):
+    """Pressure and volume velocity along MenArray ma for all frequencies in wff at once.
+    Returns indices of cells along actual path from head ( see calc_pressure_array )
+    and arrays pi, ui, po, uo of shape (len(wff), len(path)).
+    Transmission matrices come from the cache of transmission_array, so they are
+    shared with input_impedance_array of the same frequencies.
+    """
+    pr = pressure_profile(wff, ma, endp, 0, from_tail, ctx)
+    return pr.cell, pr.pi, pr.ui, pr.po, pr.uo
+
+
+class IncrementalImpedance(object):
+    """Input impedance of Men mensur for frequency array wff, which is updated
+    incrementally after local edits of df, db, r or c_ratio of cells.
+    Results of every cell are kept in own MenResult ( attribute res ), and only the cells
+    from an edited cell toward the input end (and parent joints of edited child groups)
+    are recalculated. Men is only read.
+    Changes of connection of cells are not supported, make a new instance for them.
+    """
+    def __init__(self, wff, men, ctx=None):
+        self.men = men
+        self.ctx = ctx
+        self.wf = np.array(wff, dtype=float)
+        self.wf.setflags(write=False)
+        self.dirty = set()
+        self.res = MenResult()
+        # position of each cell in its chain, chain tops, and joints referring each chain top
+        self.pos = {}
+        self.top = {}
+        self.refs = {}
+        self.depth = {}
+        tops = [(men, 0)]
+        while tops:
+            t, dp = tops.pop()
+            if t in self.depth:
+                continue
+            self.depth[t] = dp
+            m, n = t, 0
+            while m:
+                self.pos[m] = n
+                self.top[m] = t
+                if m.child and m.c_type != 'MERGE':
+                    ct = xmensur.top_mensur(m.child)
+                    self.refs.setdefault(ct, []).append(m)
+                    tops.append((ct, dp + 1))
+                m, n = m.next, n + 1
+        # every child is calculated, including those skipped by the engine ( closed SPLIT ),
+        # so that all cells keep results
+        for t in sorted(self.depth, key=lambda t: -self.depth[t]):
+            if t is not men:
+                input_impedance_array(self.wf, t, ctx, self.res)
+        self.zi = input_impedance_array(self.wf, men, ctx, self.res)
+
+    def mark_dirty(self, men):
+        """Tell that men is edited"""
+        self.dirty.add(men)
+
+    def update(self):
+        """Recalculate cells affected by edits and returns input impedance"""
+        if not self.dirty:
+            return self.zi
+        # most downstream dirty cell of each chain, including joints of parents
+        start = {}
+        work = list(self.dirty)
+        while work:
+            m = work.pop()
+            t = self.top[m]
+            if t in start and self.pos[start[t]] >= self.pos[m]:
+                continue
+            start[t] = m
+            work.extend(self.refs.get(t, []))
+
+        res = self.res
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # deepest chains first, so joints of parents read updated children
+            for t in sorted(start, key=lambda t: -self.depth[t]):
+                cur = start[t]
+                if cur.next is None:
+                    res.zo[cur] = radimp_array(self.wf, cur.df, self.ctx)
+                while cur != t:
+                    calc_impedance_array(self.wf, cur, res, self.ctx)
+                    cur = cur.prev
+                calc_impedance_array(self.wf, t, res, self.ctx)
+                res.mat.pop(t, None)  # transmission matrix of the group is made again when used
+
+        self.dirty.clear()
+        self.zi = res.zi[self.men].copy()
+        self.zi[self.wf == 0] = 0
+        return self.zi
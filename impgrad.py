@@ -0,0 +1,314 @@
+"""
+impgrad
+derivatives of input impedance by mensur parameters.
+Impedance is calculated once from the end (forward), then sensitivities are
+propagated from the input end back through the same chain (adjoint).
+"""
+import numpy as np
+
+import xmensur
+import imped
+
+
+def radimp_grad_array(wf, dia, ctx):
+    """derivative of radimp_array by diameter dia"""
+    g = np.zeros(len(wf), dtype=complex)
+    if dia > 0 and ctx.rad_calc != 'NONE':
+        from scipy import special  # imported on demand for fast startup
+        pos = wf > 0
+        s = dia*dia*np.pi/4.0
+        k = wf[pos]/ctx.c0
+        x = k*dia
+        re = 1 - special.jn(1, x)/x*2
+        im = special.struve(1, x)/x*2
+        dre = special.jn(2, x)/x*2  # d(re)/dx
+        dim = 2*(2/(3*np.pi) - special.struve(2, x)/x)  # d(im)/dx
+        gre = ctx.rhoc0/s*(k*dre - 2/dia*re)
+        gim = ctx.rhoc0/s*(k*dim - 2/dia*im)
+        if ctx.rad_calc == 'BAFFLE':
+            g[pos] = gre + gim*1j
+        elif ctx.rad_calc == 'PIPE':
+            g[pos] = 0.5*gre + 0.7*gim*1j
+
+    return g
+
+
+class Tape(object):
+    """Values recorded by forward calculation and gradients accumulated by backward one"""
+    def __init__(self, wf, ma, ctx):
+        self.wf = wf
+        self.ma = ma
+        self.ctx = ctx
+        self.zo = {}  # output impedance of cells
+        self.tm = {}  # transmission matrix of cells with r > 0
+        self.joint = {}  # values of joint cells
+        n = (len(ma), len(wf))
+        self.gdf = np.zeros(n, dtype=complex)
+        self.gdb = np.zeros(n, dtype=complex)
+        self.gr = np.zeros(n, dtype=complex)
+        self.gratio = np.zeros(n, dtype=complex)
+
+    def cell_tm(self, i):
+        ma = self.ma
+        if i not in self.tm:
+            self.tm[i] = imped.transmission_array(self.wf, ma.df[i], ma.db[i], ma.r[i], self.ctx)
+        return self.tm[i]
+
+    def add_cell_grad(self, i, gt):
+        """accumulate derivative gt (n, 2, 2) of input impedance by transmission matrix of cell i"""
+        ma, ctx = self.ma, self.ctx
+        dt = imped.impcore.calc_transmission_grad_array(self.wf, ma.df[i], ma.db[i], ma.r[i], ctx.c0, ctx.rhoc0, ctx.nu)
+        self.gdf[i] += np.sum(gt*dt[0], axis=(1, 2))
+        self.gdb[i] += np.sum(gt*dt[1], axis=(1, 2))
+        self.gr[i] += np.sum(gt*dt[2], axis=(1, 2))
+
+    def add_product_grad(self, cells, g):
+        """accumulate derivative g of matrix product of cells (in order of multiplication)"""
+        cells = [i for i in cells if self.ma.r[i] > 0]
+        eye = np.broadcast_to(np.eye(2, dtype=complex), g.shape)
+        pre = [eye]
+        for i in cells[:-1]:
+            pre.append(np.matmul(pre[-1], self.cell_tm(i)))
+        suf = eye
+        for k in range(len(cells) - 1, -1, -1):
+            gt = np.matmul(np.matmul(np.swapaxes(pre[k], 1, 2), g), np.swapaxes(suf, 1, 2))
+            self.add_cell_grad(cells[k], gt)
+            suf = np.matmul(self.cell_tm(cells[k]), suf)
+
+
+def child_cells(ma, top):
+    """cells of child chain used for transmission matrix, same as imped.chain_matrix_array"""
+    end = ma.end[top]
+    if end > top:
+        end -= 1
+    return list(range(top, end + 1))
+
+
+def branch_values(m, n, z2, c_ratio):
+    """impedance at BRANCH and its derivatives by adjusted m, n (entries) and z2"""
+    m01, m10 = m[:, 0, 1], m[:, 1, 0]
+    m00, m11 = m[:, 0, 0], m[:, 1, 1]
+    n00, n01, n10, n11 = n[:, 0, 0], n[:, 0, 1], n[:, 1, 0], n[:, 1, 1]
+    num = m01*n01 + (m01*n00 + m00*n01)*z2
+    dv = (m11*n01 + m01*n11 + ((m01 + n01)*(m10 + n10) - (m00 - n00)*(m11 - n11))*z2)
+    z = num/dv
+    # derivatives of num and dv
+    dnum_m = [n01*z2, n01 + n00*z2, 0, 0]
+    ddv_m = [-(m11 - n11)*z2, n11 + (m10 + n10)*z2, (m01 + n01)*z2, n01 - (m00 - n00)*z2]
+    dnum_n = [m01*z2, m01 + m00*z2, 0, 0]
+    ddv_n = [(m11 - n11)*z2, m11 + (m10 + n10)*z2, (m01 + n01)*z2, m01 + (m00 - n00)*z2]
+    gm = np.empty(m.shape, dtype=complex)
+    gn = np.empty(n.shape, dtype=complex)
+    for k, (a, b) in enumerate(((0, 0), (0, 1), (1, 0), (1, 1))):
+        gm[:, a, b] = (dnum_m[k] - z*ddv_m[k])/dv
+        gn[:, a, b] = (dnum_n[k] - z*ddv_n[k])/dv
+    gz2 = ((m01*n00 + m00*n01) - z*((m01 + n01)*(m10 + n10) - (m00 - n00)*(m11 - n11)))/dv
+    z[dv == 0] = 0
+
+    return z, gm, gn, gz2
+
+
+def forward_chain(tape, top):
+    """input impedance of the chain starting at top, recording values into tape"""
+    wf, ma, ctx = tape.wf, tape.ma, tape.ctx
+    end = ma.end[top]
+    z = imped.radimp_array(wf, ma.df[end], ctx)
+    zj = {}  # MERGE index -> input impedance of its next cell
+    targets = set(ma.joint[top:end + 1]) - {-1}
+    for i in range(end, top - 1, -1):
+        if i in targets:
+            zj[i] = z
+        if ma.child[i] >= 0:
+            zo = forward_joint(tape, i, z, zj)
+        else:
+            zo = z
+        tape.zo[i] = zo
+        if ma.r[i] > 0:
+            z = imped.impcore.zo2zi_array(tape.cell_tm(i), zo)
+        else:
+            z = zo
+
+    return z
+
+
+def forward_joint(tape, i, z2, zj):
+    """output impedance of joint cell i"""
+    wf, ma = tape.wf, tape.ma
+    c_type = xmensur.C_TYPES[ma.c_type[i]]
+    c_ratio = ma.c_ratio[i]
+    if c_type == 'SPLIT':
+        zc = forward_chain(tape, ma.child[i])  # also needed for derivative by c_ratio = 0
+        tape.joint[i] = (zc, z2)
+        if c_ratio == 0:
+            z = z2
+        else:
+            z1 = zc / c_ratio
+            z = z1*z2/(z1+z2)
+            z[(z1 == 0) & (z2 == 0)] = 0
+    elif c_type == 'BRANCH':
+        jnt = ma.joint[i]
+        m = np.broadcast_to(np.eye(2, dtype=complex), (len(wf), 2, 2))
+        for k in reversed(child_cells(ma, ma.child[i])):
+            if ma.r[k] > 0:
+                m = np.matmul(tape.cell_tm(k), m)
+        n = np.broadcast_to(np.eye(2, dtype=complex), (len(wf), 2, 2))
+        for k in range(jnt, i, -1):
+            if ma.r[k] > 0:
+                n = np.matmul(tape.cell_tm(k), n)
+        m = m.copy()
+        n = n.copy()
+        tape.joint[i] = (m.copy(), n.copy(), zj[jnt])
+        if c_ratio >= 1 or c_ratio <= 0:
+            # main path or child only
+            return imped.impcore.zo2zi_array(m if c_ratio >= 1 else n, zj[jnt])
+        m[:, 0, 1] /= c_ratio
+        m[:, 1, 0] *= c_ratio
+        n[:, 0, 1] /= (1 - c_ratio)
+        n[:, 1, 0] *= (1 - c_ratio)
+        z = branch_values(m, n, zj[jnt], c_ratio)[0]
+    elif c_type == 'ADDON' and c_ratio > 0:
+        raise ValueError('derivative of ADDON connection is not supported')
+    else:
+        z = np.zeros(len(wf), dtype=complex)
+
+    return z
+
+
+def mobius_grad(tm, zo, lam):
+    """derivatives of zi = zo2zi(tm, zo) multiplied by lam.
+    Returns derivative by tm (n, 2, 2) and by zo.
+    """
+    t00, t01, t10, t11 = tm[:, 0, 0], tm[:, 0, 1], tm[:, 1, 0], tm[:, 1, 1]
+    gt = np.zeros(tm.shape, dtype=complex)
+    inf = np.isinf(zo)
+    z = np.where(inf, 0, zo)
+    den = t10*z + t11
+    num = t00*z + t01
+    gt[:, 0, 0] = np.where(inf, 1/t10, z/den)*lam
+    gt[:, 0, 1] = np.where(inf, 0, 1/den)*lam
+    gt[:, 1, 0] = np.where(inf, -t00/(t10*t10), -num*z/(den*den))*lam
+    gt[:, 1, 1] = np.where(inf, 0, -num/(den*den))*lam
+    gz = np.where(inf, 0, (t00*t11 - t01*t10)/(den*den))*lam
+
+    return gt, gz
+
+
+def backward_chain(tape, top, lam):
+    """propagate derivative lam of input impedance by input impedance of top, down to the end"""
+    ma = tape.ma
+    end = ma.end[top]
+    pending = {}  # cell index -> derivative by its input impedance, given by BRANCH
+    for i in range(top, end + 1):
+        if i in pending:
+            lam = lam + pending.pop(i)
+        if ma.r[i] > 0:
+            gt, lam = mobius_grad(tape.cell_tm(i), tape.zo[i], lam)
+            tape.add_cell_grad(i, gt)
+        if ma.child[i] >= 0:
+            lam = backward_joint(tape, i, lam, pending)
+    # radiation at the end
+    tape.gdf[end] += lam * radimp_grad_array(tape.wf, ma.df[end], tape.ctx)
+
+
+def backward_joint(tape, i, lam, pending):
+    """propagate derivative lam by output impedance of joint cell i.
+    Returns derivative by input impedance of next cell.
+    """
+    ma = tape.ma
+    c_type = xmensur.C_TYPES[ma.c_type[i]]
+    c_ratio = ma.c_ratio[i]
+    if c_type == 'SPLIT':
+        zc, z2 = tape.joint[i]
+        d = zc + c_ratio*z2
+        if c_ratio > 0:
+            backward_chain(tape, ma.child[i], lam*c_ratio*z2*z2/(d*d))
+        tape.gratio[i] += lam*(-zc*z2*z2/(d*d))
+        return lam*zc*zc/(d*d)
+    elif c_type == 'BRANCH':
+        m, n, z2 = tape.joint[i]
+        jnt = ma.joint[i]
+        if c_ratio >= 1 or c_ratio <= 0:
+            # main path or child only, derivative by c_ratio is one sided there
+            gt, gz2 = mobius_grad(m if c_ratio >= 1 else n, z2, lam)
+            if c_ratio >= 1:
+                tape.add_product_grad(child_cells(ma, ma.child[i]), gt)
+            else:
+                tape.add_product_grad(range(i + 1, jnt + 1), gt)
+            tape.gratio[i] += np.nan
+            pending[jnt + 1] = pending.get(jnt + 1, 0) + gz2
+            return np.zeros(len(tape.wf), dtype=complex)
+        ma_ = m.copy()
+        na = n.copy()
+        ma_[:, 0, 1] /= c_ratio
+        ma_[:, 1, 0] *= c_ratio
+        na[:, 0, 1] /= (1 - c_ratio)
+        na[:, 1, 0] *= (1 - c_ratio)
+        z, gm, gn, gz2 = branch_values(ma_, na, z2, c_ratio)
+        tape.gratio[i] += lam*(-gm[:, 0, 1]*m[:, 0, 1]/(c_ratio*c_ratio) + gm[:, 1, 0]*m[:, 1, 0]
+                               + gn[:, 0, 1]*n[:, 0, 1]/(1 - c_ratio)**2 - gn[:, 1, 0]*n[:, 1, 0])
+        # derivatives by matrices before area adjustment
+        gm[:, 0, 1] /= c_ratio
+        gm[:, 1, 0] *= c_ratio
+        gn[:, 0, 1] /= (1 - c_ratio)
+        gn[:, 1, 0] *= (1 - c_ratio)
+        gm *= lam[:, np.newaxis, np.newaxis]
+        gn *= lam[:, np.newaxis, np.newaxis]
+        tape.add_product_grad(child_cells(ma, ma.child[i]), gm)
+        tape.add_product_grad(range(i + 1, jnt + 1), gn)
+        pending[jnt + 1] = pending.get(jnt + 1, 0) + lam*gz2
+        return np.zeros(len(tape.wf), dtype=complex)
+    else:
+        return np.zeros(len(tape.wf), dtype=complex)
+
+
+def impedance_grad(wff, men, ctx=None):
+    """Input impedance and its derivatives by parameters of every cell.
+    wff : array of wave frequency, men : Men or MenArray.
+    Returns dict of 'zi' (nfreq) and 'df', 'db', 'r', 'c_ratio' (ncell, nfreq),
+    derivatives by df, db, r (in meter) and c_ratio of each cell of MenArray.
+    Derivative by c_ratio of BRANCH at 0 or 1 is one sided and given as nan.
+    Memory of order ncell * nfreq is used for recording.
+    """
+    if ctx is None:
+        ctx = imped.get_context()
+    if not isinstance(men, xmensur.MenArray):
+        men = xmensur.compile_mensur(men)
+    wf = np.array(wff, dtype=float)
+    wf.setflags(write=False)
+    tape = Tape(wf, men, ctx)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        zi = forward_chain(tape, 0)
+        backward_chain(tape, 0, np.ones(len(wf), dtype=complex))
+
+    zero = wf == 0
+    zi = np.where(zero, 0, zi)
+    for g in (tape.gdf, tape.gdb, tape.gr, tape.gratio):
+        g[:, zero] = 0
+
+    return {'zi': zi, 'df': tape.gdf, 'db': tape.gdb, 'r': tape.gr, 'c_ratio': tape.gratio}
+
+
+def resonance_sensitivity(f0, men, ctx=None, h=0.01):
+    """Shift of resonance frequencies f0 (maxima or minima of impedance magnitude)
+    by parameters of every cell, d(f0)/d(param).
+    h : frequency step (Hz) of differences around f0.
+    Returns dict of 'df', 'db', 'r', 'c_ratio' of shape (len(f0), ncell).
+    """
+    if not isinstance(men, xmensur.MenArray):
+        men = xmensur.compile_mensur(men)
+    f0 = np.asarray(f0, dtype=float)
+    ff = np.concatenate((f0 - h, f0, f0 + h))
+    g = impedance_grad(np.pi*2*ff, men, ctx)
+    zz = g['zi']
+    a2 = np.abs(zz)**2
+    n = len(f0)
+    # f0 is a root of d|Z|^2/df, whose derivative by f is d2 and by param is dp
+    d2 = (a2[2*n:] - 2*a2[n:2*n] + a2[:n])/(h*h)
+    res = {}
+    for key in ('df', 'db', 'r', 'c_ratio'):
+        p = 2*np.real(np.conj(zz)*g[key])  # d|Z|^2/d(param)
+        dp = (p[:, 2*n:] - p[:, :n])/(2*h)
+        res[key] = (-dp/d2).T
+
+    return res
@@ -0,0 +1,163 @@
+"""
+impprof
+opt-in profiling of calculation phases.
+enable() replaces hot path routines of xmensur, imped and impcore backend by
+timing wrappers, and disable() puts the originals back, so nothing is measured
+and there is no overhead while disabled.
+phase(name) measures a block of code, e.g. writing output.
+report() returns wall time and calls of each phase, recursive calls, cells
+evaluated and cache hits since enable().
+Time of a routine includes routines called from it; recursive calls are
+counted but not timed twice. Not thread safe.
+"""
+import importlib
+import json
+import sys
+import time
+
+import imped
+
+# (owner, routine names) instrumented by enable, owners are imported by enable
+# and impcore is the selected backend imped.impcore
+TARGETS = (('xmensur', ('read_mensur_file', 'build_mensur', 'resolve_child_mensur', 'slice_mensur', 'compile_mensur',
+                        'read_mensur_array', 'build_mensur_array')),
+           ('mencache', ('load', 'read_entry', 'store')),
+           ('mensimplify', ('simplify', 'simplify_impedance')),
+           ('impstate.StateImpedance', ('prepare', 'impedance')),
+           ('imped', ('input_impedance', 'calc_impedance', 'child_impedance', 'transmission_matrix', 'radimp',
+                      'input_impedance_array', 'input_impedance_grid', 'calc_impedance_array', 'child_impedance_array',
+                      'chain_impedance_array', 'transmission_array', 'radimp_array',
+                      'calc_pressure', 'calc_pressure_array', 'pressure_map', 'pressure_profile')),
+           ('impcore', ('calc_transmission', 'zo2zi', 'calc_transmission_array', 'zo2zi_array', 'propagate_kernel')))
+
+_enabled = False
+_stats = {}  # phase name -> [time, calls, recursive calls]
+_patched = []  # (owner, attribute, wrapper, state)
+_start = {}  # time and cache info at enable
+
+
+def is_enabled():
+    return _enabled
+
+
+def _add(name, t, calls=1, nested=0):
+    st = _stats.setdefault(name, [0.0, 0, 0])
+    st[0] += t
+    st[1] += calls
+    st[2] += nested
+
+
+def _wrap(owner, attr, name):
+    state = {'func': getattr(owner, attr), 'depth': 0}
+
+    def wrapper(*args, **kwargs):
+        if state['depth']:
+            _add(name, 0.0, 1, 1)
+            return state['func'](*args, **kwargs)
+        state['depth'] = 1
+        t0 = time.perf_counter()
+        try:
+            return state['func'](*args, **kwargs)
+        finally:
+            _add(name, time.perf_counter() - t0)
+            state['depth'] = 0
+            if getattr(owner, attr) is not wrapper:
+                # replaced during the call ( lazy jit of backend )
+                state['func'] = getattr(owner, attr)
+                setattr(owner, attr, wrapper)
+
+    wrapper.__doc__ = state['func'].__doc__
+    setattr(owner, attr, wrapper)
+    _patched.append((owner, attr, wrapper, state))
+
+
+def _resolve(owner):
+    """module or class of dotted name owner, impcore is the backend in use by imped"""
+    if owner == 'impcore':
+        return imped.impcore
+    module, _, attr = owner.partition('.')
+    obj = importlib.import_module(module)
+    return getattr(obj, attr) if attr else obj
+
+
+def enable():
+    """Start profiling, statistics are reset"""
+    global _enabled
+    if _enabled:
+        disable()
+    reset()
+    for owner, names in TARGETS:
+        obj = _resolve(owner)
+        prefix = owner.rpartition('.')[2]
+        for attr in names:
+            if getattr(obj, attr) is not None:  # propagate_kernel is None without compiled kernel
+                _wrap(obj, attr, prefix + '.' + attr)
+    _enabled = True
+
+
+def disable():
+    """Stop profiling and restore original routines. Statistics are kept for report."""
+    global _enabled
+    while _patched:
+        owner, attr, wrapper, state = _patched.pop()
+        if getattr(owner, attr) is wrapper:
+            setattr(owner, attr, state['func'])
+    _enabled = False
+
+
+def reset():
+    _stats.clear()
+    _start['time'] = time.perf_counter()
+    _start['tm'] = imped.tm_cache_info()
+    _start['radimp'] = imped.radimp_cache_info()
+
+
+class phase(object):
+    """Context manager measuring a block as phase name while profiling is enabled"""
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _enabled:
+            self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if _enabled:
+            _add(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+def report():
+    """Returns dict of profiling results since enable(), ready for json.
+    phases : {name: {'time', 'calls', 'recursive'}} of called routines and phase blocks
+    cells : transmission matrices evaluated ( per frequency by calc_transmission,
+            per frequency array by calc_transmission_array ) and chains run by propagate_kernel
+    child_recursions : recursive calls of input impedance for child groups
+    caches : hits and misses of transmission matrix and radiation impedance caches
+    """
+    phases = {k: {'time': v[0], 'calls': v[1], 'recursive': v[2]} for k, v in sorted(_stats.items())}
+
+    def calls(k, i=1):
+        return _stats.get(k, (0, 0, 0))[i]
+    caches = {}
+    for key, info in (('tm', imped.tm_cache_info()), ('radimp', imped.radimp_cache_info())):
+        caches[key] = {k: info[k] - _start[key][k] for k in ('hits', 'misses', 'collapsed') if k in info}
+
+    return {'total': time.perf_counter() - _start['time'],
+            'phases': phases,
+            'cells': {'scalar': calls('impcore.calc_transmission'), 'array': calls('impcore.calc_transmission_array'),
+                      'kernel': calls('impcore.propagate_kernel')},
+            'child_recursions': sum(calls('imped.' + k, 2) for k in ('input_impedance', 'input_impedance_array',
+                                                                    'chain_impedance_array')),
+            'caches': caches}
+
+
+def write_report(dest='-', **extra):
+    """Write report() with extra items as a JSON line to stderr ( dest "-" ) or appended to file dest"""
+    line = json.dumps(dict(report(), **extra))
+    if dest == '-':
+        print(line, file=sys.stderr)
+    else:
+        with open(dest, 'a') as f:
+            f.write(line + '\n')
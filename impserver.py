@@ -0,0 +1,441 @@
+"""
+impserver
+local calculation server keeping parsed mensurs and loaded routines warm.
+Started by calcimpy.py --serve ADDRESS, ADDRESS is "host:port", "port" ( localhost )
+or "unix:/path/to/socket".
+
+request  : POST /impedance, /peaks or /pressure with JSON object of
+           path or xmen ( inline XMEN text ), and optional parameters
+           temperature, radiation, minfreq, maxfreq, stepfreq ( impedance, peaks ),
+           ftol, prominence ( dB, peaks ), freq, pressure ( dBSPL ), step ( mm, 0 for cell ends ), from_tail ( pressure ),
+           format ( 'json' or 'npz' ).
+response : JSON object of result arrays ( complex arrays as name.real and name.imag )
+           and 'timing', or npz of result arrays with timing in X-Calcimpy-Timing header.
+           Errors are JSON {'error': message} with status 400, or 503 when all workers
+           and the queue are busy.
+GET /status returns counts of requests and cache statistics.
+
+Impedance is multiplied by section area of input end as calcimpy.py writes it.
+Mensurs are kept by hash of their source text, so edited files are parsed again.
+"""
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+import concurrent.futures
+import http.client
+import http.server
+from collections import OrderedDict
+import numpy as np
+
+import xmensur as xmn
+import imped
+import mencache
+import resonance
+
+MENSUR_CACHE_SIZE = 64  # number of parsed mensurs kept in memory
+QUEUE_SIZE = 16  # number of requests waiting for workers before 503
+KINDS = ('impedance', 'peaks', 'pressure')
+TIMING_HEADER = 'X-Calcimpy-Timing'
+
+
+class RequestError(ValueError):
+    """Bad request, reported with status 400"""
+
+
+class MensurCache(object):
+    """Thread safe LRU cache of MenArray by source key"""
+    def __init__(self, size=MENSUR_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, raw, path=None):
+        """MenArray of XMEN source raw ( bytes ) and whether it was cached"""
+        key = mencache.source_key(raw)
+        with self.lock:
+            ma = self.items.get(key)
+            if ma is not None:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return ma, True
+            self.misses += 1
+        ma = xmn.build_mensur_array(io.TextIOWrapper(io.BytesIO(raw)), path)
+        with self.lock:
+            self.items[key] = ma
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+        return ma, False
+
+    def info(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.items)}
+
+
+def freq_axis(minfreq, maxfreq, stepfreq):
+    """Frequencies from minfreq to maxfreq by stepfreq, same as calcimpy.py"""
+    nn = int(round((maxfreq - minfreq)/stepfreq)) + 1
+    return np.linspace(minfreq, maxfreq, nn, endpoint=True)
+
+
+def _param(req, name, default, kind=float):
+    try:
+        v = kind(req.get(name, default))
+    except (TypeError, ValueError):
+        raise RequestError('bad value of {0} : {1!r}'.format(name, req.get(name)))
+    if kind is float and not np.isfinite(v):
+        raise RequestError('bad value of {0} : {1!r}'.format(name, req.get(name)))
+    return v
+
+
+def _positive(req, name, default):
+    v = _param(req, name, default)
+    if v <= 0:
+        raise RequestError('{0} must be positive : {1!r}'.format(name, req.get(name)))
+    return v
+
+
+def _freqs(req):
+    """freq of pressure request, a number or a list of numbers >= 0"""
+    v = req.get('freq', 440.0)
+    try:
+        if isinstance(v, (str, bytes, bool, dict)):
+            raise TypeError
+        ff = np.atleast_1d(np.asarray(v, dtype=float))
+    except (TypeError, ValueError):
+        raise RequestError('bad value of freq : {0!r}'.format(v))
+    if ff.ndim != 1 or len(ff) == 0 or not np.all(np.isfinite(ff)) or np.any(ff < 0):
+        raise RequestError('bad value of freq : {0!r}'.format(v))
+    return ff
+
+
+def parse_request(kind, req):
+    """Parameters of request req ( dict ) of kind, checked before calculation.
+    Raises RequestError for unknown kind or bad values."""
+    if kind not in KINDS:
+        raise RequestError('unknown request : ' + str(kind))
+    prm = {'radiation': _param(req, 'radiation', 'PIPE', str), 'temperature': _param(req, 'temperature', 24.0)}
+    if prm['radiation'] not in ('PIPE', 'BAFFLE', 'NONE'):
+        raise RequestError('unknown radiation : ' + prm['radiation'])
+    if kind == 'pressure':
+        prm['freq'] = _freqs(req)
+        prm['pressure'] = _param(req, 'pressure', 60.0)
+        prm['step'] = _param(req, 'step', 1.0)  # 0 for cell ends only, as calcprs.py
+        if prm['step'] < 0:
+            raise RequestError('step must not be negative : {0!r}'.format(req.get('step')))
+        from_tail = req.get('from_tail', False)
+        if not isinstance(from_tail, (bool, int)):
+            raise RequestError('bad value of from_tail : {0!r}'.format(from_tail))
+        prm['from_tail'] = bool(from_tail)
+    else:
+        prm['minfreq'] = _param(req, 'minfreq', 0.0)
+        prm['maxfreq'] = _param(req, 'maxfreq', 2000.0)
+        prm['stepfreq'] = _positive(req, 'stepfreq', 2.5)
+        if prm['minfreq'] < 0 or prm['maxfreq'] < prm['minfreq']:
+            raise RequestError('bad frequency range : {0} - {1}'.format(prm['minfreq'], prm['maxfreq']))
+        if kind == 'peaks':
+            prm['ftol'] = _positive(req, 'ftol', 1.0e-3)
+            prm['prominence'] = _param(req, 'prominence', resonance.PROMINENCE)
+            if prm['prominence'] < 0:
+                raise RequestError('prominence must not be negative : {0!r}'.format(req.get('prominence')))
+    return prm
+
+
+class Calculator(object):
+    """Calculation of requests with warm mensur cache"""
+    def __init__(self, cache_size=MENSUR_CACHE_SIZE):
+        self.mensurs = MensurCache(cache_size)
+        self.lock = threading.Lock()
+        self.counts = {k: 0 for k in KINDS}
+        self.errors = 0
+
+    def warm_up(self):
+        """Import scipy and fill routines used by calculation ( done before first request )"""
+        ma = xmn.build_mensur_array(['[', '10,10,100,', '10,10,0,', ']'])
+        imped.input_impedance_array(np.array([0.0, 100.0]), ma)
+
+    def mensur(self, req):
+        if 'xmen' in req:
+            raw = str(req['xmen']).encode('utf-8')
+            path = None
+        elif 'path' in req:
+            path = str(req['path'])
+            try:
+                with open(path, 'rb') as f:
+                    raw = f.read()
+            except OSError as e:
+                raise RequestError(str(e))
+        else:
+            raise RequestError('path or xmen is required')
+        try:
+            return self.mensurs.get(raw, path)
+        except (xmn.MensurSyntaxError, ValueError, KeyError, IndexError) as e:
+            raise RequestError('{0}: {1}'.format(type(e).__name__, e))
+
+    def calculate(self, kind, req):
+        """Result arrays ( dict of name -> array ) and timing of request req ( dict ) of kind"""
+        prm = parse_request(kind, req)
+        t0 = time.perf_counter()
+        ma, cached = self.mensur(req)
+        t1 = time.perf_counter()
+        ctx = imped.calc_context(prm['temperature'], prm['radiation'])
+        s = ma.df[0]*ma.df[0]*np.pi/4  # section area
+        if kind == 'pressure':
+            ff = prm['freq']
+            p = 2.0e-5*np.power(10.0, prm['pressure']/20.0)  # dBSPL -> Pa
+            pr = imped.pressure_profile(np.pi*2*ff, ma, p, prm['step']/1000.0, prm['from_tail'], ctx)
+            res = dict(freq=ff, **pr._asdict())
+        else:
+            ff = freq_axis(prm['minfreq'], prm['maxfreq'], prm['stepfreq'])
+            if kind == 'peaks':
+                pk = resonance.find_peaks(ff, ma, ctx, prm['ftol'], prm['prominence'])
+                res = {'freq': pk['freq'], 'type': pk['type'], 'imp': s*pk['imp'], 'Q': pk['Q']}
+            else:
+                res = {'freq': ff, 'imp': s*imped.input_impedance_array(np.pi*2*ff, ma, ctx)}
+        t2 = time.perf_counter()
+        with self.lock:
+            self.counts[kind] += 1
+        return res, {'parse': t1 - t0, 'calc': t2 - t1, 'cached': cached}
+
+    def status(self):
+        with self.lock:
+            st = {'requests': dict(self.counts), 'errors': self.errors}
+        st['mensurs'] = self.mensurs.info()
+        st['tm_cache'] = imped.tm_cache_info()
+        st['radimp_cache'] = imped.radimp_cache_info()
+        st['backend'] = imped.impcore.name
+        return st
+
+
+def _tolist(v):
+    """list of array v, nan and inf are None ( null ), which strict JSON allows"""
+    if v.dtype.kind != 'f':
+        return v.tolist()
+    a = v.astype(object)
+    a[~np.isfinite(v)] = None
+    return a.tolist()
+
+
+def encode_json(res, timing):
+    """JSON bytes of result arrays, complex ones split into name.real and name.imag.
+    Values of nan or inf are written as null."""
+    d = {}
+    for k, v in res.items():
+        v = np.asarray(v)
+        if np.iscomplexobj(v):
+            d[k + '.real'] = _tolist(v.real)
+            d[k + '.imag'] = _tolist(v.imag)
+        else:
+            d[k] = _tolist(v)
+    d['timing'] = timing
+    return json.dumps(d, allow_nan=False).encode('utf-8')
+
+
+def _array(v):
+    a = np.array(v)
+    return np.array(v, dtype=float) if a.dtype == object else a
+
+
+def decode_json(body):
+    """Result arrays and timing from JSON bytes of encode_json, null is nan"""
+    d = json.loads(body.decode('utf-8'))
+    timing = d.pop('timing', {})
+    res = {}
+    for k, v in d.items():
+        if k.endswith('.imag'):
+            continue
+        if k.endswith('.real'):
+            res[k[:-5]] = _array(v) + 1j*_array(d[k[:-5] + '.imag'])
+        else:
+            res[k] = _array(v)
+    return res, timing
+
+
+def encode_npz(res):
+    buf = io.BytesIO()
+    np.savez(buf, **res)
+    return buf.getvalue()
+
+
+def decode_npz(body):
+    with np.load(io.BytesIO(body)) as d:
+        return {k: d[k] for k in d.files}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """HTTP handler, server has attributes calc ( Calculator ), pool and slots"""
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status, body, ctype='application/json', timing=None):
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        if timing is not None:
+            self.send_header(TIMING_HEADER, json.dumps(timing))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, msg):
+        with self.server.calc.lock:
+            self.server.calc.errors += 1
+        self.reply(status, json.dumps({'error': msg}).encode('utf-8'))
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self.reply(200, json.dumps(self.server.calc.status()).encode('utf-8'))
+        else:
+            self.error(404, 'not found : ' + self.path)
+
+    def do_POST(self):
+        t0 = time.perf_counter()
+        kind = self.path.strip('/')
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8') or '{}')
+            if not isinstance(req, dict):
+                raise ValueError('request must be a JSON object')
+        except ValueError as e:
+            self.error(400, 'bad request : {0}'.format(e))
+            return
+        fmt = req.get('format', 'json')
+        if fmt not in ('json', 'npz'):
+            self.error(400, 'unknown format : {0}'.format(fmt))
+            return
+        try:
+            parse_request(kind, req)  # bad fields are reported before waiting for a worker
+        except RequestError as e:
+            self.error(400, str(e))
+            return
+        if not self.server.slots.acquire(blocking=False):
+            self.error(503, 'server is busy')
+            return
+        try:
+            fut = self.server.pool.submit(self.server.calc.calculate, kind, req)
+            res, timing = fut.result()
+        except RequestError as e:
+            self.error(400, str(e))
+            return
+        except Exception as e:
+            self.error(500, '{0}: {1}'.format(type(e).__name__, e))
+            return
+        finally:
+            self.server.slots.release()
+        timing['queue'] = time.perf_counter() - t0 - timing['parse'] - timing['calc']
+        if fmt == 'npz':
+            body = encode_npz(res)
+            timing['total'] = time.perf_counter() - t0
+            self.reply(200, body, 'application/octet-stream', timing)
+        else:
+            timing['total'] = time.perf_counter() - t0
+            self.reply(200, encode_json(res, timing))
+
+    def log_message(self, format, *args):
+        pass  # no access log
+
+
+class TCPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # listen backlog, busy server answers 503 instead of refusing
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        conn, addr = super().get_request()
+        return conn, ('unix', 0)  # handler expects (host, port)
+
+
+def parse_address(address):
+    """('unix', path) or ('tcp', (host, port)) of ADDRESS of --serve"""
+    if address.startswith('unix:'):
+        return 'unix', address[5:]
+    host, sep, port = address.rpartition(':')
+    return 'tcp', (host or '127.0.0.1', int(port))
+
+
+def make_server(address, workers=1, queue=QUEUE_SIZE, calc=None):
+    """HTTP server of Calculator calc on address ( see parse_address ) with workers threads.
+    Requests more than workers + queue at once are rejected by 503.
+    """
+    kind, addr = parse_address(address)
+    if kind == 'unix':
+        if os.path.exists(addr):
+            os.unlink(addr)  # left by earlier server
+        server = UnixServer(addr, Handler)
+    else:
+        server = TCPServer(addr, Handler)
+    server.calc = calc or Calculator()
+    server.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    server.slots = threading.BoundedSemaphore(workers + queue)
+    return server
+
+
+def serve(address, workers=1, queue=QUEUE_SIZE):
+    """Run server until interrupted ( SIGINT or SIGTERM )"""
+    server = make_server(address, workers, queue)
+    server.calc.warm_up()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print('calcimpy server on {0}, {1} workers'.format(address, workers), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+        kind, addr = parse_address(address)
+        if kind == 'unix' and os.path.exists(addr):
+            os.unlink(addr)
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class Client(object):
+    """Client of calcimpy server on address ( same as --serve ), keeps one connection.
+    e.g. Client('8765').request('impedance', path='sample/simple.xmen', maxfreq=1000)
+    """
+    def __init__(self, address, timeout=60.0):
+        kind, addr = parse_address(address)
+        if kind == 'unix':
+            self.conn = UnixConnection(addr, timeout)
+        else:
+            self.conn = http.client.HTTPConnection(addr[0], addr[1], timeout=timeout)
+
+    def call(self, method, url, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        self.conn.request(method, url, body, headers)
+        resp = self.conn.getresponse()
+        return resp, resp.read()
+
+    def request(self, kind, **req):
+        """Result arrays ( dict ) and timing of request.
+        Raises RuntimeError with message of server for errors."""
+        resp, body = self.call('POST', '/' + kind, json.dumps(req).encode('utf-8'))
+        if resp.status != 200:
+            raise RuntimeError('{0} : {1}'.format(resp.status, json.loads(body.decode('utf-8'))['error']))
+        if req.get('format') == 'npz':
+            return decode_npz(body), json.loads(resp.getheader(TIMING_HEADER))
+        return decode_json(body)
+
+    def status(self):
+        resp, body = self.call('GET', '/status')
+        return json.loads(body.decode('utf-8'))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,218 @@
+"""
+impstate
+input impedance of one mensur for many states ( fingerings of tone holes,
+valve combinations ), which differ only in c_ratio of joints.
+A state is a dict of child group name -> c_ratio, applied to every joint cell
+referring that group ( e.g. both BRANCH and MERGE of a valve ).
+
+StateImpedance keeps transmission matrices of plain cells between joints and of
+child chains used by BRANCH, which do not depend on states. Impedance of each state
+is calculated joint by joint from the end, and results downstream of a joint are
+kept by ratios of joints after it, so states sharing the tail of the bore reuse
+them, as well as child chains of unchanged ratios.
+"""
+import numpy as np
+
+import xmensur as xmn
+import imped
+
+
+def read_states(path):
+    """Read table of states from CSV file path.
+    First line is names of child groups, a column named 'state' gives labels of states
+    ( row numbers are used without it ). Values are numbers or expressions of XMEN
+    like OPEN, CLOSE, HALF. Lines starting with # are ignored.
+    Returns list of (label, dict of name -> c_ratio).
+    """
+    env = xmn.new_variables()
+    states = []
+    names = None
+    with open(path) as f:
+        for lineno, ln in enumerate(f, 1):
+            ln = ln.strip()
+            if not ln or ln.startswith('#'):
+                continue
+            cols = [c.strip() for c in ln.split(',')]
+            if names is None:
+                names = cols
+                continue
+            if len(cols) != len(names):
+                raise xmn.MensurSyntaxError('{0} values for {1} columns'.format(len(cols), len(names)), lineno, path)
+            label = str(len(states))
+            st = {}
+            for name, c in zip(names, cols):
+                if name == 'state':
+                    label = c
+                else:
+                    try:
+                        st[name] = xmn.evaluate(c, env)
+                    except (ValueError, SyntaxError, NameError, ArithmeticError) as e:
+                        raise xmn.MensurSyntaxError(str(e), lineno, path)
+            states.append((label, st))
+    return states
+
+
+def joint_names(ma):
+    """names of child groups referred by joints of MenArray ma, which states can set"""
+    return {name for i, name in ma.c_name.items() if ma.child[i] >= 0}
+
+
+def check_states(ma, states):
+    """Raise ValueError if a state of states ( list of dict ) has names not in joint_names(ma)"""
+    unknown = set().union(*states) - joint_names(ma)
+    if unknown:
+        raise ValueError('no joint refers child group : ' + ', '.join(sorted(unknown)))
+
+
+def matmul2(a, b):
+    """product of arrays of 2x2 matrices, faster than np.matmul for them"""
+    c = np.empty(np.broadcast_shapes(a.shape, b.shape), dtype=complex)
+    c[:, 0, 0] = a[:, 0, 0]*b[:, 0, 0] + a[:, 0, 1]*b[:, 1, 0]
+    c[:, 0, 1] = a[:, 0, 0]*b[:, 0, 1] + a[:, 0, 1]*b[:, 1, 1]
+    c[:, 1, 0] = a[:, 1, 0]*b[:, 0, 0] + a[:, 1, 1]*b[:, 1, 0]
+    c[:, 1, 1] = a[:, 1, 0]*b[:, 0, 1] + a[:, 1, 1]*b[:, 1, 1]
+    return c
+
+
+class StateImpedance(object):
+    """Input impedance of MenArray ma for frequency array wff under states of c_ratio.
+    Results are the same as input_impedance_array of ma with c_ratio set by the state.
+    """
+    def __init__(self, wff, ma, ctx=None):
+        self.wf = np.array(wff, dtype=float)
+        self.wf.setflags(write=False)
+        self.ma = ma
+        self.ctx = imped.get_context() if ctx is None else ctx
+        self.memo = {}  # (chain top, joint, ratios downstream) -> (impedance, impedances after MERGE)
+        self.chains = {}
+        self.hits = 0
+        self.misses = 0
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            self.prepare(0)
+
+    def product(self, cells):
+        """transmission matrix of cells in order of multiplication,
+        runs of identical cells are collapsed into one matrix power"""
+        ma = self.ma
+        m = np.broadcast_to(np.eye(2, dtype=complex), (len(self.wf), 2, 2))
+        k = len(cells) - 1
+        while k >= 0:
+            i = cells[k]
+            n = 1
+            if ma.r[i] > 0:
+                while k - n >= 0 and (ma.df[cells[k - n]], ma.db[cells[k - n]], ma.r[cells[k - n]]) == (
+                        ma.df[i], ma.db[i], ma.r[i]):
+                    n += 1
+                m = matmul2(imped.transmission_array(self.wf, ma.df[i], ma.db[i], ma.r[i], self.ctx, n), m)
+            k -= n
+        return m
+
+    def prepare(self, top):
+        """state independent data of chain starting at top and its child chains.
+        Returns joint cells of the chain and its children ( which ratios affect it ).
+        """
+        if top in self.chains:
+            return self.chains[top]['all']
+        ma = self.ma
+        end = ma.end[top]
+        joints = [i for i in range(top, end + 1) if ma.child[i] >= 0]
+        targets = set(ma.joint[top:end + 1]) - {-1}
+        specials = sorted(set(joints) | targets, reverse=True)
+        ch = {'specials': specials, 'targets': targets, 'all': []}
+        self.chains[top] = ch
+        # matrices of plain cells after each special cell, and before the first one
+        ch['seg'] = {}
+        lo = end
+        for s in specials:
+            ch['seg'][s] = self.product(list(range(s + 1, lo + 1))) if lo > s else None
+            lo = s - 1
+        ch['head'] = self.product(list(range(top, lo + 1))) if lo >= top else None
+        if not specials:
+            ch['tail'] = self.product(list(range(top, end + 1)))
+        ch['tm'] = {s: imped.transmission_array(self.wf, ma.df[s], ma.db[s], ma.r[s], self.ctx)
+                    for s in specials if ma.r[s] > 0}
+        ch['n'] = {}
+        ch['child'] = {}
+        # joints after each special cell and their child chains, keys of memo
+        ch['down'] = {}
+        down = []
+        for s in specials:
+            if ma.child[s] >= 0:
+                c_type = xmn.C_TYPES[ma.c_type[s]]
+                if c_type == 'SPLIT':
+                    down = down + self.prepare(ma.child[s])
+                if c_type in ('BRANCH', 'ADDON'):
+                    m = imped.chain_matrix_array(self.wf, ma, ma.child[s], self.ctx)
+                    m.setflags(write=False)
+                    ch['child'][s] = m
+                    if c_type == 'BRANCH':
+                        ch['n'][s] = self.product(list(range(s + 1, ma.joint[s] + 1)))
+                down = down + [s]
+            ch['down'][s] = np.array(down, dtype=np.int64)
+        ch['all'] = down
+        return down
+
+    def ratios(self, state):
+        """c_ratio of all cells with state applied"""
+        check_states(self.ma, [state])
+        ratio = self.ma.c_ratio.copy()
+        for i, name in self.ma.c_name.items():
+            if name in state:
+                ratio[i] = state[name]
+        return ratio
+
+    def chain(self, top, ratio):
+        """input impedance of chain starting at top under c_ratio ratio"""
+        ma, wf, ch = self.ma, self.wf, self.chains[top]
+        specials = ch['specials']
+        if not specials:
+            return imped.impcore.zo2zi_array(ch['tail'], imped.radimp_array(wf, ma.df[ma.end[top]], self.ctx))
+        keys = [tuple(ratio[ch['down'][s]]) for s in specials]
+        # start from the most upstream joint already calculated with the same ratios after it
+        start = 0
+        z, zj = None, {}
+        for k in range(len(specials) - 1, -1, -1):
+            v = self.memo.get((top, specials[k], keys[k]))
+            if v is not None:
+                z, zj = v
+                start = k + 1
+                self.hits += 1
+                break
+        if z is None:
+            z = imped.radimp_array(wf, ma.df[ma.end[top]], self.ctx)
+        for k in range(start, len(specials)):
+            self.misses += 1
+            s = specials[k]
+            if ch['seg'][s] is not None:
+                z = imped.impcore.zo2zi_array(ch['seg'][s], z)
+            if s in ch['targets']:
+                zj = dict(zj)
+                zj[s] = z
+            if ma.child[s] >= 0:
+                c_type = xmn.C_TYPES[ma.c_type[s]]
+                child = ch['child'].get(s)
+                if c_type == 'SPLIT' and ratio[s] != 0:
+                    child = self.chain(ma.child[s], ratio)
+                jnt = ma.joint[s]
+                z2 = zj[jnt] if c_type == 'BRANCH' else z
+                z = imped.joint_impedance_array(wf, ma, s, z2, ch['n'].get(s), self.ctx, ratio[s], child)
+            if s in ch['tm']:
+                z = imped.impcore.zo2zi_array(ch['tm'][s], z)
+            self.memo[(top, s, keys[k])] = (z, zj)
+        if ch['head'] is not None:
+            z = imped.impcore.zo2zi_array(ch['head'], z)
+        return z
+
+    def impedance(self, state):
+        """input impedance for state ( dict of child group name -> c_ratio )"""
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            zi = self.chain(0, self.ratios(state))
+        return np.where(self.wf == 0, 0, zi)
+
+
+def input_impedance_states(wff, ma, states, ctx=None):
+    """input impedance of MenArray ma for every state in states ( list of dict ),
+    array of shape (len(states), len(wff))."""
+    check_states(ma, states)
+    si = StateImpedance(wff, ma, ctx)
+    return np.array([si.impedance(st) for st in states])
@@ -0,0 +1,187 @@
+"""
+mencache
+on-disk cache of parsed and resolved mensurs.
+load(path) returns MenArray of XMEN file path. The first load parses the file and
+stores the arrays in cache directory, later loads of the same source memory-map the
+stored file instead of parsing.
+Entries are named by sha256 of the source text and xmensur.PARSER_VERSION, so an
+edited source or a newer parser never hits a stale entry. Entries of other versions
+and broken files are removed, and the least recently used entries are evicted when
+the directory exceeds size limit.
+
+entry file : MAGIC, header length (uint64 little endian), JSON header
+             ( version, key, cells, c_name, source ) and FIELDS of MenArray
+             stored one after another, each aligned to 8 bytes.
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+import numpy as np
+
+import xmensur as xmn
+
+MAGIC = b'CIMPMEN1'
+SUFFIX = '.men'
+FIELDS = (('df', '<f8'), ('db', '<f8'), ('r', '<f8'), ('c_ratio', '<f8'),
+          ('next', '<i4'), ('prev', '<i4'), ('child', '<i4'), ('parent', '<i4'),
+          ('joint', '<i4'), ('end', '<i4'), ('c_type', '<i1'))
+CACHE_LIMIT = 256*2**20  # bytes, default size limit of cache directory
+
+
+def cache_dir():
+    """Default cache directory, CALCIMPY_CACHE environment variable or ~/.cache/calcimpy"""
+    return os.environ.get('CALCIMPY_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', 'calcimpy')
+
+
+def _prefix():
+    return 'men{0}-'.format(xmn.PARSER_VERSION)
+
+
+def source_key(text):
+    """Cache key of XMEN source text ( str or bytes )"""
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    h = hashlib.sha256(_prefix().encode('ascii'))
+    h.update(text)
+    return h.hexdigest()
+
+
+def entry_path(key, cdir=None):
+    return os.path.join(cdir or cache_dir(), _prefix() + key + SUFFIX)
+
+
+def _align(n):
+    return (n + 7)//8*8
+
+
+def write_entry(fout, ma, key, source=''):
+    """Write MenArray ma to binary file object fout"""
+    n = len(ma)
+    head = json.dumps({'version': xmn.PARSER_VERSION, 'key': key, 'cells': n, 'source': source,
+                       'c_name': [[int(k), v] for k, v in sorted(ma.c_name.items())]}).encode('utf-8')
+    start = _align(len(MAGIC) + 8 + len(head))
+    fout.write(MAGIC + np.array(len(head), dtype='<u8').tobytes() + head + b'\0'*(start - len(MAGIC) - 8 - len(head)))
+    for name, dt in FIELDS:
+        b = np.ascontiguousarray(getattr(ma, name), dtype=dt).tobytes()
+        fout.write(b + b'\0'*(_align(len(b)) - len(b)))
+
+
+def read_entry(path, key=None):
+    """MenArray memory-mapped from entry file path ( copy on write ).
+    Raises ValueError if the file is broken or of other version or key.
+    """
+    mm = np.memmap(path, dtype=np.uint8, mode='c')
+    if len(mm) < len(MAGIC) + 8 or mm[:len(MAGIC)].tobytes() != MAGIC:
+        raise ValueError('not a mensur cache file : ' + path)
+    hl = int(mm[len(MAGIC):len(MAGIC) + 8].view('<u8')[0])
+    try:
+        head = json.loads(mm[len(MAGIC) + 8:len(MAGIC) + 8 + hl].tobytes().decode('utf-8'))
+    except ValueError:
+        raise ValueError('broken header of mensur cache file : ' + path)
+    if head.get('version') != xmn.PARSER_VERSION or (key is not None and head.get('key') != key):
+        raise ValueError('stale mensur cache file : ' + path)
+
+    n = head['cells']
+    ma = xmn.MenArray(0)
+    pos = _align(len(MAGIC) + 8 + hl)
+    for name, dt in FIELDS:
+        size = n*np.dtype(dt).itemsize
+        if pos + size > len(mm):
+            raise ValueError('truncated mensur cache file : ' + path)
+        setattr(ma, name, mm[pos:pos + size].view(dt))
+        pos += _align(size)
+    ma.c_name = {k: v for k, v in head['c_name']}
+    return ma
+
+
+def store(ma, key, cdir=None, source='', limit=None):
+    """Store MenArray ma as entry of key, then evict old entries over limit. Returns entry path."""
+    cdir = cdir or cache_dir()
+    os.makedirs(cdir, exist_ok=True)
+    path = entry_path(key, cdir)
+    # written to a temporary file and renamed, readers never see a partial entry
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=cdir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_entry(f, ma, key, source)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    evict(cdir, limit)
+    return path
+
+
+def entries(cdir=None):
+    """List of (path, size, mtime) of cache files in cdir"""
+    cdir = cdir or cache_dir()
+    res = []
+    if os.path.isdir(cdir):
+        for e in os.scandir(cdir):
+            if e.is_file() and e.name.startswith('men') and e.name.endswith(SUFFIX):
+                st = e.stat()
+                res.append((e.path, st.st_size, st.st_mtime))
+    return res
+
+
+def evict(cdir=None, limit=None):
+    """Remove entries of other parser versions, then least recently used entries
+    until total size is within limit ( CACHE_LIMIT if None ). Returns number of removed files.
+    """
+    limit = CACHE_LIMIT if limit is None else limit
+    cur, old = [], []
+    for e in entries(cdir):
+        (cur if os.path.basename(e[0]).startswith(_prefix()) else old).append(e)
+    total = sum(e[1] for e in cur)
+    cur.sort(key=lambda e: e[2])
+    while cur and total > limit:
+        old.append(cur.pop(0))
+        total -= old[-1][1]
+    removed = 0
+    for e in old:
+        try:
+            os.unlink(e[0])
+            removed += 1
+        except OSError:
+            pass  # removed by another process
+    return removed
+
+
+def clear(cdir=None):
+    """Remove all entries"""
+    return evict(cdir, 0)
+
+
+def cache_info(cdir=None):
+    """dict of number of entries 'files' and total 'bytes' in cdir"""
+    ent = entries(cdir)
+    return {'files': len(ent), 'bytes': sum(e[1] for e in ent)}
+
+
+def load(path, cdir=None, limit=None):
+    """MenArray of XMEN file path, from cache directory cdir if stored there.
+    Otherwise the file is parsed by xmensur.build_mensur_array and stored.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    key = source_key(raw)
+    epath = entry_path(key, cdir)
+    if os.path.exists(epath):
+        try:
+            ma = read_entry(epath, key)
+            os.utime(epath)  # recently used
+            return ma
+        except (ValueError, OSError):
+            try:
+                os.unlink(epath)
+            except OSError:
+                pass
+
+    ma = xmn.build_mensur_array(io.TextIOWrapper(io.BytesIO(raw)), path)  # decoded as open() does
+    try:
+        store(ma, key, cdir, os.path.abspath(path), limit)
+    except OSError:
+        pass  # cache is not writable, still returns result
+    return ma
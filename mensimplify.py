@@ -0,0 +1,206 @@
+"""
+mensimplify
+error bounded simplification of MenArray before calculation.
+Runs of adjacent plain cells ( r > 0, no child ) are merged into single cone cells
+while the diameter of the merged cone stays within tol of the original bore at every
+cell end, and its mean diameter within tol of the diameter giving the same wall loss.
+Joints ( SPLIT, BRANCH, MERGE, INSERT ), zero length cells, chain tops and ends are
+kept as they are, so child groups and c_ratio states work unchanged, and end cells
+keep the diameter of radiation.
+
+simplify(ma, tol) merges by diameter tolerance ( meter ).
+simplify_impedance(ma, wf, ztol) searches the largest diameter tolerance whose
+input impedance differs at most ztol ( relative to max |Z| ) over wf.
+Both return the new MenArray and SimplifyInfo of cells, removed cells, tolerance,
+achieved diameter error and impedance error ( None if not evaluated ).
+"""
+from collections import namedtuple
+import numpy as np
+
+import xmensur as xmn
+import imped
+
+SimplifyInfo = namedtuple('SimplifyInfo', ('cells', 'removed', 'tol', 'error', 'imp_error'))
+SEARCH_STEPS = 12  # bisection steps of simplify_impedance, tolerance is found within 0.5 %
+
+
+def mergeable(ma):
+    """Cells which can be merged with neighbours in their chain"""
+    ok = (ma.r > 0) & (ma.c_type == 0) & (ma.child < 0)
+    # end cell of chain gives diameter of radiation ( radimp_array of df[end] )
+    ok &= ma.end != np.arange(len(ma))
+    # end of group referred by MERGE keeps its own cell, parent of top is not overwritten
+    ok &= ~((ma.parent >= 0) & (ma.prev >= 0))
+    return ok
+
+
+def cone_error(x, df, db, i, j):
+    """Error of a cone from df[i] to db[j] replacing cells i..j ( x is position of input
+    ends and the output end of j at x[j + 1] ). Max of diameter difference at cell ends
+    and difference of wall loss diameter, mean diameter of the cone against the length
+    weighted harmonic mean of mean diameters of cells ( wall loss goes by r/d )."""
+    a = x[i:j + 1]
+    b = x[i + 1:j + 2]
+    slope = (db[j] - df[i])/(x[j + 1] - x[i])
+    ef = np.abs(df[i] + slope*(a - x[i]) - df[i:j + 1])
+    eb = np.abs(df[i] + slope*(b - x[i]) - db[i:j + 1])
+    dl = (x[j + 1] - x[i])/np.sum((b - a)*2/(df[i:j + 1] + db[i:j + 1]))
+    return max(ef.max(), eb.max(), abs((df[i] + db[j])*0.5 - dl))
+
+
+def merge_run(x, df, db, tol):
+    """Greedy segments (first, last, error) of one run of cells, each within tol.
+    A segment is extended in O(1) by keeping the interval of slopes from df[first] which
+    pass within tol of every cell end so far, and the sum of wall loss r/d,
+    so a run is done in O(n). Error of each segment is by cone_error.
+    """
+    segs = []
+    n = len(df)
+    i = 0
+    while i < n:
+        lo, hi = -np.inf, np.inf
+        loss = (x[i + 1] - x[i])*2/(df[i] + db[i])
+        lo, hi = bound(lo, hi, x[i + 1] - x[i], db[i] - df[i], tol)
+        j = i
+        while j + 1 < n:
+            k = j + 1
+            length = x[k + 1] - x[i]
+            # diameters at both ends of cell k, the input end may differ from db[j]
+            lo2, hi2 = bound(lo, hi, x[k] - x[i], df[k] - df[i], tol)
+            lo2, hi2 = bound(lo2, hi2, length, db[k] - df[i], tol)
+            loss2 = loss + (x[k + 1] - x[k])*2/(df[k] + db[k])
+            slope = (db[k] - df[i])/length
+            if not lo2 <= slope <= hi2 or abs((df[i] + db[k])*0.5 - length/loss2) > tol:
+                break
+            lo, hi, loss = lo2, hi2, loss2
+            j = k
+        segs.append((i, j, cone_error(x, df, db, i, j) if j > i else 0.0))
+        i = j + 1
+    return segs
+
+
+def bound(lo, hi, dx, dd, tol):
+    """Narrow slope interval (lo, hi) by a point dx after the first cell end, at diameter
+    dd from it, which the cone must pass within tol"""
+    if dx <= 0:
+        return lo, hi
+    return max(lo, (dd - tol)/dx), min(hi, (dd + tol)/dx)
+
+
+def segments(ma, tol):
+    """List of (first, last, error) of cells of ma in index order, merged within tol"""
+    ok = mergeable(ma)
+    segs = []
+    i = 0
+    n = len(ma)
+    while i < n:
+        if not ok[i]:
+            segs.append((i, i, 0.0))
+            i += 1
+            continue
+        # run of mergeable cells inside one chain
+        j = i
+        while j + 1 < n and ok[j + 1] and ma.next[j] == j + 1:
+            j += 1
+        r = ma.r[i:j + 1]
+        x = np.concatenate(([0.0], np.cumsum(r)))
+        for a, b, e in merge_run(x, ma.df[i:j + 1], ma.db[i:j + 1], tol):
+            segs.append((i + a, i + b, e))
+        i = j + 1
+    return segs
+
+
+def cell_map(n, segs):
+    """index of segment of each of n cells"""
+    new = np.empty(n, dtype=np.int32)
+    for k, (a, b, e) in enumerate(segs):
+        new[a:b + 1] = k
+    return new
+
+
+def radiation_error(ma, out, segs):
+    """Max change of diameter of radiation, df of chain end cells"""
+    ends = np.unique(ma.end)
+    return float(np.max(np.abs(out.df[cell_map(len(ma), segs)[ends]] - ma.df[ends]), initial=0.0))
+
+
+def rebuild(ma, segs):
+    """MenArray of segments (first, last, error) of ma"""
+    first = np.array([s[0] for s in segs], dtype=np.int64)
+    last = np.array([s[1] for s in segs], dtype=np.int64)
+    new = cell_map(len(ma), segs)
+
+    def remap(idx):
+        return np.where(idx >= 0, new[np.maximum(idx, 0)], -1).astype(np.int32)
+
+    out = xmn.MenArray(len(segs))
+    out.df[:] = ma.df[first]
+    out.db[:] = ma.db[last]
+    cr = np.concatenate(([0.0], np.cumsum(ma.r)))
+    out.r[:] = cr[last + 1] - cr[first]
+    out.r[first == last] = ma.r[first[first == last]]  # single cells keep exact length
+    out.next[:] = remap(ma.next[last])
+    out.prev[:] = remap(ma.prev[first])
+    out.child[:] = remap(ma.child[first])
+    out.parent[:] = remap(np.where(ma.parent[last] >= 0, ma.parent[last], ma.parent[first]))
+    out.joint[:] = remap(ma.joint[first])
+    out.end[:] = remap(ma.end[first])
+    out.c_type[:] = ma.c_type[first]
+    out.c_ratio[:] = ma.c_ratio[first]
+    out.c_name = {int(new[i]): name for i, name in ma.c_name.items()}
+    return out
+
+
+def simplify(ma, tol):
+    """Merge adjacent plain cells of ma into cones within diameter tolerance tol ( meter ).
+    Returns (MenArray, SimplifyInfo). ma is not changed.
+    error of SimplifyInfo includes change of diameter of radiation at chain ends.
+    """
+    segs = segments(ma, tol)
+    out = rebuild(ma, segs)
+    err = max(max((s[2] for s in segs), default=0.0), radiation_error(ma, out, segs))
+    return out, SimplifyInfo(len(out), len(ma) - len(out), tol, err, None)
+
+
+def impedance_error(z, zs):
+    """Max |zs - z| relative to max |z| over finite values of z"""
+    ok = np.isfinite(z)
+    if not ok.any():
+        return 0.0
+    scale = np.max(np.abs(z[ok]))
+    if scale == 0:
+        return 0.0
+    return float(np.max(np.abs(zs[ok] - z[ok]))/scale)
+
+
+def simplify_impedance(ma, wf, ztol, ctx=None):
+    """Simplify ma by the largest diameter tolerance whose input impedance over angular
+    frequencies wf differs at most ztol ( relative to max |Z| ) from that of ma.
+    Tolerance is searched by bisection in log scale between 1e-9 m and the largest
+    diameter. Returns (MenArray, SimplifyInfo) with imp_error of the result, ma itself
+    if no tolerance is within ztol.
+    """
+    with np.errstate(all='ignore'):
+        z = imped.input_impedance_array(wf, ma, ctx)
+
+    def trial(tol):
+        out, info = simplify(ma, tol)
+        with np.errstate(all='ignore'):
+            zs = imped.input_impedance_array(wf, out, ctx)
+        return out, info._replace(imp_error=impedance_error(z, zs))
+
+    best = ma, SimplifyInfo(len(ma), 0, 0.0, 0.0, 0.0)
+    lo, hi = np.log(1e-9), np.log(max(ma.df.max(), ma.db.max(), 1e-9))
+    res = trial(np.exp(hi))
+    if res[1].imp_error <= ztol:
+        return res
+    for _ in range(SEARCH_STEPS):
+        mid = (lo + hi)*0.5
+        res = trial(np.exp(mid))
+        if res[1].imp_error <= ztol:
+            lo = mid
+            if res[1].cells <= best[1].cells:
+                best = res
+        else:
+            hi = mid
+    return best
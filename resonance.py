@@ -0,0 +1,173 @@
+"""
+resonance
+peak search of input impedance by adaptive frequency sampling
+"""
+import numpy as np
+
+import imped
+
+GOLD = (np.sqrt(5) - 1)/2  # golden section ratio
+PHASE_STEP = np.pi/8  # largest phase change of impedance between points of refined grid
+CURVATURE = 0.05  # largest second difference of log |Z| at points of refined grid
+MAX_LEVEL = 8  # halvings of coarse grid step by refine_grid
+PROMINENCE = 0.5  # dB, least prominence of peaks
+
+
+class Counter(object):
+    """Magnitude of input impedance as a function of frequency, counting evaluations"""
+    def __init__(self, men, ctx=None):
+        self.men = men
+        self.ctx = ctx
+        self.nev = 0
+
+    def impedance(self, ff):
+        self.nev += len(ff)
+        return imped.input_impedance_array(np.pi*2*ff, self.men, self.ctx)
+
+    def __call__(self, ff):
+        return np.abs(self.impedance(ff))
+
+
+def refine_grid(ff, zz, fun, ftol):
+    """Insert midpoints into intervals of ff where phase of zz changes more than PHASE_STEP
+    or log |zz| bends more than CURVATURE, until MAX_LEVEL halvings or intervals of 2*ftol.
+    Narrow resonances between coarse points are found by the phase turning over them.
+    Returns refined ff and zz.
+    """
+    for level in range(MAX_LEVEL):
+        mg = np.abs(zz)
+        ok = mg > 0  # zero at wf = 0 has no phase
+        flag = ok[1:] & ok[:-1] & (np.abs(np.angle(zz[1:]*np.conj(zz[:-1]))) > PHASE_STEP)
+        with np.errstate(divide='ignore'):
+            lm = np.log(mg)
+        bend = ok[2:] & ok[1:-1] & ok[:-2] & (np.abs(lm[2:] - 2*lm[1:-1] + lm[:-2]) > CURVATURE)
+        flag[1:] |= bend
+        flag[:-1] |= bend
+        flag &= np.diff(ff) > 2*ftol
+        if not flag.any():
+            break
+        fm = (ff[:-1][flag] + ff[1:][flag])*0.5
+        idx = np.argsort(np.concatenate((ff, fm)), kind='stable')
+        ff = np.concatenate((ff, fm))[idx]
+        zz = np.concatenate((zz, fun.impedance(fm)))[idx]
+
+    return ff, zz
+
+
+def prominence(lm, i):
+    """Prominence of maxima i of lm, height over the higher of the lowest points on both
+    sides up to a higher point or the end of lm ( as scipy.signal.peak_prominences )"""
+    pr = np.empty(len(i))
+    for k, j in enumerate(i):
+        higher = np.flatnonzero(lm[:j] > lm[j])
+        left = lm[higher[-1] + 1 if len(higher) else 0:j + 1].min()
+        higher = np.flatnonzero(lm[j + 1:] > lm[j])
+        right = lm[j:j + 1 + higher[0] if len(higher) else len(lm)].min()
+        pr[k] = lm[j] - max(left, right)
+
+    return pr
+
+
+def golden_search(fun, a, b, tol):
+    """Minimize fun in every bracket [a, b] at once by golden section search.
+    fun takes and returns arrays.
+    """
+    a = np.array(a, dtype=float)
+    b = np.array(b, dtype=float)
+    c = b - GOLD*(b - a)
+    d = a + GOLD*(b - a)
+    fcd = fun(np.concatenate((c, d)))
+    fc, fd = fcd[:len(c)], fcd[len(c):]
+    while len(a) and np.max(b - a) > tol:
+        left = fc < fd  # minimum is in [a, d]
+        b = np.where(left, d, b)
+        a = np.where(left, a, c)
+        c, d = np.where(left, b - GOLD*(b - a), d), np.where(left, c, a + GOLD*(b - a))
+        fc, fd = np.where(left, 0, fd), np.where(left, fc, 0)
+        fn = fun(np.where(left, c, d))
+        fc = np.where(left, fn, fc)
+        fd = np.where(left, fd, fn)
+
+    return (a + b)*0.5
+
+
+def bisect_search(fun, a, b, tol):
+    """Find crossing of zero of fun in every bracket [a, b] at once by bisection.
+    fun(a) and fun(b) must have opposite signs.
+    """
+    a = np.array(a, dtype=float)
+    b = np.array(b, dtype=float)
+    sa = np.sign(fun(a))
+    while len(a) and np.max(np.abs(b - a)) > tol:
+        m = (a + b)*0.5
+        sm = np.sign(fun(m))
+        same = sm == sa
+        a = np.where(same, m, a)
+        b = np.where(same, b, m)
+
+    return (a + b)*0.5
+
+
+def half_power(ff, mg, i, f0, thr, above, fun, tol):
+    """Frequencies of half power points on both sides of peak i of coarse mg.
+    above : True if mg goes above thr out of the peak (minimum).
+    Returns array of (left, right), nan when not found in ff.
+    """
+    fl = np.full(len(i), np.nan)
+    fr = np.full(len(i), np.nan)
+    br = []  # brackets (peak, side, a, b)
+    for k, j in enumerate(i):
+        out = mg > thr[k] if above else mg < thr[k]
+        jl = np.flatnonzero(out[:j])
+        jr = np.flatnonzero(out[j + 1:])
+        if len(jl):
+            br.append((k, 0, ff[jl[-1]], f0[k]))
+        if len(jr):
+            br.append((k, 1, f0[k], ff[j + 1 + jr[0]]))
+    if br:
+        kk, side, a, b = [np.array(v) for v in zip(*br)]
+        th = thr[kk]
+        f = bisect_search(lambda x: fun(x) - th, a, b, tol)
+        fl[kk[side == 0]] = f[side == 0]
+        fr[kk[side == 1]] = f[side == 1]
+
+    return fl, fr
+
+
+def find_peaks(ff, men, ctx=None, ftol=1.0e-3, min_prominence=PROMINENCE):
+    """Search maxima and minima of input impedance magnitude.
+    ff : coarse frequency grid, men : Men or MenArray.
+    ff is refined where impedance turns ( refine_grid ), peaks of less than
+    min_prominence (dB) are dropped and the others are refined until ftol (Hz).
+    Returns dict of arrays 'freq', 'type' (1: maximum, -1: minimum), 'imp' (complex),
+    'Q' (f0 / half power band width) and number of evaluations 'nev'.
+    """
+    fun = Counter(men, ctx)
+    ff = np.asarray(ff, dtype=float)
+    ff, zz = refine_grid(ff, fun.impedance(ff), fun, ftol)
+    mg = np.abs(zz)
+
+    imax = np.flatnonzero((mg[1:-1] > mg[:-2]) & (mg[1:-1] >= mg[2:])) + 1
+    imin = np.flatnonzero((mg[1:-1] < mg[:-2]) & (mg[1:-1] <= mg[2:]) & (mg[1:-1] > 0)) + 1
+    with np.errstate(divide='ignore'):
+        db = 20*np.log10(mg)
+    imax = imax[prominence(db, imax) >= min_prominence]
+    imin = imin[prominence(-db, imin) >= min_prominence]
+
+    fmax = golden_search(lambda x: -fun(x), ff[imax - 1], ff[imax + 1], ftol)
+    fmin = golden_search(fun, ff[imin - 1], ff[imin + 1], ftol)
+
+    f0 = np.concatenate((fmax, fmin))
+    tp = np.concatenate((np.ones(len(fmax), dtype=int), -np.ones(len(fmin), dtype=int)))
+    z0 = imped.input_impedance_array(np.pi*2*f0, men, ctx)
+    fun.nev += len(f0)
+    a0 = np.abs(z0)
+
+    nx = len(fmax)
+    fl = np.full(len(f0), np.nan)
+    fr = np.full(len(f0), np.nan)
+    fl[:nx], fr[:nx] = half_power(ff, mg, imax, fmax, a0[:nx]/np.sqrt(2), False, fun, ftol)
+    fl[nx:], fr[nx:] = half_power(ff, mg, imin, fmin, a0[nx:]*np.sqrt(2), True, fun, ftol)
+
+    idx = np.argsort(f0)
+    return {'freq': f0[idx], 'type': tp[idx], 'imp': z0[idx], 'Q': (f0/(fr - fl))[idx], 'nev': fun.nev}
@@ -54,9 +54,9 @@ if __name__ == "__main__" :
             wff = np.pi*2*ff
             s = mentop.df*mentop.df*np.pi/4 # section area 
             for i in np.arange(nn,dtype = int):
-                imped.input_impedance(wff[i],mentop)
+                zi = imped.input_impedance(wff[i],mentop)
                 # output impedance density
-                print(ff[i],',',np.real(mentop.zi)*s,',',np.imag(mentop.zi)*s)
+                print(ff[i],',',np.real(zi)*s,',',np.imag(zi)*s)
                 # print(ff[i])
 
         elif args.calculation == 'RI':
@@ -0,0 +1,29 @@
+"""
+common setup of tests, run by "python -m pytest tests" at the top directory.
+modules of calcimpy are imported from the parent directory.
+"""
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import imped  # noqa: E402
+
+SAMPLES = ('simple', 'split', 'branch', 'subgroup', 'sample')
+
+
+def sample_path(name):
+    """path of sample/name.xmen"""
+    return os.path.join(ROOT, 'sample', name + '.xmen')
+
+
+@pytest.fixture(autouse=True)
+def default_params():
+    """every test starts from default parameters and empty caches"""
+    imped.set_params(24.0, 0.0, 2000.0, 2.5, rad='PIPE')
+    imped.clear_tm_cache()
+    imped.clear_radimp_cache()
+    yield
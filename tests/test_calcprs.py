@@ -0,0 +1,83 @@
+"""calcprs.py pressure maps in csv and npz and --profile, against imped.pressure_profile"""
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+import calcprs
+from conftest import sample_path, ROOT
+
+
+def calcprs_run(*argv):
+    out = subprocess.run([sys.executable, os.path.join(ROOT, 'calcprs.py')] + list(argv),
+                         cwd=ROOT, capture_output=True, check=True)
+    return out.stdout, out.stderr
+
+
+def profile(name, freq, step, from_tail=False):
+    ff = calcprs.parse_freqs(freq)
+    ma = xmn.read_mensur_array(sample_path(name))
+    pr = imped.pressure_profile(np.pi*2*ff, ma, 2.0e-5*10**3, step*0.001, from_tail, imped.calc_context(24.0, 'PIPE'))
+    return ff, pr
+
+
+def test_parse_freqs():
+    assert np.array_equal(calcprs.parse_freqs('440'), [440.0])
+    assert np.array_equal(calcprs.parse_freqs('220,440'), [220.0, 440.0])
+    assert np.allclose(calcprs.parse_freqs('100:110:2.5'), [100, 102.5, 105, 107.5, 110])
+
+
+@pytest.mark.parametrize('from_tail', [False, True])
+@pytest.mark.parametrize('name', ['simple', 'branch', 'sample'])
+def test_map_npz(tmp_path, name, from_tail):
+    out = str(tmp_path / 'map.npz')
+    calcprs_run('-f', '100:400:50', '-s', '20', '-F', 'npz', '-o', out, *(['-T'] if from_tail else []), sample_path(name))
+    ff, pr = profile(name, '100:400:50', 20, from_tail)
+    with np.load(out) as d:
+        assert np.array_equal(d['freq'], ff)
+        for key in pr._fields:
+            assert np.allclose(d[key], getattr(pr, key), rtol=1e-12, atol=0)
+        assert d['pi'].shape == (7, len(pr.cell))
+
+
+def test_map_csv(tmp_path):
+    out = str(tmp_path / 'map.prs')
+    calcprs_run('-f', '220,440,880', '-s', '10', '-o', out, sample_path('sample'))
+    ff, pr = profile('sample', '220,440,880', 10)
+    with open(out) as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith('#') and 'freq: 220,440,880' in lines[0]
+    head = lines[1].split(',')
+    assert head[:2] == ['L', 'D'] and np.array_equal([float(v) for v in head[2:]], ff)
+    tab = np.array([[float(v) for v in ln.split(',')] for ln in lines[2:]])
+    # input of each slice and the output end
+    assert tab.shape == (len(pr.cell) + 1, 2 + len(ff))
+    assert np.allclose(tab[:, 0], np.append(pr.x, pr.x[-1] + pr.r[-1])*1000, atol=5e-4)
+    assert np.allclose(tab[:, 1], np.append(pr.df, pr.db[-1])*1000, atol=5e-4)
+    db = 20*np.log10(np.abs(np.column_stack((pr.pi, pr.po[:, -1])))/2e-5)
+    assert np.allclose(tab[:, 2:], db.T, atol=5e-4)
+
+
+def test_single_freq_to_stdout():
+    out, _ = calcprs_run('-f', '440', '-s', '0', '-o', '-', sample_path('simple'))
+    lines = out.decode().splitlines()
+    assert lines[1] == 'L,D,dBSPL'
+    ff, pr = profile('simple', '440', 0)
+    assert float(lines[2].split(',')[2]) == pytest.approx(20*np.log10(abs(pr.pi[0, 0])/2e-5), abs=5e-4)
+
+
+def test_profile(tmp_path):
+    out = str(tmp_path / 'map.npz')
+    log = str(tmp_path / 'profile.jsonl')
+    calcprs_run('-f', '100:300:100', '-F', 'npz', '-o', out, '--profile', '--profile-output', log, sample_path('branch'))
+    with open(log) as f:
+        rep = [json.loads(ln) for ln in f]
+    assert len(rep) == 1 and rep[0]['file'] == sample_path('branch')
+    assert rep[0]['phases']['imped.pressure_profile']['calls'] == 1
+    assert rep[0]['phases']['write']['calls'] == 1
+    with np.load(out) as d:
+        assert d['pi'].shape[0] == 3
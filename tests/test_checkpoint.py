@@ -0,0 +1,124 @@
+"""calcimpy.py -K resumes interrupted runs and starts over when arguments or source change"""
+import os
+import shutil
+import sys
+import numpy as np
+import pytest
+
+import imped
+import impbackend
+import calcimpy
+from conftest import sample_path
+
+CHUNK = 16
+ARGS = ['-M', '200', '-s', '2.5', '-f', 'npy']  # 81 frequencies, 6 chunks
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def run(monkeypatch):
+    """run(argv, stop=None) runs calcimpy main, raising Interrupted at chunk stop.
+    Returns number of chunks calculated."""
+    monkeypatch.setattr(calcimpy, 'CHUNK', CHUNK)
+    solve = imped.input_impedance_array
+
+    def run(argv, stop=None):
+        calls = [0]
+
+        def counted(wff, *a, **kw):
+            if len(wff) <= CHUNK:  # chunks of the spectrum, not evaluation of --simplify-error
+                if calls[0] == stop:
+                    raise Interrupted()
+                calls[0] += 1
+            return solve(wff, *a, **kw)
+        monkeypatch.setattr(imped, 'input_impedance_array', counted)
+        monkeypatch.setattr(sys, 'argv', ['calcimpy.py'] + argv)
+        try:
+            calcimpy.main()
+        finally:
+            monkeypatch.setattr(imped, 'input_impedance_array', solve)
+        return calls[0]
+    return run
+
+
+@pytest.fixture
+def bore(tmp_path):
+    path = str(tmp_path / 'sample.xmen')
+    shutil.copy(sample_path('sample'), path)
+    return path
+
+
+def reference(run, bore, tmp_path, extra=()):
+    out = str(tmp_path / 'ref.npy')
+    run(ARGS + list(extra) + ['-o', out, bore])
+    return calcimpy.load_result(out, mmap=False)
+
+
+def check(out, ref):
+    ff, zz = calcimpy.load_result(out, mmap=False)
+    assert np.array_equal(ff, ref[0])
+    assert np.allclose(zz, ref[1], rtol=1e-12, atol=0, equal_nan=True)
+    assert not os.path.exists(out + calcimpy.CHECKPOINT_SUFFIX)
+
+
+def test_resume(run, bore, tmp_path):
+    ref = reference(run, bore, tmp_path)
+    out = str(tmp_path / 'out.npy')
+    with pytest.raises(Interrupted):
+        run(ARGS + ['-K', '-o', out, bore], stop=3)
+    with open(out + calcimpy.CHECKPOINT_SUFFIX) as f:
+        assert len(f.read().splitlines()) == 1 + 3
+    assert run(ARGS + ['-K', '-o', out, bore]) == 3  # remaining chunks only
+    check(out, ref)
+
+
+def test_cut_record(run, bore, tmp_path):
+    """a record cut by interruption is calculated again"""
+    out = str(tmp_path / 'out.npy')
+    with pytest.raises(Interrupted):
+        run(ARGS + ['-K', '-o', out, bore], stop=2)
+    with open(out + calcimpy.CHECKPOINT_SUFFIX, 'a') as f:
+        f.write('32')
+    assert run(ARGS + ['-K', '-o', out, bore]) == 4
+    check(out, reference(run, bore, tmp_path))
+
+
+@pytest.mark.parametrize('changed', [
+    ['--simplify', '0.1'],
+    ['--simplify-error', '0.01'],
+    ['-t', '20'],
+    ['-R', 'BAFFLE'],
+    ['-B', 'numpy'],
+])
+def test_changed_options(run, bore, tmp_path, changed):
+    if changed[0] == '-B' and impbackend.load('numpy').backends == impbackend.load(None).backends:
+        pytest.skip('default backend is numpy for all routines here')
+    out = str(tmp_path / 'out.npy')
+    with pytest.raises(Interrupted):
+        run(ARGS + ['-K', '-o', out, bore], stop=3)
+    assert run(ARGS + changed + ['-K', '-o', out, bore]) == 6  # started over
+    check(out, reference(run, bore, tmp_path, changed))
+
+
+def test_changed_source(run, bore, tmp_path):
+    out = str(tmp_path / 'out.npy')
+    with pytest.raises(Interrupted):
+        run(ARGS + ['-K', '-o', out, bore], stop=3)
+    with open(bore) as f:
+        text = f.read()
+    assert '8,12,400' in text
+    with open(bore, 'w') as f:
+        f.write(text.replace('8,12,400', '8,12,410', 1))
+    assert run(ARGS + ['-K', '-o', out, bore]) == 6
+    check(out, reference(run, bore, tmp_path))
+
+
+def test_bin_format(run, bore, tmp_path):
+    out = str(tmp_path / 'out.bin')
+    with pytest.raises(Interrupted):
+        run(['-M', '200', '-f', 'bin', '-K', '-o', out, bore], stop=1)
+    assert run(['-M', '200', '-f', 'bin', '-K', '-o', out, bore]) == 5
+    check(out, reference(run, bore, tmp_path))
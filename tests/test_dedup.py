@@ -0,0 +1,117 @@
+"""child groups shared by several joints are calculated once per batch, and children
+are skipped only where they do not affect the result ( c_ratio 0 )"""
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+
+WF = np.pi*2*np.linspace(0, 2000, 81)
+
+SHARED = """[
+10,10,100,
+|,H,0.5,
+10,10,100,
+|,H,0.5,
+10,10,100,
+|,H,0.5,
+10,10,100,
+|,H,0.5,
+10,10,100,
+|,H,0.5,
+10,10,100,
+<,V,0.5
+10,10,200,
+>,V,0.5,
+10,10,300,
+OPEN_END
+]
+{,H
+8,8,5,
+OPEN_END
+}
+{,V
+12,12,210,
+OPEN_END
+}
+"""
+
+
+def bore(text):
+    return xmn.build_mensur_array(text.split('\n'))
+
+
+def child_top(ma, name):
+    return {int(ma.child[i]) for i, n in ma.c_name.items() if n == name and ma.child[i] >= 0}.pop()
+
+
+def set_ratio(ma, name, c_ratio):
+    for i, n in ma.c_name.items():
+        if n == name:
+            ma.c_ratio[i] = c_ratio
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """counts of chain_impedance_array ( 'z' ) and chain_matrix_array ( 'm' ) calls by top"""
+    counts = {}
+    for kind, attr in (('z', 'chain_impedance_array'), ('m', 'chain_matrix_array')):
+        def counted(wf, ma, top, *args, _func=getattr(imped, attr), _kind=kind, **kwargs):
+            counts[(_kind, top)] = counts.get((_kind, top), 0) + 1
+            return _func(wf, ma, top, *args, **kwargs)
+        monkeypatch.setattr(imped, attr, counted)
+    return counts
+
+
+def test_shared_group_once(calls, monkeypatch):
+    ma = bore(SHARED)
+    h = child_top(ma, 'H')
+    z = imped.input_impedance_array(WF, ma)
+    assert calls[('z', h)] == 1
+
+    # without memo every joint calculates the group again, with the same result
+    group_array = imped.group_array
+    monkeypatch.setattr(imped, 'group_array', lambda wf, ma, top, kind, ctx, memo: group_array(wf, ma, top, kind, ctx, None))
+    calls.clear()
+    z0 = imped.input_impedance_array(WF, ma)
+    assert calls[('z', h)] == 5
+    assert np.array_equal(z, z0, equal_nan=True)
+
+
+def test_shared_group_men_engines():
+    ma = bore(SHARED)
+    men = xmn.build_mensur(SHARED.split('\n'))
+    z = imped.input_impedance_array(WF, ma)
+    zm = imped.input_impedance_array(WF, men)
+    ok = np.isfinite(z)
+    assert np.allclose(zm[ok], z[ok], rtol=1e-10, atol=0)
+
+
+@pytest.mark.parametrize('c_ratio, computed', [(0, 0), (1e-6, 1), (0.5, 1), (1, 1)])
+def test_branch_pruned_at_zero_only(calls, c_ratio, computed):
+    ma = bore(SHARED)
+    set_ratio(ma, 'V', c_ratio)
+    imped.input_impedance_array(WF, ma)
+    assert calls.get(('m', child_top(ma, 'V')), 0) == computed
+
+
+@pytest.mark.parametrize('c_ratio, computed', [(0, 0), (1e-6, 1), (1, 1)])
+def test_split_pruned_at_zero_only(calls, c_ratio, computed):
+    ma = bore(SHARED)
+    set_ratio(ma, 'H', c_ratio)
+    imped.input_impedance_array(WF, ma)
+    assert calls.get(('z', child_top(ma, 'H')), 0) == computed
+
+
+def test_pruned_children_do_not_change_result():
+    # closed holes and BRANCH of main path only are the bore without them
+    ma = bore(SHARED)
+    set_ratio(ma, 'H', 0)
+    set_ratio(ma, 'V', 0)
+    plain = bore('[\n10,10,600,\n10,10,200,\n10,10,300,\nOPEN_END\n]\n')
+    z, zp = imped.input_impedance_array(WF, ma), imped.input_impedance_array(WF, plain)
+    assert np.allclose(z, zp, rtol=1e-10, atol=0)
+    # BRANCH of child path only
+    set_ratio(ma, 'V', 1)
+    child = bore('[\n10,10,600,\n12,12,210,\n10,10,300,\nOPEN_END\n]\n')
+    assert np.allclose(imped.input_impedance_array(WF, ma), imped.input_impedance_array(WF, child), rtol=1e-10, atol=0)
@@ -0,0 +1,65 @@
+"""temperature x frequency grid in one pass equals separate runs of each temperature"""
+import sys
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+import calcimpy
+from conftest import SAMPLES, sample_path
+
+WF = np.pi*2*np.linspace(0, 2000, 161)
+TEMPS = (0.0, 24.0, 37.5)
+
+
+def close(z, zr, rtol=1e-12):
+    ok = np.isfinite(zr)
+    return np.array_equal(ok, np.isfinite(z)) and np.max(np.abs(z[ok] - zr[ok])) <= rtol*np.max(np.abs(zr[ok]))
+
+
+def test_grid_context():
+    ctx = imped.grid_context(TEMPS, 4, 'BAFFLE')
+    for k, t in enumerate(TEMPS):
+        one = imped.calc_context(t, 'BAFFLE')
+        for name in ('c0', 'rho', 'rhoc0', 'mu', 'nu'):
+            v = getattr(ctx, name)
+            assert v.shape == (12,) and not v.flags.writeable
+            assert np.array_equal(v[k*4:(k + 1)*4], np.full(4, getattr(one, name)))
+    assert ctx.rad_calc == 'BAFFLE'
+
+
+@pytest.mark.parametrize('rad', ['PIPE', 'BAFFLE', 'NONE'])
+@pytest.mark.parametrize('name', SAMPLES)
+def test_grid_equals_separate_runs(name, rad):
+    ma = xmn.read_mensur_array(sample_path(name))
+    zg = imped.input_impedance_grid(WF, ma, TEMPS, rad)
+    assert zg.shape == (len(TEMPS), len(WF))
+    for k, t in enumerate(TEMPS):
+        imped.clear_tm_cache()
+        imped.clear_radimp_cache()
+        assert close(zg[k], imped.input_impedance_array(WF, ma, imped.calc_context(t, rad)))
+
+
+def test_grid_of_men():
+    men = xmn.read_mensur_file(sample_path('branch'))
+    zg = imped.input_impedance_grid(WF, men, TEMPS, 'PIPE')
+    for k, t in enumerate(TEMPS):
+        assert close(zg[k], imped.input_impedance_array(WF, men, imped.calc_context(t, 'PIPE')))
+
+
+def test_cli_sweep_equals_separate_runs(monkeypatch, tmp_path):
+    def run(temp, out):
+        monkeypatch.setattr(sys, 'argv', ['calcimpy.py', '-t', temp, '-f', 'npz', '-M', '1000', '-o', out,
+                                          sample_path('sample')])
+        calcimpy.main()
+    sweep = str(tmp_path / 'sweep.npz')
+    run('10:30:10', sweep)
+    with np.load(sweep) as d:
+        temps, ff, zz = d['temperature'], d['freq'], d['imp']
+    assert np.array_equal(temps, [10, 20, 30]) and zz.shape == (3, len(ff))
+    for k, t in enumerate(temps):
+        out = str(tmp_path / 'one{0}.npz'.format(k))
+        run(str(t), out)
+        f1, z1 = calcimpy.load_result(out)
+        assert np.array_equal(f1, ff)
+        assert close(zz[k], z1)
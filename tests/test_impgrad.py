@@ -0,0 +1,83 @@
+"""impgrad.impedance_grad against central differences on sample files"""
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+import impgrad
+from conftest import SAMPLES, sample_path
+
+WF = np.pi*2*np.array([0.0, 50.0, 333.0, 777.0, 1234.0, 1900.0])
+RTOL = 1.0e-4  # finite differences by relative step 1e-6
+
+
+def solve(ma, ctx):
+    imped.clear_tm_cache()
+    imped.clear_radimp_cache()
+    return imped.input_impedance_array(WF, ma, ctx)
+
+
+def parameters(ma):
+    """(key, cell) of parameters having derivatives"""
+    for i in range(len(ma)):
+        if ma.r[i] > 0:
+            yield 'r', i
+        if ma.r[i] > 0 or i == ma.end[0]:
+            yield 'df', i
+            yield 'db', i
+        if ma.child[i] >= 0:
+            yield 'c_ratio', i
+
+
+def check(ma, ctx):
+    """derivatives of all parameters of ma agree with central differences"""
+    g = impgrad.impedance_grad(WF, ma, ctx)
+    z0 = solve(ma, ctx)
+    assert np.allclose(g['zi'], z0, rtol=1e-10, atol=0, equal_nan=True)
+    for key, i in parameters(ma):
+        arr = getattr(ma, key)
+        v = arr[i]
+        h = max(abs(v), 1e-3)*1e-6
+        lo, hi = v - h, v + h
+        if key == 'c_ratio':
+            # one sided at the ends of the range
+            lo, hi = max(lo, 0.0), min(hi, 1.0)
+        arr[i] = hi
+        zp = solve(ma, ctx)
+        arr[i] = lo
+        zm = solve(ma, ctx)
+        arr[i] = v
+        fd = (zp - zm)/(hi - lo)
+        gi = g[key][i]
+        ok = np.isfinite(gi) & np.isfinite(fd)
+        ok[WF == 0] = False
+        scale = np.abs(fd) + np.abs(z0)/max(abs(v), 1e-3)*1e-6
+        err = np.abs(fd - gi)[ok]/scale[ok]
+        assert not len(err) or err.max() < RTOL, (key, i, err.max())
+
+
+@pytest.mark.parametrize('rad', ['PIPE', 'BAFFLE', 'NONE'])
+@pytest.mark.parametrize('name', SAMPLES)
+def test_central_differences(name, rad):
+    ctx = imped.calc_context(24.0, rad)
+    check(xmn.compile_mensur(xmn.read_mensur_file(sample_path(name))), ctx)
+
+
+@pytest.mark.parametrize('c_ratio', [0.0, 0.3, 0.8, 1.0])
+def test_branch_ratio(c_ratio):
+    """BRANCH blend between main and child path, one sided at the ends"""
+    ma = xmn.compile_mensur(xmn.read_mensur_file(sample_path('branch')))
+    joints = (ma.c_type == xmn.C_TYPES.index('BRANCH')) & (ma.child >= 0)
+    assert joints.any()
+    ma.c_ratio[joints] = c_ratio
+    check(ma, imped.calc_context(24.0, 'PIPE'))
+
+
+def test_scipy_is_not_imported():
+    """impgrad is imported without scipy ( loaded by radiation routines on demand )"""
+    import subprocess
+    import sys
+    from conftest import ROOT
+    out = subprocess.run([sys.executable, '-c', 'import sys, impgrad; print("scipy" in sys.modules)'],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == 'False'
@@ -0,0 +1,50 @@
+"""impprof instrumentation of routines and lazy imports"""
+import subprocess
+import sys
+import types
+import numpy as np
+
+import xmensur as xmn
+import imped
+import impbackend
+import impprof
+from conftest import sample_path, ROOT
+
+
+def test_import_is_light():
+    code = ('import sys, impprof\n'
+            'print(sorted(m for m in ("impstate", "mencache", "mensimplify") if m in sys.modules))')
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == '[]'
+
+
+def test_kernel_is_instrumented(monkeypatch):
+    numpy_ns = impbackend.load('numpy')
+    src = impbackend.source_module()
+    ns = types.SimpleNamespace(**vars(numpy_ns))
+    ns.propagate_kernel, ns.kernel_min_work, ns.kernel_min_cells = src.propagate_kernel, 0, 1
+    monkeypatch.setattr(imped, 'impcore', ns)
+    ma = xmn.read_mensur_array(sample_path('simple'))
+    wf = np.pi*2*np.arange(0.0, 200.0, 20.0)
+    impprof.enable()
+    try:
+        imped.input_impedance_array(wf, ma)
+        rep = impprof.report()
+    finally:
+        impprof.disable()
+    assert rep['cells']['kernel'] >= 1
+    assert rep['phases']['impcore.propagate_kernel']['calls'] == rep['cells']['kernel']
+    assert ns.propagate_kernel is src.propagate_kernel
+
+
+def test_missing_kernel_stays_none(monkeypatch):
+    ns = types.SimpleNamespace(**vars(impbackend.load('numpy')))
+    ns.propagate_kernel = None
+    monkeypatch.setattr(imped, 'impcore', ns)
+    impprof.enable()
+    try:
+        assert ns.propagate_kernel is None
+        assert impprof.is_enabled()
+    finally:
+        impprof.disable()
+    assert ns.calc_transmission is impbackend.load('numpy').calc_transmission
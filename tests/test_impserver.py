@@ -0,0 +1,192 @@
+"""impserver request checks, error statuses and Client round trip"""
+import json
+import threading
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+import impserver
+from conftest import sample_path
+
+
+def start(address, calc=None, workers=1, queue=impserver.QUEUE_SIZE):
+    server = impserver.make_server(address, workers, queue, calc)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if address.startswith('unix:'):
+        return server, impserver.Client(address)
+    return server, impserver.Client('127.0.0.1:{0}'.format(server.server_address[1]))
+
+
+@pytest.fixture
+def serve():
+    """serve(calc=None, workers=1, queue=QUEUE_SIZE, address=ephemeral port) returns Client"""
+    started = []
+
+    def serve(calc=None, workers=1, queue=impserver.QUEUE_SIZE, address='127.0.0.1:0'):
+        server, client = start(address, calc, workers, queue)
+        started.append((server, client))
+        return client
+    yield serve
+    for server, client in started:
+        client.close()
+        server.shutdown()
+        server.server_close()
+        server.pool.shutdown()
+
+
+def strict_loads(body):
+    def refuse(name):
+        raise ValueError('not strict JSON : ' + name)
+    return json.loads(body.decode('utf-8'), parse_constant=refuse)
+
+
+@pytest.mark.parametrize('kind, req, msg', [
+    ('spectrum', {}, 'unknown request'),
+    ('impedance', {'radiation': 'WALL'}, 'unknown radiation'),
+    ('impedance', {'temperature': 'warm'}, 'bad value of temperature'),
+    ('impedance', {'maxfreq': float('nan')}, 'bad value of maxfreq'),
+    ('impedance', {'stepfreq': 0}, 'stepfreq must be positive'),
+    ('impedance', {'minfreq': 100, 'maxfreq': 50}, 'bad frequency range'),
+    ('peaks', {'ftol': 0}, 'ftol must be positive'),
+    ('peaks', {'prominence': -1}, 'prominence must not be negative'),
+    ('pressure', {'freq': 'abc'}, 'bad value of freq'),
+    ('pressure', {'freq': [100, None]}, 'bad value of freq'),
+    ('pressure', {'freq': []}, 'bad value of freq'),
+    ('pressure', {'freq': [[100]]}, 'bad value of freq'),
+    ('pressure', {'freq': -1}, 'bad value of freq'),
+    ('pressure', {'step': -1}, 'step must not be negative'),
+    ('pressure', {'from_tail': 'yes'}, 'bad value of from_tail'),
+])
+def test_parse_request_errors(kind, req, msg):
+    with pytest.raises(impserver.RequestError) as e:
+        impserver.parse_request(kind, req)
+    assert msg in str(e.value)
+
+
+def test_parse_request_values():
+    prm = impserver.parse_request('pressure', {'freq': [100, 200.5], 'step': 0, 'from_tail': True})
+    assert np.array_equal(prm['freq'], [100, 200.5])
+    assert prm['step'] == 0 and prm['from_tail'] is True  # step 0 is cell ends only, as calcprs.py
+    prm = impserver.parse_request('impedance', {})
+    assert (prm['minfreq'], prm['maxfreq'], prm['stepfreq'], prm['radiation']) == (0.0, 2000.0, 2.5, 'PIPE')
+
+
+def test_encode_json_non_finite():
+    body = impserver.encode_json({'q': np.array([1.0, np.nan, np.inf]), 'z': np.array([1 + np.nan*1j]),
+                                  'n': np.array([1, 2])}, {'calc': 0.1})
+    d = strict_loads(body)
+    assert d['q'] == [1.0, None, None] and d['z.imag'] == [None] and d['n'] == [1, 2]
+    res, timing = impserver.decode_json(body)
+    assert res['q'][0] == 1 and np.isnan(res['q'][1:]).all() and np.isnan(res['z'].imag[0])
+    assert timing == {'calc': 0.1}
+
+
+def expected_impedance(path, maxfreq, stepfreq=2.5):
+    ma = xmn.read_mensur_array(path)
+    ff = impserver.freq_axis(0.0, maxfreq, stepfreq)
+    return ff, ma.df[0]*ma.df[0]*np.pi/4*imped.input_impedance_array(np.pi*2*ff, ma, imped.calc_context(24.0, 'PIPE'))
+
+
+@pytest.mark.parametrize('fmt', ['json', 'npz'])
+def test_impedance_round_trip(serve, fmt):
+    client = serve()
+    res, timing = client.request('impedance', path=sample_path('branch'), maxfreq=500, format=fmt)
+    ff, zz = expected_impedance(sample_path('branch'), 500)
+    assert np.array_equal(res['freq'], ff)
+    assert np.allclose(res['imp'], zz, rtol=1e-12, atol=0)
+    assert {'parse', 'calc', 'queue', 'total'} <= set(timing)
+
+
+def test_inline_text_and_cache(serve):
+    client = serve()
+    with open(sample_path('split')) as f:
+        text = f.read()
+    a, t1 = client.request('impedance', xmen=text, maxfreq=200)
+    b, t2 = client.request('impedance', xmen=text, maxfreq=200)
+    assert not t1['cached'] and t2['cached']
+    assert np.array_equal(a['imp'], b['imp'])
+    assert client.status()['mensurs']['hits'] == 1
+
+
+def test_pressure_and_peaks(serve):
+    client = serve()
+    res, _ = client.request('pressure', path=sample_path('simple'), freq=[100, 300], step=0)
+    ma = xmn.read_mensur_array(sample_path('simple'))
+    pr = imped.pressure_profile(np.pi*2*np.array([100.0, 300.0]), ma, 2.0e-5*10**3, 0.0, False,
+                                imped.calc_context(24.0, 'PIPE'))
+    assert np.allclose(res['pi'], pr.pi, rtol=1e-12)
+    res, _ = client.request('peaks', path=sample_path('simple'), maxfreq=1000)
+    assert len(res['freq']) and set(res['type'].tolist()) <= {-1, 1}
+
+
+def test_non_finite_result_is_strict_json(serve):
+    class NanCalculator(impserver.Calculator):
+        def calculate(self, kind, req):
+            return {'Q': np.array([np.nan, 2.0, np.inf])}, {'parse': 0.0, 'calc': 0.0, 'cached': False}
+    client = serve(NanCalculator())
+    resp, body = client.call('POST', '/peaks', json.dumps({'xmen': ''}).encode('utf-8'))
+    assert resp.status == 200
+    assert strict_loads(body)['Q'] == [None, 2.0, None]
+
+
+@pytest.mark.parametrize('body, msg', [
+    (b'[1, 2]', 'must be a JSON object'),
+    (b'{"path": 1', 'bad request'),
+    (b'{"format": "xml"}', 'unknown format'),
+    (b'{"path": "/no/such/file.xmen"}', 'No such file'),
+    (b'{"xmen": "[\\n10,10\\n]"}', 'DF,DB,R are required'),
+    (b'{"path": "x", "freq": "abc"}', 'bad value of freq'),
+])
+def test_bad_request_400(serve, body, msg):
+    client = serve()
+    url = '/pressure'
+    resp, out = client.call('POST', url, body)
+    assert resp.status == 400
+    assert msg in json.loads(out.decode('utf-8'))['error']
+
+
+def test_unexpected_error_500(serve):
+    class Broken(impserver.Calculator):
+        def calculate(self, kind, req):
+            raise RuntimeError('broken')
+    client = serve(Broken())
+    resp, out = client.call('POST', '/impedance', b'{"xmen": ""}')
+    assert resp.status == 500 and 'broken' in json.loads(out.decode('utf-8'))['error']
+    assert client.status()['errors'] == 1
+
+
+def test_busy_503(serve):
+    release = threading.Event()
+    entered = threading.Event()
+
+    class Slow(impserver.Calculator):
+        def calculate(self, kind, req):
+            entered.set()
+            release.wait(10)
+            return impserver.Calculator.calculate(self, kind, req)
+    client = serve(Slow(), workers=1, queue=0)
+    port = client.conn.port
+    result = {}
+
+    def first():
+        c = impserver.Client('127.0.0.1:{0}'.format(port))
+        result['res'] = c.request('impedance', path=sample_path('simple'), maxfreq=100)
+        c.close()
+    t = threading.Thread(target=first)
+    t.start()
+    assert entered.wait(10)
+    with pytest.raises(RuntimeError) as e:
+        client.request('impedance', path=sample_path('simple'), maxfreq=100)
+    assert str(e.value).startswith('503')
+    release.set()
+    t.join(10)
+    assert len(result['res'][0]['freq']) == 41
+
+
+def test_unix_socket(serve, tmp_path):
+    client = serve(address='unix:' + str(tmp_path / 'calc.sock'))
+    res, _ = client.request('impedance', path=sample_path('simple'), maxfreq=100)
+    ff, zz = expected_impedance(sample_path('simple'), 100)
+    assert np.allclose(res['imp'], zz, rtol=1e-12, atol=0)
+    assert client.status()['requests']['impedance'] == 1
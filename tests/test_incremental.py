@@ -0,0 +1,70 @@
+"""imped.IncrementalImpedance against full calculation after random edits"""
+import random
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+from conftest import sample_path
+
+WF = np.pi*2*np.linspace(0, 2000, 64)
+
+
+def cells(men):
+    """all Men cells of main and child groups"""
+    res, seen, tops = [], set(), [men]
+    while tops:
+        m = tops.pop()
+        while m and m not in seen:
+            seen.add(m)
+            res.append(m)
+            if m.child and m.c_type != 'MERGE':
+                tops.append(xmn.top_mensur(m.child))
+            m = m.next
+    return res
+
+
+def full(men):
+    return imped.input_impedance_array(WF, men)
+
+
+def close(z, zf):
+    ok = np.isfinite(zf)
+    return np.array_equal(ok, np.isfinite(z)) and np.max(np.abs(z[ok] - zf[ok])) <= 1e-9*np.max(np.abs(zf[ok]))
+
+
+@pytest.mark.parametrize('name', ['split', 'branch', 'subgroup', 'sample'])
+def test_random_edits(name):
+    men = xmn.read_mensur_file(sample_path(name))
+    inc = imped.IncrementalImpedance(WF, men)
+    assert close(inc.zi, full(men))
+    rnd = random.Random(name)
+    all_cells = cells(men)
+    for _ in range(20):
+        # a few edits between updates
+        for c in rnd.sample(all_cells, min(3, len(all_cells))):
+            if c.child and c.c_type in ('SPLIT', 'BRANCH'):
+                c.c_ratio = rnd.choice((0.0, 0.3, 0.5, 1.0))
+            elif c.r > 0:
+                c.df *= rnd.uniform(0.9, 1.1)
+                c.db *= rnd.uniform(0.9, 1.1)
+                c.r *= rnd.uniform(0.9, 1.1)
+            inc.mark_dirty(c)
+        assert close(inc.update(), full(men))
+
+
+def test_update_without_edit():
+    men = xmn.read_mensur_file(sample_path('sample'))
+    inc = imped.IncrementalImpedance(WF, men)
+    z = inc.zi.copy()
+    assert np.array_equal(inc.update(), z, equal_nan=True)
+
+
+def test_mensur_is_not_changed():
+    """results are kept by IncrementalImpedance, two of them on one mensur do not interfere"""
+    men = xmn.read_mensur_file(sample_path('branch'))
+    a = imped.IncrementalImpedance(WF, men)
+    b = imped.IncrementalImpedance(WF[1:], men)
+    assert not hasattr(men, 'zi')
+    assert close(a.update(), full(men))
+    assert close(b.update(), imped.input_impedance_array(WF[1:], men))
@@ -0,0 +1,99 @@
+"""c_ratio of BRANCH and SPLIT as documented in doc/calcimpy_basics.md, by every engine,
+and impstate states against solving with c_ratio set"""
+import random
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+import impstate
+from conftest import sample_path
+
+WF = np.pi*2*np.linspace(0, 2000, 81)
+
+
+def close(z, zr, rtol=1e-9):
+    ok = np.isfinite(zr)
+    return np.array_equal(ok, np.isfinite(z)) and np.max(np.abs(z[ok] - zr[ok])) <= rtol*np.max(np.abs(zr[ok]))
+
+
+def bore(text):
+    return xmn.build_mensur_array(text.split('\n'))
+
+
+def engines(name, group, c_ratio):
+    """input impedance of sample name with joints of group set to c_ratio,
+    by MenArray, Men and impstate"""
+    ma = xmn.read_mensur_array(sample_path(name))
+    zs = impstate.input_impedance_states(WF, ma, [{group: c_ratio}])[0]
+    for i, n in ma.c_name.items():
+        if n == group:
+            ma.c_ratio[i] = c_ratio
+    men = xmn.read_mensur_file(sample_path(name))
+    m = men
+    while m:
+        if m.c_name == group:
+            m.c_ratio = c_ratio
+        m = m.next
+    return imped.input_impedance_array(WF, ma), imped.input_impedance_array(WF, men), zs
+
+
+@pytest.mark.parametrize('c_ratio, text', [
+    (0.0, '[\n10,10,300\n10,10,200\n10,10,500\nOPEN_END\n]'),  # main path only
+    (1.0, '[\n10,10,300\n12,12,100\n10,10,500\nOPEN_END\n]'),  # child path only
+])
+def test_branch_ends(c_ratio, text):
+    zr = imped.input_impedance_array(WF, bore(text))
+    for z in engines('branch', 'SL1', c_ratio):
+        assert close(z, zr)
+
+
+@pytest.mark.parametrize('c_ratio, end', [(1e-7, 0.0), (1 - 1e-7, 1.0)])
+def test_branch_continuous(c_ratio, end):
+    """blend gives the child path share c_ratio, so it meets the ends"""
+    for z, zr in zip(engines('branch', 'SL1', c_ratio), engines('branch', 'SL1', end)):
+        assert close(z, zr, 1e-4)
+
+
+def test_branch_blend_is_between():
+    """magnitude at the first peak moves monotonically from main path to child path"""
+    k = np.argmax(np.abs(engines('branch', 'SL1', 0.0)[0][1:])) + 1
+    mags = [np.abs(engines('branch', 'SL1', c)[0][k]) for c in (0.0, 0.25, 0.5, 0.75, 1.0)]
+    d = np.diff(mags)
+    assert np.all(d > 0) or np.all(d < 0)
+
+
+@pytest.mark.parametrize('c_ratio', [0.0, 0.5, 1.0])
+def test_split(c_ratio):
+    """0 does not connect the side path, otherwise it is parallel with impedance / c_ratio"""
+    ctx = imped.get_context()
+    zmain = imped.input_impedance_array(WF, bore('[\n10,10,850\nOPEN_END\n]'))
+    zside = imped.input_impedance_array(WF, bore('[\n8,8,5\nOPEN_END\n]'))
+    with np.errstate(all='ignore'):
+        zo = zmain if c_ratio == 0 else zside/c_ratio*zmain/(zside/c_ratio + zmain)
+        zr = imped.impcore.zo2zi_array(imped.transmission_array(WF, 0.01, 0.01, 0.15, ctx), zo)
+    zr[WF == 0] = 0
+    for z in engines('split', 'TH1', c_ratio):
+        assert close(z, zr)
+
+
+@pytest.mark.parametrize('name', ['split', 'branch', 'sample'])
+def test_states(name):
+    """StateImpedance of random states equals solving with c_ratio set"""
+    ma = xmn.read_mensur_array(sample_path(name))
+    names = sorted(impstate.joint_names(ma))
+    rnd = random.Random(name)
+    states = [{n: rnd.choice((0.0, 0.2, 0.5, 1.0)) for n in names if rnd.random() < 0.7} for _ in range(12)]
+    zz = impstate.input_impedance_states(WF, ma, states)
+    for st, z in zip(states, zz):
+        ms = xmn.read_mensur_array(sample_path(name))
+        for i, n in ms.c_name.items():
+            if n in st:
+                ms.c_ratio[i] = st[n]
+        assert close(z, imped.input_impedance_array(WF, ms))
+
+
+def test_unknown_state():
+    ma = xmn.read_mensur_array(sample_path('split'))
+    with pytest.raises(ValueError):
+        impstate.input_impedance_states(WF, ma, [{'NOPE': 1.0}])
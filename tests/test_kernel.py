@@ -0,0 +1,56 @@
+"""propagate_kernel against cached matrices of the numpy MenArray engine"""
+import types
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+import impbackend
+import benchmark
+from conftest import SAMPLES, sample_path
+
+
+def kernel_backend(min_cells):
+    """numpy backend with python source of propagate_kernel used for every chain"""
+    ns = types.SimpleNamespace(**vars(impbackend.load('numpy')))
+    ns.propagate_kernel = impbackend.source_module().propagate_kernel
+    ns.kernel_min_work, ns.kernel_min_cells = 0, min_cells
+    return ns
+
+
+def taper(tmp_path, n):
+    path = tmp_path / 'taper{0}.xmen'.format(n)
+    path.write_text(benchmark.bore_text('taper', n))
+    return str(path)
+
+
+@pytest.mark.parametrize('min_cells', [1, impbackend.KERNEL_MIN_CELLS])
+@pytest.mark.parametrize('name', SAMPLES + ('taper',))
+def test_kernel_equals_numpy(monkeypatch, tmp_path, name, min_cells):
+    path = taper(tmp_path, 40) if name == 'taper' else sample_path(name)
+    ma = xmn.read_mensur_array(path)
+    wf = np.pi*2*np.linspace(0, 2000, 81)
+    ctx = imped.calc_context(24.0, 'PIPE')
+    monkeypatch.setattr(imped, 'impcore', impbackend.load('numpy'))
+    z0 = imped.input_impedance_array(wf, ma, ctx)
+    imped.clear_tm_cache()
+    monkeypatch.setattr(imped, 'impcore', kernel_backend(min_cells))
+    z1 = imped.input_impedance_array(wf, ma, ctx)
+    ok = np.isfinite(z0)
+    assert np.array_equal(ok, np.isfinite(z1))
+    assert np.max(np.abs(z1[ok] - z0[ok])) <= 1e-10*np.max(np.abs(z0[ok]))
+
+
+def test_parallel_jit_keeps_source_module():
+    numba = pytest.importorskip('numba')
+    src = impbackend.source_module()
+    ns = types.SimpleNamespace()
+    ns.propagate_kernel = impbackend.LazyJit(ns, 'propagate_kernel', src.propagate_kernel, parallel=True)
+    wf = np.pi*2*np.linspace(0, 2000, 41)
+    args = [np.full(41, v) for v in (346.0, 413.0, 1.5e-5)]
+    df, db, r, n = np.array([0.01, 0.012]), np.array([0.012, 0.012]), np.array([0.1, 0.2]), np.array([1, 3])
+    zo = np.ones(41, dtype=complex)
+    z = ns.propagate_kernel(wf, df, db, r, n, zo, *args)
+    assert isinstance(ns.propagate_kernel, numba.core.registry.CPUDispatcher)
+    assert src.prange is range
+    assert np.allclose(z, src.propagate_kernel(wf, df, db, r, n, zo, *args), rtol=1e-12, atol=0)
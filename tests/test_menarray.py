@@ -0,0 +1,95 @@
+"""compile_mensur and build_mensur_array give the MenArray of the linked Men cells"""
+import numpy as np
+import pytest
+
+import xmensur as xmn
+from conftest import SAMPLES, sample_path
+
+FIELDS = ('df', 'db', 'r', 'next', 'prev', 'child', 'parent', 'joint', 'end', 'c_type', 'c_ratio')
+
+
+def read_lines(name):
+    with open(sample_path(name)) as f:
+        return f.readlines()
+
+
+def men_cells(top):
+    """all Men reachable from top by next and child links"""
+    seen, todo = {}, [top]
+    while todo:
+        m = todo.pop()
+        while m and id(m) not in seen:
+            seen[id(m)] = m
+            if m.child:
+                todo.append(m.child)
+            m = m.next
+    return list(seen.values())
+
+
+def test_branch_ir():
+    ma = xmn.read_mensur_array(sample_path('branch'))
+    # main chain 0..5 and child SL1 6..7, BRANCH at 1 and MERGE at 3
+    expected = {'df': [10, 10, 10, 10, 10, 10, 12, 12], 'db': [10, 10, 10, 10, 10, 0, 12, 0],
+                'r': [300, 0, 200, 0, 500, 0, 100, 0],
+                'next': [1, 2, 3, 4, 5, -1, 7, -1], 'prev': [-1, 0, 1, 2, 3, 4, -1, 6],
+                'child': [-1, 6, -1, 7, -1, -1, -1, -1], 'parent': [-1, -1, -1, -1, -1, -1, 1, 3],
+                'joint': [-1, 3, -1, -1, -1, -1, -1, -1], 'end': [5, 5, 5, 5, 5, 5, 7, 7],
+                'c_type': [0, 2, 0, 3, 0, 0, 0, 0], 'c_ratio': [1, 0.5, 1, 0.5, 1, 1, 1, 1]}
+    for key, v in expected.items():
+        scale = 1000 if key in ('df', 'db', 'r') else 1
+        assert np.allclose(getattr(ma, key)*scale, v), key
+    assert ma.c_name == {1: 'SL1', 3: 'SL1'}
+    assert [xmn.C_TYPES[t] for t in ma.c_type[[1, 3]]] == ['BRANCH', 'MERGE']
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_compile_matches_men(name):
+    top = xmn.build_mensur(read_lines(name))
+    cells = men_cells(top)
+    ma = xmn.compile_mensur(top)
+    assert len(ma) == len(cells)
+    # geometry and joints of every Men appear once
+    key = sorted((m.df, m.db, m.r, m.c_type or '', m.c_name, m.c_ratio) for m in cells)
+    got = sorted((ma.df[i], ma.db[i], ma.r[i], xmn.C_TYPES[ma.c_type[i]] or '', ma.c_name.get(i, ''), ma.c_ratio[i])
+                 for i in range(len(ma)))
+    assert key == got
+    for i in range(len(ma)):
+        # chains are consecutive and end at end[i]
+        if ma.next[i] >= 0:
+            assert ma.next[i] == i + 1 and ma.prev[i + 1] == i and ma.end[i] == ma.end[i + 1]
+        else:
+            assert ma.end[i] == i
+        if ma.child[i] >= 0:
+            c = ma.child[i]
+            if xmn.C_TYPES[ma.c_type[i]] == 'BRANCH':
+                j = ma.joint[i]
+                assert xmn.C_TYPES[ma.c_type[j]] == 'MERGE' and ma.child[j] == ma.end[c]
+                # a child of one cell is both ends of the loop, its parent is the MERGE
+                assert ma.parent[c] == (j if c == ma.end[c] else i)
+            else:
+                assert ma.parent[c] == i
+    # top of main is 0 and the walk of next from 0 is the main chain of Men
+    m, i = top, 0
+    while m:
+        assert (ma.df[i], ma.db[i], ma.r[i]) == m.get_fbr()
+        m, i = m.next, ma.next[i]
+    assert i == -1
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_direct_parse_equals_compile(name):
+    lines = read_lines(name)
+    ma = xmn.build_mensur_array(lines)
+    mc = xmn.compile_mensur(xmn.build_mensur(lines))
+    for key in FIELDS:
+        assert np.array_equal(getattr(ma, key), getattr(mc, key)), key
+        assert getattr(ma, key).dtype == getattr(mc, key).dtype
+    assert ma.c_name == mc.c_name
+
+
+def test_compile_does_not_change_men():
+    top = xmn.build_mensur(read_lines('sample'))
+    cells = men_cells(top)
+    before = [dict(vars(m)) for m in cells]
+    xmn.compile_mensur(top)
+    assert [dict(vars(m)) for m in cells] == before
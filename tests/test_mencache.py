@@ -0,0 +1,91 @@
+"""mencache entries are never stale after edits of the source or a new parser version"""
+import os
+import numpy as np
+
+import xmensur as xmn
+import mencache
+from conftest import sample_path
+
+
+def same(a, b):
+    return len(a) == len(b) and a.c_name == b.c_name and all(
+        np.array_equal(getattr(a, k), getattr(b, k)) for k, _ in mencache.FIELDS)
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_hit_is_memory_mapped(tmp_path):
+    cdir = str(tmp_path / 'cache')
+    path = sample_path('sample')
+    first = mencache.load(path, cdir)
+    assert mencache.cache_info(cdir)['files'] == 1
+    second = mencache.load(path, cdir)
+    assert isinstance(second.df, np.memmap)
+    assert same(first, second)
+    assert same(second, xmn.read_mensur_array(path))
+
+
+def test_edited_source(tmp_path):
+    cdir = str(tmp_path / 'cache')
+    path = str(tmp_path / 'bore.xmen')
+    write(path, '[\n10,10,100\n10,10,0\n]\n')
+    a = mencache.load(path, cdir)
+    write(path, '[\n10,12,100\n12,12,0\n]\n')
+    b = mencache.load(path, cdir)
+    assert a.db[0] == 0.010 and b.db[0] == 0.012
+    assert same(b, xmn.read_mensur_array(path))
+    assert mencache.cache_info(cdir)['files'] == 2
+
+
+def test_parser_version(tmp_path, monkeypatch):
+    cdir = str(tmp_path / 'cache')
+    path = sample_path('branch')
+    mencache.load(path, cdir)
+    old = mencache.entries(cdir)[0][0]
+    monkeypatch.setattr(xmn, 'PARSER_VERSION', xmn.PARSER_VERSION + 1)
+    ma = mencache.load(path, cdir)
+    assert not isinstance(ma.df, np.memmap)  # parsed again
+    files = [e[0] for e in mencache.entries(cdir)]
+    assert old not in files and len(files) == 1  # entry of old version is removed
+    # entry written by another version under the current name is refused by its header
+    with open(files[0], 'rb') as f:
+        data = f.read()
+    cur = '"version": {0}'.format(xmn.PARSER_VERSION).encode()
+    assert cur in data
+    with open(files[0], 'wb') as f:
+        f.write(data.replace(cur, '"version": {0}'.format(xmn.PARSER_VERSION - 1).encode()))
+    ma = mencache.load(path, cdir)
+    assert not isinstance(ma.df, np.memmap)
+    assert same(ma, xmn.read_mensur_array(path))
+
+
+def test_broken_entry(tmp_path):
+    cdir = str(tmp_path / 'cache')
+    path = sample_path('split')
+    mencache.load(path, cdir)
+    entry = mencache.entries(cdir)[0][0]
+    with open(entry, 'r+b') as f:
+        f.truncate(os.path.getsize(entry)//2)
+    ma = mencache.load(path, cdir)
+    assert same(ma, xmn.read_mensur_array(path))
+    assert same(mencache.load(path, cdir), ma)  # stored again
+
+
+def test_evict_least_recently_used(tmp_path):
+    cdir = str(tmp_path / 'cache')
+    paths = []
+    for k in range(3):
+        p = str(tmp_path / 'b{0}.xmen'.format(k))
+        write(p, '[\n10,10,{0}\n10,10,0\n]\n'.format(100 + k))
+        paths.append(p)
+        mencache.load(p, cdir)
+        e = mencache.entry_path(mencache.source_key(open(p, 'rb').read()), cdir)
+        os.utime(e, (1000 + k, 1000 + k))
+    size = mencache.entries(cdir)[0][1]
+    mencache.evict(cdir, 2*size)
+    left = {e[0] for e in mencache.entries(cdir)}
+    assert mencache.entry_path(mencache.source_key(open(paths[0], 'rb').read()), cdir) not in left
+    assert len(left) == 2
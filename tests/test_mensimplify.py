@@ -0,0 +1,76 @@
+"""mensimplify keeps the error within tolerance and impedance close to the original"""
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+import mensimplify
+from conftest import SAMPLES, sample_path
+
+WF = np.pi*2*np.linspace(50, 2000, 400)
+
+
+def bell(n=100):
+    """taper of n cells of 10 mm flaring toward the end, the last cell is the bell"""
+    d = [10 + 0.02*k**1.5/10 for k in range(n + 1)]
+    return xmn.build_mensur_array(['['] + ['{0},{1},10'.format(d[k], d[k + 1]) for k in range(n)] + [']'])
+
+
+def deviation(ma, out):
+    return mensimplify.impedance_error(imped.input_impedance_array(WF, ma), imped.input_impedance_array(WF, out))
+
+
+def test_end_cell_is_kept():
+    """merging the end cell changed diameter of radiation without being measured"""
+    ma = xmn.build_mensur_array(['[', '10,11,100', '11,12,100', ']'])
+    out, info = mensimplify.simplify(ma, 1e-4)
+    assert info.removed == 0 and info.error == 0
+    assert deviation(ma, out) == 0
+
+
+def test_radiation_error():
+    ma = bell(4)
+    out = mensimplify.rebuild(ma, [(0, 3, 0.0)])  # the end cell merged by force
+    assert mensimplify.radiation_error(ma, out, [(0, 3, 0.0)]) == pytest.approx(ma.df[3] - ma.df[0])
+
+
+@pytest.mark.parametrize('tol, ztol', [(1e-5, 1e-2), (1e-6, 1e-3)])
+def test_bell(tol, ztol):
+    ma = bell()
+    out, info = mensimplify.simplify(ma, tol)
+    assert info.removed > 0 and info.error <= tol
+    assert out.df[out.end[0]] == ma.df[ma.end[0]]
+    assert deviation(ma, out) <= ztol
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+@pytest.mark.parametrize('tol', [1e-5, 1e-4, 1e-3])
+def test_samples(name, tol):
+    ma = xmn.read_mensur_array(sample_path(name))
+    out, info = mensimplify.simplify(ma, tol)
+    assert info.error <= tol
+    assert info.cells == len(out) and info.removed == len(ma) - len(out)
+    if tol <= 1e-4:
+        assert deviation(ma, out) <= 1e-3
+
+
+@pytest.mark.parametrize('name', ['sample', 'sample2'])
+def test_simplify_impedance(name):
+    ma = xmn.read_mensur_array(sample_path(name))
+    out, info = mensimplify.simplify_impedance(ma, WF, 1e-3)
+    assert info.imp_error <= 1e-3
+    assert deviation(ma, out) == pytest.approx(info.imp_error)
+
+
+def test_segments_linear_merge_agrees_with_cone_error():
+    """greedy segments are each within tol by the exact cone_error"""
+    rnd = np.random.default_rng(0)
+    for _ in range(50):
+        n = rnd.integers(2, 40)
+        x = np.concatenate(([0.0], np.cumsum(rnd.uniform(0.001, 0.02, n))))
+        d = 0.01 + 0.003*np.sin(x*rnd.uniform(1, 30))
+        tol = 10**rnd.uniform(-6, -3)
+        segs = mensimplify.merge_run(x, d[:-1], d[1:], tol)
+        assert segs[0][0] == 0 and segs[-1][1] == n - 1
+        for a, b, e in segs:
+            assert e <= tol and e == pytest.approx(mensimplify.cone_error(x, d[:-1], d[1:], a, b) if b > a else 0.0)
@@ -0,0 +1,65 @@
+"""MensurDocument parses in threads without shared state"""
+import gc
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import xmensur as xmn
+from conftest import SAMPLES, sample_path
+
+
+def read_lines(name):
+    with open(sample_path(name)) as f:
+        return f.readlines()
+
+
+def signature(doc):
+    ma = xmn.compile_mensur(doc.top)
+    return (tuple(doc.group_names), tuple(sorted(doc.men_grp_table)), len(doc.mensur),
+            ma.df.tobytes(), ma.db.tobytes(), ma.r.tobytes(), ma.child.tobytes())
+
+
+def parse_many(texts, jobs=64, workers=8):
+    """parse texts round robin in workers threads, returns [(name, doc)]"""
+    names = sorted(texts)
+    start = threading.Barrier(workers)
+
+    def parse(k):
+        if k < workers:
+            start.wait()  # let the first parses run at once
+        name = names[k % len(names)]
+        return name, xmn.parse_mensur(texts[name], sample_path(name))
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(parse, range(jobs)))
+
+
+def test_threaded_parse_no_cross_talk():
+    texts = {name: read_lines(name) for name in SAMPLES}
+    expected = {name: signature(xmn.parse_mensur(lines)) for name, lines in texts.items()}
+    assert len(set(expected.values())) == len(SAMPLES)
+    for name, doc in parse_many(texts):
+        assert signature(doc) == expected[name]
+        assert all(men.group in doc.group_names for men in doc.mensur if men.group)
+
+
+def test_no_leftover_state():
+    texts = {name: read_lines(name) for name in SAMPLES}
+    docs = parse_many(texts, jobs=16)
+    assert (xmn.group_names, xmn.group_tree, xmn.mensur, dict(xmn.men_grp_table)) == ((), (), (), {})
+    refs = [weakref.ref(doc.top) for name, doc in docs]
+    del docs
+    gc.collect()
+    assert all(r() is None for r in refs)
+
+
+def test_publish_last_is_consistent(monkeypatch):
+    for attr in ('group_names', 'group_tree', 'mensur', 'men_grp_table'):
+        monkeypatch.setattr(xmn, attr, getattr(xmn, attr))
+    monkeypatch.setattr(xmn, 'publish_last', True)
+    texts = {name: read_lines(name) for name in SAMPLES}
+    docs = [doc for name, doc in parse_many(texts)]
+    last = [doc for doc in docs if doc.men_grp_table['MAIN'] is xmn.men_grp_table['MAIN']]
+    assert len(last) == 1
+    doc = last[0]
+    assert xmn.group_names == tuple(doc.group_names) and xmn.mensur == tuple(doc.mensur)
+    assert dict(xmn.men_grp_table) == doc.men_grp_table
@@ -0,0 +1,46 @@
+"""MensurSyntaxError of both XMEN parsers with line numbers"""
+import pytest
+
+import xmensur as xmn
+
+# (text lines, line number of error, part of message)
+CASES = (
+    (['[', '10,10,100', '10,x+,100', ']'], 3, 'invalid expression'),
+    (['a = 3', '[', '10,10,a', '10,10,b', ']'], 4, 'undefined name : b'),
+    (['[', '10,10,10', ']', '{, A', '10,10,10', '}', '{, A', '10,10,10', '}'], 7, 'doubling'),
+    (['[', '10,10,10', ']', '}'], 4, 'END_GROUP without GROUP'),
+    (['10,10,10'], 1, 'outside of MAIN'),
+    (['[', '10,10,10', 'SPLIT, A', ']'], 3, 'requires name and ratio'),
+    (['[', '10,10', ']'], 2, 'DF,DB,R are required'),
+    (['[', '__import__("os").system("true"),10,10', ']'], 2, 'unsupported expression'),
+    (['[', '10,10,10', 'SPLIT, NOPE, 1', '10,10,10', ']'], 3, 'group NOPE is not defined'),
+    (['# comment', '', '[', '10,10,10  # comment', 'x = 1/0', ']'], 5, 'division by zero'),
+    (['{, A', '10,10,10', '}'], None, 'MAIN is not defined'),
+)
+
+
+@pytest.mark.parametrize('build', [xmn.build_mensur, xmn.build_mensur_array])
+@pytest.mark.parametrize('lines, lineno, msg', CASES)
+def test_line_number(build, lines, lineno, msg):
+    with pytest.raises(xmn.MensurSyntaxError) as e:
+        build(lines, 'bad.xmen')
+    assert e.value.lineno == lineno
+    assert e.value.path == 'bad.xmen'
+    assert msg in e.value.msg
+    if lineno is not None:
+        assert str(e.value).startswith('bad.xmen:{0}: '.format(lineno))
+
+
+def test_is_value_error():
+    """old callers catching ValueError keep working"""
+    with pytest.raises(ValueError):
+        xmn.build_mensur(['[', '10,10', ']'])
+
+
+def test_read_file(tmp_path):
+    path = tmp_path / 'bad.xmen'
+    path.write_text('[\n10,10,10\n10,10,zz\n]\n')
+    for read in (xmn.read_mensur_file, xmn.read_mensur_array):
+        with pytest.raises(xmn.MensurSyntaxError) as e:
+            read(str(path))
+        assert e.value.lineno == 3 and e.value.path == str(path)
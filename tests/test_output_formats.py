@@ -0,0 +1,81 @@
+"""calcimpy.py outputs of every format read back by load_result, chunked and to stdout"""
+import io
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+import calcimpy
+from conftest import sample_path, ROOT
+
+ARGS = ['-M', '200', '-s', '2.5']  # 81 frequencies, not a multiple of CHUNK
+
+
+def expected(maxfreq=200.0, stepfreq=2.5, name='sample'):
+    ff = np.linspace(0, maxfreq, int(round(maxfreq/stepfreq)) + 1)
+    ma = xmn.read_mensur_array(sample_path(name))
+    return ff, ma.df[0]*ma.df[0]*np.pi/4*imped.input_impedance_array(np.pi*2*ff, ma, imped.calc_context(24.0, 'PIPE'))
+
+
+def run(monkeypatch, argv):
+    monkeypatch.setattr(sys, 'argv', ['calcimpy.py'] + argv)
+    calcimpy.main()
+
+
+def calcimpy_stdout(argv):
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'calcimpy.py')] + argv,
+                          cwd=ROOT, capture_output=True, check=True).stdout
+
+
+@pytest.mark.parametrize('chunk', [16, calcimpy.CHUNK])
+@pytest.mark.parametrize('fmt', ['npy', 'npz', 'bin'])
+def test_round_trip(monkeypatch, tmp_path, fmt, chunk):
+    monkeypatch.setattr(calcimpy, 'CHUNK', chunk)
+    out = str(tmp_path / ('out.' + fmt))
+    run(monkeypatch, ARGS + ['-f', fmt, '-o', out, sample_path('sample')])
+    ff, zz = expected()
+    for mmap in (True, False):
+        f1, z1 = calcimpy.load_result(out, mmap=mmap)
+        assert np.array_equal(f1, ff)
+        assert np.allclose(z1, zz, rtol=1e-12, atol=0, equal_nan=True)
+        del f1, z1
+
+
+def test_csv_matches_binary(monkeypatch, tmp_path):
+    monkeypatch.setattr(calcimpy, 'CHUNK', 16)
+    run(monkeypatch, ARGS + ['-f', 'csv', '-o', str(tmp_path / 'out.imp'), sample_path('sample')])
+    tab = np.genfromtxt(str(tmp_path / 'out.imp'), delimiter=',', skip_header=1)
+    ff, zz = expected()
+    assert tab.shape == (len(ff), 4)
+    assert np.array_equal(tab[:, 0], ff)
+    assert np.allclose(tab[:, 1] + 1j*tab[:, 2], zz, rtol=1e-12, atol=0)
+
+
+def test_large_spectrum_in_chunks(tmp_path):
+    # 10001 frequencies are two chunks of CHUNK and a rest
+    out = str(tmp_path / 'out.bin')
+    calcimpy_stdout(['-M', '2000', '-s', '0.2', '-f', 'bin', '-o', out, sample_path('branch')])
+    ff, zz = expected(2000.0, 0.2, 'branch')
+    assert len(ff) % calcimpy.CHUNK
+    f1, z1 = calcimpy.load_result(out)
+    assert np.array_equal(f1, ff)
+    assert np.allclose(z1, zz, rtol=1e-12, atol=0, equal_nan=True)
+
+
+@pytest.mark.parametrize('fmt', ['npy', 'bin', 'csv'])
+def test_stdout_is_file_output(tmp_path, fmt):
+    out = str(tmp_path / ('out.' + fmt))
+    calcimpy_stdout(ARGS + ['-f', fmt, '-o', out, sample_path('sample')])
+    with open(out, 'rb') as f:
+        assert calcimpy_stdout(ARGS + ['-f', fmt, '-o', '-', sample_path('sample')]) == f.read()
+
+
+def test_stdout_npz():
+    data = calcimpy_stdout(ARGS + ['-f', 'npz', '-o', '-', sample_path('sample')])
+    ff, zz = expected()
+    with np.load(io.BytesIO(data)) as d:
+        assert np.array_equal(d['freq'], ff)
+        assert np.allclose(d['imp'], zz, rtol=1e-12, atol=0, equal_nan=True)
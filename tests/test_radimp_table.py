@@ -0,0 +1,62 @@
+"""ka interpolation table of radiation functions against Bessel and Struve functions"""
+import numpy as np
+import pytest
+
+import imped
+
+
+@pytest.fixture
+def table():
+    """set_radimp_table(step, xmax), the table is disabled after the test"""
+    yield imped.set_radimp_table
+    imped.set_radimp_table(None)
+
+
+def direct(x):
+    """radiation functions without table, by power series for small x where 1 - 2 J1(x)/x cancels"""
+    assert imped._rad_table is None
+    re, im = imped.radiation_functions(x)
+    small = x < 0.05
+    xs = x[small]
+    re[small] = xs*xs/8 - xs**4/192 + xs**6/9216 - xs**8/737280
+    im[small] = 4/np.pi*(xs/3 - xs**3/45 + xs**5/1575 - xs**7/99225)
+    return re, im
+
+
+@pytest.mark.parametrize('step, xmax', [(1.0e-3, 200.0), (1.0e-2, 50.0), (0.05, 20.0)])
+def test_table_error(table, step, xmax):
+    rng = np.random.default_rng(5)
+    # grid points, midpoints and random points over the whole table, from small ka up to xmax
+    x = np.concatenate((np.arange(1, int(xmax/step))*step, (np.arange(int(xmax/step)) + 0.5)*step,
+                        rng.uniform(1e-6, xmax, 20000), np.geomspace(1e-6, 1e-1, 200)))
+    x = x[x <= xmax]
+    re0, im0 = direct(x)
+    table(step, xmax)
+    re, im = imped.radiation_functions(x)
+    assert np.max(np.abs(re/re0 - 1)) < 0.15*step*step
+    assert np.max(np.abs(im/im0 - 1)) < 0.15*step*step
+
+
+def test_fallback_beyond_table(table):
+    x = np.array([0.5, 9.999, 10.0, 10.0001, 15.0, 400.0])
+    re0, im0 = direct(x)
+    table(1.0e-3, 10.0)
+    re, im = imped.radiation_functions(x)
+    out = x > imped._rad_table[1]
+    assert out.sum() == 3
+    assert np.array_equal(re[out], re0[out]) and np.array_equal(im[out], im0[out])
+    assert np.allclose(re[~out], re0[~out], rtol=1e-6) and np.allclose(im[~out], im0[~out], rtol=1e-6)
+
+
+@pytest.mark.parametrize('rad', ['PIPE', 'BAFFLE'])
+def test_radimp_array_with_table(table, rad):
+    ctx = imped.calc_context(24.0, rad)
+    wf = np.pi*2*np.linspace(0, 20000, 2001)
+    dia = 0.3  # ka up to about 55, beyond the table of xmax 50
+    z0 = np.array(imped.radimp_array(wf, dia, ctx))
+    table(1.0e-3, 50.0)
+    z1 = imped.radimp_array(wf, dia, ctx)
+    assert z1[0] == 0 and z0[0] == 0
+    assert np.allclose(z1.real[1:], z0.real[1:], rtol=1.5e-7, atol=0)
+    assert np.allclose(z1.imag[1:], z0.imag[1:], rtol=1.5e-7, atol=0)
+    assert not np.array_equal(z1, z0)  # not the cached result without table
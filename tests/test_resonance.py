@@ -0,0 +1,121 @@
+"""resonance.find_peaks against fine sweeps and a closed form cylinder"""
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+import impcore
+import resonance
+from conftest import SAMPLES, sample_path
+
+
+def brute_force(mag, f0, half, kind):
+    """frequency and Q of the peak near f0 of mag(ff) by a fine sweep over f0 +- half,
+    Q is nan without half power points in it"""
+    ff = np.linspace(f0 - half, f0 + half, 4001)
+    mg = mag(ff) if kind > 0 else 1/mag(ff)
+    j = 2000 - 333 + np.argmax(mg[2000 - 333:2000 + 334])  # in the middle, away from other peaks
+    m0, m1, m2 = mg[j - 1:j + 2]
+    assert m1 >= max(m0, m2)
+    fp = ff[j] + (ff[1] - ff[0])*0.5*(m0 - m2)/(m0 - 2*m1 + m2)  # vertex of parabola
+    thr = m1/np.sqrt(2)
+    jl = np.flatnonzero(mg[:j] < thr)
+    jr = j + np.flatnonzero(mg[j:] < thr)
+    if not len(jl) or not len(jr):
+        return fp, np.nan
+    # linear interpolation of the crossings
+    jl, jr = jl[-1], jr[0]
+    fl = np.interp(thr, mg[jl:jl + 2], ff[jl:jl + 2])
+    fr = np.interp(-thr, -mg[jr - 1:jr + 1], ff[jr - 1:jr + 1])
+    return fp, fp/(fr - fl)
+
+
+def check_peaks(pk, mag, ftol):
+    """frequency and Q of peaks pk against brute_force, weak peaks without half power points
+    are checked by frequency"""
+    nq = 0
+    for f0, tp, q in zip(pk['freq'], pk['type'], pk['Q']):
+        has_q = np.isfinite(q) and q > 3
+        half = 1.5*f0/q if has_q else 2.0
+        fb, qb = brute_force(mag, f0, half, tp)
+        assert abs(f0 - fb) <= 2*ftol
+        if has_q:
+            assert q == pytest.approx(qb, rel=2e-3)
+            nq += 1
+    return nq
+
+
+@pytest.mark.parametrize('name', ['sample', 'split'])
+def test_peaks_vs_fine_sweep(name):
+    ma = xmn.read_mensur_array(sample_path(name))
+    ctx = imped.calc_context(24.0, 'PIPE')
+
+    def mag(ff):
+        return np.abs(imped.input_impedance_array(np.pi*2*ff, ma, ctx))
+    pk = resonance.find_peaks(np.arange(0, 2000.001, 25.0), ma, ctx)
+    assert check_peaks(pk, mag, 1e-3) >= 10
+
+    # every clear peak of a fine sweep is found on the coarse grid
+    ff = np.arange(0, 2000.001, 0.1)
+    with np.errstate(divide='ignore'):
+        db = 20*np.log10(mag(ff))
+    for sign in (1, -1):
+        i = np.flatnonzero((sign*db[1:-1] > sign*db[:-2]) & (sign*db[1:-1] >= sign*db[2:])) + 1
+        i = i[(resonance.prominence(sign*db, i) > 2*resonance.PROMINENCE) & (ff[i] < 1990)]
+        found = pk['freq'][pk['type'] == sign]
+        assert np.all(np.min(np.abs(ff[i][:, None] - found[None, :]), axis=1) < 0.1)
+
+
+def test_prominence_filter():
+    ma = xmn.read_mensur_array(sample_path('split'))
+    ff = np.arange(0, 2000.001, 2.5)
+    pk = resonance.find_peaks(ff, ma, min_prominence=0)
+    kept = resonance.find_peaks(ff, ma)
+    assert len(kept['freq']) < len(pk['freq'])
+    assert np.isin(kept['freq'], pk['freq']).all()
+    # ripple of split pair near 195 Hz is under 0.5 dB
+    assert np.any((pk['freq'] > 190) & (pk['freq'] < 200))
+    assert not np.any((kept['freq'] > 190) & (kept['freq'] < 200))
+
+
+def test_prominence_definition():
+    lm = np.array([0.0, 3.0, 1.0, 2.0, 0.5, 4.0, 0.0])
+    assert np.array_equal(resonance.prominence(lm, np.array([1, 3, 5])), [2.5, 1.0, 4.0])
+
+
+def test_cylinder_closed_form():
+    # open pipe without radiation, input impedance is j Zc tan(kL) with lossy k of calc_transmission
+    ctx = imped.calc_context(24.0, 'NONE')
+    d, L = 0.01, 1.0
+    ma = xmn.build_mensur_array(['[\n', '10,10,1000,\n', '10,10,0,\n', ']\n'])
+
+    def mag(ff):
+        w = np.pi*2*ff
+        aa = impcore.Wdmp*np.sqrt(2*w*ctx.nu)/ctx.c0/d
+        k = np.sqrt((w/ctx.c0)*(w/ctx.c0 - 2*(-1+1j)*aa))
+        return np.abs(ctx.rhoc0/(np.pi/4*d*d)*np.tan(k*L))
+    pk = resonance.find_peaks(np.arange(0, 2000.001, 50.0), ma, ctx)
+    # quarter wave maxima and half wave minima, wave number kw + aa ( first order in wall loss aa )
+    n = np.arange(1, len(pk['freq']) + 1)
+    a = impcore.Wdmp*np.sqrt(2*ctx.nu)/ctx.c0/d  # aa = a sqrt(w)
+    w = n*np.pi/(2*L)*ctx.c0
+    for it in range(50):
+        w = (n*np.pi/(2*L) - a*np.sqrt(w))*ctx.c0
+    assert len(pk['freq']) == np.sum(n*ctx.c0/(4*L) < 2000)
+    assert np.array_equal(pk['type'], np.where(n % 2, 1, -1))
+    assert np.allclose(pk['freq'], w/(np.pi*2), rtol=1e-3, atol=0)
+    # Q of a lossy pipe is about beta/(2 alpha) by d beta/dw, few percent off by second order terms
+    aa = a*np.sqrt(w)
+    assert np.allclose(pk['Q'], (w/ctx.c0 + aa/2)/(2*aa), rtol=0.05, atol=0)
+    assert check_peaks(pk, mag, 1e-3) == len(pk['freq'])
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_refine_grid_keeps_coarse_points(name):
+    ma = xmn.read_mensur_array(sample_path(name))
+    fun = resonance.Counter(ma)
+    ff = np.arange(0, 2000.001, 50.0)
+    fr, zr = resonance.refine_grid(ff, fun.impedance(ff), fun, 1e-3)
+    assert np.isin(ff, fr).all() and np.all(np.diff(fr) > 0)
+    assert np.allclose(zr, imped.input_impedance_array(np.pi*2*fr, ma), rtol=1e-12, atol=0)
+    assert fun.nev == len(fr)
@@ -0,0 +1,76 @@
+"""transmission matrix cache and collapse of runs of identical cells into matrix powers"""
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+
+WF = np.pi*2*np.linspace(0, 2000, 101)
+
+
+def cell_product(wf, df, db, r, ctx, n):
+    tm = imped.impcore.calc_transmission_array(wf, df, db, r, ctx.c0, ctx.rhoc0, ctx.nu)
+    out = np.broadcast_to(np.eye(2, dtype=complex), tm.shape)
+    for k in range(n):
+        out = np.matmul(out, tm)
+    return out
+
+
+@pytest.mark.parametrize('n', [2, 3, 7, 64])
+@pytest.mark.parametrize('df, db, r', [(0.01, 0.01, 0.05), (0.01, 0.014, 0.03)])
+def test_power_equals_cell_by_cell(df, db, r, n):
+    ctx = imped.calc_context(24.0, 'PIPE')
+    wf = WF[1:]
+    tm = imped.transmission_array(wf, df, db, r, ctx, n)
+    ref = cell_product(wf, df, db, r, ctx, n)
+    assert np.max(np.abs(tm - ref)) <= 1e-9*np.max(np.abs(ref))
+    assert imped.tm_cache_info()['collapsed'] == n - 1
+
+
+def test_straight_power_is_one_long_cell():
+    ctx = imped.calc_context(24.0, 'PIPE')
+    wf = WF[1:]
+    tm = imped.transmission_array(wf, 0.01, 0.01, 0.05, ctx, 20)
+    one = imped.transmission_array(wf, 0.01, 0.01, 1.0, ctx)
+    assert np.max(np.abs(tm - one)) <= 1e-9*np.max(np.abs(one))
+
+
+def test_collapsed_bore_equals_scalar_engine():
+    # run of identical tapers is collapsed by the MenArray engine, not by the scalar Men engine
+    text = '[\n' + '10,12,40,\n'*25 + '12,12,100,\n' + '12,12,0,\n]\n'
+    lines = text.split('\n')
+    ma = xmn.build_mensur_array(lines)
+    men = xmn.build_mensur(lines)
+    za = imped.input_impedance_array(WF, ma)
+    assert imped.tm_cache_info()['collapsed'] == 24
+    zs = np.array([imped.input_impedance(w, men) for w in WF])
+    assert np.max(np.abs(za - zs)) <= 1e-9*np.max(np.abs(zs))
+
+
+def test_keys_separate_contexts():
+    wf = np.array(WF[1:])
+    wf.setflags(write=False)
+    ctxs = [imped.calc_context(24.0, 'PIPE'), imped.calc_context(30.0, 'PIPE'), imped.calc_context(24.0, 'NONE')]
+    tms = [imped.transmission_array(wf, 0.01, 0.012, 0.1, c) for c in ctxs]
+    # radiation type does not change transmission matrices, temperature does
+    assert imped.tm_cache_info()['misses'] == 2 and imped.tm_cache_info()['hits'] == 1
+    assert tms[2] is tms[0] and not np.allclose(tms[0], tms[1])
+    for c, tm in zip(ctxs, tms):
+        assert np.array_equal(tm, imped.impcore.calc_transmission_array(wf, 0.01, 0.012, 0.1, c.c0, c.rhoc0, c.nu))
+    # grid context of the same temperatures is another key
+    grid = imped.grid_context([24.0], len(wf))
+    assert imped.transmission_array(wf, 0.01, 0.012, 0.1, grid) is not tms[0]
+    # radiation impedance is keyed by radiation type
+    za = [imped.radimp_array(wf, 0.02, c) for c in ctxs]
+    assert not np.array_equal(za[0], za[2]) and not np.any(za[2])
+
+
+def test_keys_separate_frequencies():
+    ctx = imped.calc_context(24.0, 'PIPE')
+    wf = np.array(WF[1:])
+    tm = imped.transmission_array(wf, 0.01, 0.01, 0.1, ctx)
+    assert imped.transmission_array(wf.copy(), 0.01, 0.01, 0.1, ctx) is tm  # same values, same key
+    wf[0] *= 2  # writable array is keyed by its current values
+    tm2 = imped.transmission_array(wf, 0.01, 0.01, 0.1, ctx)
+    assert tm2 is not tm and not np.array_equal(tm2[0], tm[0]) and np.array_equal(tm2[1:], tm[1:])
+    assert not tm.flags.writeable
@@ -0,0 +1,56 @@
+"""input_impedance_array of all frequencies at once equals input_impedance of each frequency"""
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+from conftest import SAMPLES, sample_path
+
+WF = np.pi*2*np.linspace(0, 2000, 121)
+CLOSED = '[\n10,10,300,\n|,H,0.3,\n10,14,400,\n0,0,0,\n]\n{,H\n8,8,6,\n0,0,0,\n}\n'
+
+
+def scalar(men, ctx):
+    return np.array([imped.input_impedance(w, men, ctx) for w in WF], dtype=complex)
+
+
+def same(z, zr, rtol=1e-10):
+    ok = np.isfinite(zr)
+    return np.array_equal(ok, np.isfinite(z)) and np.max(np.abs(z[ok] - zr[ok])) <= rtol*np.max(np.abs(zr[ok]))
+
+
+@pytest.mark.parametrize('rad', ['PIPE', 'BAFFLE', 'NONE'])
+@pytest.mark.parametrize('name', SAMPLES + ('closed',))
+def test_array_equals_scalar(name, rad):
+    lines = CLOSED.split('\n') if name == 'closed' else open(sample_path(name)).readlines()
+    ctx = imped.calc_context(24.0, rad)
+    men = xmn.build_mensur(lines)
+    zs = scalar(men, ctx)
+    assert zs[0] == 0  # wf = 0
+    assert same(imped.input_impedance_array(WF, men, ctx), zs)
+    assert same(imped.input_impedance_array(WF, xmn.build_mensur_array(lines), ctx), zs)
+
+
+def test_default_context():
+    imped.set_params(30.0, 0.0, 2000.0, 2.5, rad='BAFFLE')
+    men = xmn.read_mensur_file(sample_path('split'))
+    assert same(imped.input_impedance_array(WF, men), scalar(men, imped.calc_context(30.0, 'BAFFLE')))
+
+
+def test_results_of_cells():
+    # MenResult of the array engine holds arrays of each cell, those of the scalar engine values
+    men = xmn.read_mensur_file(sample_path('branch'))
+    res = imped.MenResult()
+    imped.input_impedance_array(WF, men, res=res)
+    for k in (5, 60):
+        rs = imped.MenResult()
+        imped.input_impedance(WF[k], men, res=rs)
+        assert set(rs.zi) == set(res.zi)
+        for m, z in rs.zi.items():
+            assert res.zi[m][k] == pytest.approx(z, rel=1e-10, abs=1e-300)
+
+
+def test_frequency_array_is_not_changed():
+    wf = WF.copy()
+    imped.input_impedance_array(wf, xmn.read_mensur_array(sample_path('sample')))
+    assert np.array_equal(wf, WF) and wf.flags.writeable
@@ -0,0 +1,69 @@
+"""pressure at virtual slices equals pressure of the bore sliced by slice_mensur"""
+import numpy as np
+import pytest
+
+import xmensur as xmn
+import imped
+from conftest import sample_path
+
+WF = np.pi*2*np.linspace(0, 2000, 41)
+ENDP = 2.0e-5*10**3
+
+
+TAPER = """[
+10,14,300,
+14,14,120,
+14,30,170,
+OPEN_END
+]
+"""
+
+# sample.xmen is left out, slice_mensur loses the MERGE of a BRANCH whose last child cell it slices
+BORES = ('simple', 'split', 'branch', 'subgroup', 'taper')
+
+
+def read_lines(name):
+    if name == 'taper':
+        return TAPER.split('\n')
+    with open(sample_path(name)) as f:
+        return f.readlines()
+
+
+def sliced_profile(name, step, from_tail):
+    """pressure_profile of the bore sliced by slice_mensur, without slices of rounding error
+    ( slice_mensur leaves them where step divides a cell )"""
+    men = xmn.build_mensur(read_lines(name))
+    xmn.slice_mensur(men, step)
+    pr = imped.pressure_profile(WF, xmn.compile_mensur(men), ENDP, 0, from_tail)
+    keep = ~((pr.r > 0) & (pr.r < step*1e-9))
+    return imped.PressureProfile(*[v[..., keep] for v in pr])
+
+
+@pytest.mark.parametrize('from_tail', [False, True])
+@pytest.mark.parametrize('step', [0.007, 0.05])
+@pytest.mark.parametrize('name', BORES)
+def test_virtual_slices_equal_sliced_bore(name, step, from_tail):
+    ma = xmn.build_mensur_array(read_lines(name))
+    pv = imped.pressure_profile(WF, ma, ENDP, step, from_tail)
+    ps = sliced_profile(name, step, from_tail)
+    assert len(pv.cell) == len(ps.cell) > len(xmn.actual_path(ma, from_tail))
+    # slice geometry
+    for key in ('x', 'df', 'db', 'r'):
+        assert np.allclose(getattr(pv, key), getattr(ps, key), rtol=0, atol=1e-12)
+    # pressure and volume velocity at both ends of slices
+    for key in ('pi', 'ui', 'po', 'uo'):
+        v, vs = getattr(pv, key), getattr(ps, key)
+        assert np.max(np.abs(v - vs)) <= 1e-9*np.max(np.abs(vs))
+    # ends of slices meet
+    assert np.allclose(pv.po[:, :-1], pv.pi[:, 1:], rtol=1e-12, atol=0)
+
+
+def test_virtual_slices_positions():
+    ma = xmn.read_mensur_array(sample_path('simple'))
+    path = xmn.actual_path(ma)
+    cell, x, df, db, r = xmn.virtual_slices(ma, path, 0.3)
+    # 1000 mm cell is 0.3, 0.3, 0.3 and the rest of 0.1, the open end is a cell of length 0
+    assert np.allclose(r, [0.3, 0.3, 0.3, 0.1, 0.0])
+    assert np.allclose(x, [0.0, 0.3, 0.6, 0.9, 1.0])
+    assert np.array_equal(cell, [path[0]]*4 + [path[1]])
+    assert np.allclose(df, 0.01) and np.allclose(db, 0.01)
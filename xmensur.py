@@ -1,7 +1,12 @@
 """
 xmensur core routine and handler functions
 """
-import re
+import ast
+import functools
+import math
+import operator
+import threading
+import types
 import numpy as np
 
 
@@ -21,20 +26,10 @@ class Men(object):
         self.c_name = c_name  # name of child men for searching later.
         self.c_type = c_type  # BRANCH,MERGE,TONEHOLE ...
         self.c_ratio = c_ratio  # child connection ratio
-        # below are calculated later
-        # for impedance
-        self.tm = np.eye(2, dtype=complex)  # transmission matrix, default Identity.
-        self.zi = 0  # impedance at input end
-        self.zo = 0  # impedance at output end
-        # for pressure
-        self.pi = 0  # pressure at input end
-        self.ui = 0  # volume verosity at input end
-        self.po = 0  # pressure at output end
-        self.uo = 0  # volume verosity at output end
+        # impedance and pressure are not kept here, see imped.MenResult
         # for printing total length
         self.xL = 0  # total length from 1st mensur
 
-    @property
     def append(self, next=None):
         self.next = next
         if next is not None:
@@ -82,14 +77,17 @@ HALF = 0.5
 HEAD = 0
 LAST = 1
 
-# mensur group storing
-group_names = []
-group_tree = []
-
+# tables of the last parsed document, read only aliases kept for old code.
+# each parse owns its tables ( see MensurDocument ), use them instead.
+# They are set only when publish_last is True ( opt-in, see publish ).
+publish_last = False
+group_names = ()
+group_tree = ()
 # list of all mensur items
-mensur = []
+mensur = ()
 # dictionary for each head of mensur group
-men_grp_table = {}
+men_grp_table = types.MappingProxyType({})
+_publish_lock = threading.Lock()
 
 
 def eat_comment(s):
@@ -101,30 +99,172 @@ def eat_comment(s):
         return s
 
 
-def resolve_vars(lst):
+class MensurSyntaxError(ValueError):
+    """Error in XMEN text with its line number"""
+    def __init__(self, msg, lineno=None, path=None):
+        self.msg = msg
+        self.lineno = lineno
+        self.path = path
+        if lineno is not None:
+            msg = '{0}:{1}: {2}'.format(path or '<xmen>', lineno, msg)
+        ValueError.__init__(self, msg)
+
+
+# names usable in expressions of XMEN
+CONSTANTS = {'OPEN': OPEN, 'CLOSE': CLOSE, 'HALF': HALF, 'HEAD': HEAD, 'LAST': LAST, 'pi': math.pi, 'e': math.e}
+FUNCTIONS = {k: getattr(math, k) for k in ('sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'atan2', 'sinh', 'cosh',
+                                           'tanh', 'sqrt', 'exp', 'log', 'log10', 'log2', 'hypot', 'floor',
+                                           'ceil', 'degrees', 'radians')}
+FUNCTIONS.update({'abs': abs, 'min': min, 'max': max, 'round': round, 'pow': math.pow})
+_BINOPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+           ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow}
+_UNARYOPS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+
+def new_variables():
+    """Variables dict for parsing, holding CONSTANTS"""
+    return dict(CONSTANTS)
+
+
+def _compile_node(node, src):
+    """Compile ast node of arithmetic expression into function of variables dict"""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        v = float(node.value)
+        return lambda env: v
+    elif isinstance(node, ast.Name):
+        name = node.id
+
+        def get(env):
+            try:
+                return env[name]
+            except KeyError:
+                raise ValueError('undefined name : ' + name)
+        return get
+    elif isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+        op = _BINOPS[type(node.op)]
+        a = _compile_node(node.left, src)
+        b = _compile_node(node.right, src)
+        return lambda env: op(a(env), b(env))
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARYOPS:
+        op = _UNARYOPS[type(node.op)]
+        a = _compile_node(node.operand, src)
+        return lambda env: op(a(env))
+    elif isinstance(node, ast.Call) and not node.keywords:
+        fn = node.func
+        if isinstance(fn, ast.Attribute) and isinstance(fn.value, ast.Name) and fn.value.id in ('np', 'math'):
+            fn = fn.attr
+        elif isinstance(fn, ast.Name):
+            fn = fn.id
+        if fn in FUNCTIONS:
+            f = FUNCTIONS[fn]
+            args = [_compile_node(a, src) for a in node.args]
+            return lambda env: f(*[a(env) for a in args])
+    elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in ('np', 'math'):
+        if node.attr in ('pi', 'e'):
+            v = CONSTANTS[node.attr]
+            return lambda env: v
+    raise ValueError('unsupported expression : ' + src)
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_expr(src):
+    """Compile arithmetic expression src into function of variables dict.
+    Numbers, variables, + - * / // % **, parentheses, FUNCTIONS and pi, e
+    ( also as np.xxx or math.xxx ) are allowed. Nothing is evaluated by eval.
+    """
+    try:
+        tree = ast.parse(src, mode='eval')
+    except SyntaxError:
+        raise ValueError('invalid expression : ' + src)
+    return _compile_node(tree.body, src)
+
+
+def evaluate(w, env):
+    """Value of token w, a number or an expression of variables in env"""
+    try:
+        return float(w)
+    except ValueError:
+        return float(compile_expr(w)(env))
+
+
+def assign(w, env):
+    """Execute variable definition w ( e.g. 'x=10', 'a=b=1', 'x+=1' ) into env"""
+    try:
+        tree = ast.parse(w, mode='exec')
+    except SyntaxError:
+        raise ValueError('invalid definition : ' + w)
+    st = tree.body[0] if len(tree.body) == 1 else None
+    if isinstance(st, ast.Assign) and all(isinstance(t, ast.Name) for t in st.targets):
+        v = float(_compile_node(st.value, w)(env))
+        for t in st.targets:
+            env[t.id] = v
+    elif isinstance(st, ast.AugAssign) and isinstance(st.target, ast.Name) and type(st.op) in _BINOPS:
+        env[st.target.id] = float(_BINOPS[type(st.op)](_compile_node(st.target, w)(env),
+                                                       _compile_node(st.value, w)(env)))
+    else:
+        raise ValueError('invalid definition : ' + w)
+
+
+def resolve_vars(lst, env=None):
     """Resolve vars in each args"""
-    v = []
-    for w in lst:
+    if env is None:
+        env = new_variables()
+    return [evaluate(w, env) for w in lst]
+
+
+def mensur_tokens(lines, env=None, path=None):
+    """Parse XMEN text lines in a single pass.
+    Variable definitions are evaluated into env ( new_variables() when None ).
+    Yields (lineno, kind, values) of
+    'group' : (keyword, name) of MAIN, GROUP, END_MAIN, END_GROUP and aliases
+    'joint' : (keyword, name, ratio or None) of type_keywords
+    'cell' : (df, db, r, comment) in mm
+    Errors are raised as MensurSyntaxError with line number.
+    """
+    if env is None:
+        env = new_variables()
+    for lineno, ln in enumerate(lines, 1):
+        n = ln.find('#')
+        if n >= 0:
+            ln = ln[:n]
+        ss = ''.join(ln.split())  # remove all spaces and tabs
+        if not ss:
+            continue  # ignore blank line
+        wd = ss.split(',')
+        w0 = wd[0]
         try:
-            f = float(w)
-        except ValueError:
-            # by eval, string w which contain vars predefined is parsed.
-            f = eval(w)
-
-        v.append(f)
-    return v
+            if '=' in w0:
+                assign(w0, env)
+                continue
+            elif w0 in group_keywords:
+                tok = ('group', (w0, wd[1] if len(wd) > 1 else ''))
+            elif w0 in type_keywords:
+                ratio = evaluate(wd[2], env) if len(wd) > 2 and wd[2] else None
+                tok = ('joint', (w0, wd[1] if len(wd) > 1 else '', ratio))
+            elif len(wd) < 3:
+                raise ValueError('DF,DB,R are required : ' + ss)
+            else:
+                tok = ('cell', (evaluate(wd[0], env), evaluate(wd[1], env), evaluate(wd[2], env), ''.join(wd[3:])))
+        except (ValueError, ArithmeticError, TypeError) as e:
+            raise MensurSyntaxError(str(e), lineno, path)
+        yield (lineno,) + tok
 
 
-def men_by_kwd(cur, lst):
+def men_by_kwd(cur, key, name='', ratio=None):
     """Handle BRANCH, MERGE, TONEHOLE,...
     Returns new Men item.
+    Old form men_by_kwd(cur, [key, name, ratio]) of split words is also accepted.
     """
-    key = lst[0]
-    if len(lst) > 1:
-        name = lst[1]
-
-    if len(lst) > 2:
-        ratio = resolve_vars(lst[2:3])[0]
+    if isinstance(key, (list, tuple)):
+        lst = key
+        key = lst[0]
+        name = lst[1] if len(lst) > 1 else ''
+        ratio = resolve_vars(lst[2:3])[0] if len(lst) > 2 and lst[2] else None
+    if key in ('BRANCH', 'VALVE_OUT', '<', 'MERGE', 'VALVE_IN', '>', 'SPLIT', 'TONEHOLE', '|'):
+        if not name or ratio is None:
+            raise ValueError('{0} requires name and ratio'.format(key))
+    elif key in ('INSERT', '@') and not name:
+        raise ValueError('{0} requires name'.format(key))
 
     df, db, r = cur.get_fbr()
     gp = cur.group
@@ -178,16 +318,21 @@ def joint_mensur(men):
         return None
 
 
-def resolve_child_mensur():
-    """Connect child mensur to Main"""
-    men = men_grp_table['MAIN']  # top mensur cell
+def resolve_child_mensur(table=None):
+    """Connect child mensur to Main, table is dict of group name -> head Men.
+    Without table, men_grp_table of the last parse is used as the old signature did
+    ( publish_last must be True ).
+    """
+    if table is None:
+        table = men_grp_table
+    men = table['MAIN']  # top mensur cell
 
     while men:
         if men.c_name != '':
             if men.c_type == 'INSERT':
                 # join child group to main trunc
                 men2 = men.next
-                ms = men_grp_table[men.c_name]
+                ms = table[men.c_name]
                 me = end_mensur(ms)
 
                 men.next = ms
@@ -196,9 +341,9 @@ def resolve_child_mensur():
                 men2.prev = me
             else:
                 if men.c_type == 'MERGE':
-                    ms = end_mensur(men_grp_table[men.c_name])
+                    ms = end_mensur(table[men.c_name])
                 else:
-                    ms = men_grp_table[men.c_name]
+                    ms = table[men.c_name]
                 men.setchild(ms)
 
         men = men.next
@@ -300,12 +445,13 @@ def print_mensur_ld(men):
 #         men = actual_next_mensur(men)
 
 
-def print_pressure(men):
+def print_pressure(men, res):
+    """print pressure of res ( imped.MenResult of calc_pressure ) along men"""
     xL = 0.0
     s = 'L,D,dBSPL'
     print(s)
     while men:
-        p = 20*np.log10(np.abs(men.pi)/2e-5)
+        p = 20*np.log10(np.abs(res.pi[men])/2e-5)
         ss = '{0:.3f},{1:.3f},{2:.3f}'.format(xL*1000, men.df*1000, p)
         if s != ss:
             print(ss)
@@ -318,95 +464,278 @@ def print_pressure(men):
         mm = actual_next_mensur(men)
         if not mm:
             # printout out pressure
-            ss = '{0:.3f},{1:.3f},{2:.3f}'.format(xL*1000, men.df*1000, 20*np.log10(np.abs(men.po)/2e-5))
+            ss = '{0:.3f},{1:.3f},{2:.3f}'.format(xL*1000, men.df*1000, 20*np.log10(np.abs(res.po[men])/2e-5))
             if s != ss:
                 print(ss)
                 s = ss
         men = mm
 
 
-def clear_mensur():
-    """Cleans all global mensur list, table"""
-    del mensur[:]
-    del group_names[:]
-    del group_tree[:]
-
-
-######################################################################
-def build_mensur(lines):
-    """Parse text lines which read from mensur file, then build mensur objects."""
-    global group_tree, group_names
-
-    cur = None  # current mensur cell
-    gnm = ''  # current group name
+# version of parser output, change when MenArray built from the same text changes ( mencache keys )
+PARSER_VERSION = 1
 
-    spcrm = re.compile(r'[\t\s]+')  # remove all spaces and tabs
+# child connection type codes used in MenArray.c_type
+C_TYPES = (None, 'SPLIT', 'BRANCH', 'MERGE', 'INSERT', 'ADDON')
 
-    for ln in lines:
-        s = eat_comment(ln.rstrip())
-        # remove whitespaces
-        ss = spcrm.sub('', s)
-        if len(ss) == 0:
-            continue  # ignore blank line
 
-        wd = ss.split(',')
-        # is it var def ?
-        if '=' in wd[0]:
-            exec(wd[0], globals())  # execute as python code, so that setting vars et al.
+class MenArray(object):
+    """Compiled mensur. Cells are kept in contiguous arrays instead of linked Men objects.
+    Cells of a mensur chain (main or a child group) have consecutive indices,
+    so next[i] == i + 1 inside a chain. -1 is used for none.
+    """
+    def __init__(self, n):
+        self.df = np.zeros(n)
+        self.db = np.zeros(n)
+        self.r = np.zeros(n)
+        self.next = np.full(n, -1, dtype=np.int32)
+        self.prev = np.full(n, -1, dtype=np.int32)
+        self.child = np.full(n, -1, dtype=np.int32)
+        self.parent = np.full(n, -1, dtype=np.int32)
+        self.joint = np.full(n, -1, dtype=np.int32)  # MERGE cell of BRANCH
+        self.end = np.full(n, -1, dtype=np.int32)  # last cell of the chain
+        self.c_type = np.zeros(n, dtype=np.int8)  # index of C_TYPES
+        self.c_ratio = np.ones(n)
+        self.c_name = {}  # child name of joint cells
+
+    def __len__(self):
+        return len(self.df)
+
+
+def compile_mensur(men):
+    """Convert resolved mensur starting from men into MenArray"""
+    cells = []
+    index = {}
+    ranges = []  # (first, last) of each chain
+    chains = [men]
+    while chains:
+        m = chains.pop(0)
+        if id(m) in index:
             continue
-
-        # it is command or normal DF,DB,R
-        if wd[0] in group_keywords:
-            # print(wd)
-            if wd[0] == 'END_MAIN' or wd[0] == ']':
-                group_tree = []
-                cur = None
-            elif wd[0] == 'END_GROUP' or wd[0] == '}':
-                group_tree.pop()
-                if not len(group_tree):
-                    cur = None
+        first = len(cells)
+        while m:
+            index[id(m)] = len(cells)
+            cells.append(m)
+            if m.child and id(m.child) not in index:
+                chains.append(top_mensur(m.child))
+            m = m.next
+        ranges.append((first, len(cells) - 1))
+
+    ma = MenArray(len(cells))
+    for first, last in ranges:
+        ma.end[first:last + 1] = last
+    for i, m in enumerate(cells):
+        ma.df[i], ma.db[i], ma.r[i] = m.get_fbr()
+        if m.next:
+            ma.next[i] = index[id(m.next)]
+        if m.prev:
+            ma.prev[i] = index[id(m.prev)]
+        if m.child:
+            ma.child[i] = index[id(m.child)]
+        if m.parent:
+            ma.parent[i] = index[id(m.parent)]
+        ma.c_type[i] = C_TYPES.index(m.c_type)
+        ma.c_ratio[i] = m.c_ratio
+        if m.c_name:
+            ma.c_name[i] = m.c_name
+        jnt = joint_mensur(m)
+        if jnt:
+            ma.joint[i] = index[id(jnt)]
+
+    return ma
+
+
+def actual_path(ma, from_tail=False):
+    """Indices of MenArray cells along actual sounding path,
+    which is traced in the same way as actual_next_mensur (or actual_prev_mensur if from_tail).
+    """
+    path = []
+    if not from_tail:
+        i = 0
+        while i >= 0:
+            path.append(i)
+            if ma.child[i] >= 0 and C_TYPES[ma.c_type[i]] == 'BRANCH' and ma.c_ratio[i] > HALF:
+                i = ma.child[i]
+            elif ma.next[i] >= 0:
+                i = ma.next[i]
             else:
-                if wd[0] == 'MAIN' or wd[0] == '[':
-                    gnm = 'MAIN'
-                    group_tree = [gnm]
-                elif wd[0] == 'GROUP' or wd[0] == '{':
-                    group_tree.append(wd[1])
-                    gnm = ':'.join(group_tree)  # nested groups are connected by:
-                assert (gnm not in group_names), "group name %s is doubling" % gnm  # group name must be unique
-                group_names.append(gnm)
-        else:
-            if wd[0] in type_keywords:
-                # BRANCH, MERGE, SPLIT, etc...
-                cur = men_by_kwd(cur, wd)
+                i = ma.parent[i]
+    else:
+        merges = []  # MERGE cells entered, to find the BRANCH to return to
+        i = ma.end[0]
+        while i >= 0:
+            path.append(i)
+            if ma.child[i] >= 0 and C_TYPES[ma.c_type[i]] == 'MERGE' and ma.c_ratio[i] > HALF:
+                merges.append(i)
+                i = ma.child[i]
+            elif ma.prev[i] >= 0:
+                i = ma.prev[i]
+            elif merges:
+                # parent of one cell group is overwritten by MERGE, so look up BRANCH by joint
+                i = np.flatnonzero(ma.joint == merges.pop())[0]
             else:
-                # normal df,db,r,cmt line
-                df, db, r = resolve_vars(wd[:3])  # only df,db,r
-                if len(wd) > 3:
-                    cmt = ''.join(wd[3:])
-                else:
-                    cmt = ''
-                men = Men(df*0.001, db*0.001, r*0.001, comment=cmt, group=gnm)  # create men
+                i = ma.parent[i]
+
+    return np.array(path, dtype=np.int32)
 
-                if not cur:
-                    if group_tree[0] == 'MAIN':
-                        men_grp_table['MAIN'] = men
+
+def virtual_slices(ma, path, step):
+    """Slices of MenArray cells in path by step, as slice_mensur would make, without changing ma.
+    Cells longer than step are divided into parts of step from the input end and a shorter rest.
+    Returns arrays of cell index, x ( position of input end along path from path[0] ),
+    df, db and r of each slice. Diameters are interpolated linearly inside the cell.
+    """
+    path = np.asarray(path)
+    r = ma.r[path]
+    n = np.ones(len(path), dtype=np.int64)
+    if step > 0:
+        cut = r > step
+        k = np.floor(r[cut]/step).astype(np.int64)
+        # the rest shorter than rounding error is not a slice
+        n[cut] = np.maximum(k + (r[cut] - k*step > step*1e-9), 1)
+    first = np.cumsum(n) - n
+    cell = np.repeat(path, n)
+    rc = np.repeat(r, n)
+    a = (np.arange(n.sum()) - np.repeat(first, n))*step if step > 0 else np.zeros(n.sum())
+    b = np.minimum(a + step, rc) if step > 0 else rc
+    b[first + n - 1] = r  # last slice ends at the output end
+    df, db = ma.df[cell], ma.db[cell]
+    pos = rc > 0
+    sdf, sdb = df.copy(), db.copy()
+    sdf[pos] = df[pos] + (db[pos] - df[pos])*a[pos]/rc[pos]
+    sdb[pos] = df[pos] + (db[pos] - df[pos])*b[pos]/rc[pos]
+    sdb[first + n - 1] = ma.db[path]
+    x = np.repeat(np.cumsum(r) - r, n) + a
+
+    return cell, x, sdf, sdb, b - a
+
+
+class MensurDocument(object):
+    """Parse session of one XMEN text.
+    Owns its variables, group names and table of group heads, nothing is kept in
+    module globals. Texts can be parsed in many threads at once, and a document with
+    its Men cells is released when dropped ( unless publish_last is set, then the last
+    parsed one is referred by read only module aliases, see publish ).
+    """
+    def __init__(self, path=None):
+        self.path = path  # used for error messages
+        self.variables = new_variables()
+        self.group_names = []  # in order of definition, nested groups are joined by ':'
+        self.men_grp_table = {}  # group name -> head Men
+        self.group_tree = []  # group tree at the end of text
+        self.mensur = []  # all Men items in order of creation
+        self.top = None  # top Men of MAIN
+
+    def group(self, name):
+        """Head Men of group name"""
+        return self.men_grp_table[name]
+
+    def parse(self, lines):
+        """Parse text lines of mensur file and build Men cells.
+        Returns top Men of MAIN.
+        """
+        table = self.men_grp_table
+        tree = self.group_tree
+        refs = {}  # group name -> line of the first joint referring it
+        cur = None  # current mensur cell
+        gnm = ''  # current group name
+
+        for lineno, kind, val in mensur_tokens(lines, self.variables, self.path):
+            try:
+                # it is command or normal DF,DB,R
+                if kind == 'group':
+                    key, name = val
+                    if key == 'END_MAIN' or key == ']':
+                        del tree[:]
+                        cur = None
+                    elif key == 'END_GROUP' or key == '}':
+                        if not tree:
+                            raise ValueError('END_GROUP without GROUP')
+                        tree.pop()
+                        if not len(tree):
+                            cur = None
                     else:
-                        # print(gnm)
-                        men_grp_table[gnm] = men
-                    cur = men
+                        if key == 'MAIN' or key == '[':
+                            gnm = 'MAIN'
+                            tree[:] = [gnm]
+                        elif key == 'GROUP' or key == '{':
+                            tree.append(name)
+                            gnm = ':'.join(tree)  # nested groups are connected by:
+                        if gnm in self.group_names:
+                            raise ValueError('group name %s is doubling' % gnm)  # group name must be unique
+                        self.group_names.append(gnm)
+                elif kind == 'joint':
+                    # BRANCH, MERGE, SPLIT, etc...
+                    if not cur:
+                        raise ValueError('{0} needs a preceding cell'.format(val[0]))
+                    cur = men_by_kwd(cur, *val)
+                    if cur is not None:
+                        self.mensur.append(cur)
+                    if val[1]:
+                        refs.setdefault(val[1], lineno)
                 else:
-                    cur.append(men)
-                    cur = men
+                    # normal df,db,r,cmt line
+                    df, db, r, cmt = val
+                    if not tree:
+                        raise ValueError('cell outside of MAIN or GROUP')
+                    men = Men(df*0.001, db*0.001, r*0.001, comment=cmt, group=gnm)  # create men
+                    self.mensur.append(men)
+
+                    if not cur:
+                        table['MAIN' if tree[0] == 'MAIN' else gnm] = men
+                        cur = men
+                    else:
+                        cur.append(men)
+                        cur = men
+            except ValueError as e:
+                raise MensurSyntaxError(str(e), lineno, self.path)
+
+        if 'MAIN' not in table:
+            raise MensurSyntaxError('MAIN is not defined', None, self.path)
+        for name, lineno in sorted(refs.items(), key=lambda v: v[1]):
+            if name not in table:
+                raise MensurSyntaxError('group {0} is not defined'.format(name), lineno, self.path)
+        # now resolve childs
+        resolve_child_mensur(table)
+
+        self.top = table['MAIN']
+        if publish_last:
+            publish(self)
+        return self.top
+
+
+def publish(doc):
+    """Set read only module aliases group_names, group_tree, mensur and men_grp_table
+    to tables of MensurDocument doc, for old code reading them after build_mensur.
+    Called by every parse while publish_last is True. The four aliases always come from
+    one document, but with parses in many threads it is not known which one."""
+    global group_names, group_tree, mensur, men_grp_table
+    with _publish_lock:
+        group_names = tuple(doc.group_names)
+        group_tree = tuple(doc.group_tree)
+        mensur = tuple(doc.mensur)
+        men_grp_table = types.MappingProxyType(dict(doc.men_grp_table))
+
 
-    # debug
-    # print(men_grp_table)
-    # print(group_names)
+def clear_mensur():
+    """Does nothing, kept for old code. Each parse has its own MensurDocument,
+    nothing is left from previous ones."""
+    pass
 
-    # now resolve childs
-    resolve_child_mensur()
 
-    # return topmost mensur
-    return men_grp_table['MAIN']
+######################################################################
+def parse_mensur(lines, path=None):
+    """MensurDocument of text lines read from mensur file"""
+    doc = MensurDocument(path)
+    doc.parse(lines)
+    return doc
+
+
+def build_mensur(lines, path=None):
+    """Parse text lines which read from mensur file, then build mensur objects.
+    Each call is a new MensurDocument, returns its topmost mensur.
+    path is used for error messages.
+    """
+    return parse_mensur(lines, path).top
 
 
 def read_mensur_file(path):
@@ -414,6 +743,141 @@ def read_mensur_file(path):
     lns = f.readlines()
     f.close()
 
-    men = build_mensur(lns)
+    men = build_mensur(lns, path)
 
     return men
+
+
+def build_mensur_array(lines, path=None):
+    """Parse text lines of mensur file into MenArray directly, without Men objects. Result is the same as compile_mensur(build_mensur(lines)).
+    """
+    chains = {}  # group table name -> [df, db, r, c_type, c_name, c_ratio] lists
+    names = set()
+    refs = {}  # group name -> line of the first joint referring it
+    tree = []
+    cur = None  # current chain
+    gnm = ''
+    for lineno, kind, val in mensur_tokens(lines, path=path):
+        try:
+            if kind == 'group':
+                key, name = val
+                if key == 'END_MAIN' or key == ']':
+                    tree = []
+                    cur = None
+                elif key == 'END_GROUP' or key == '}':
+                    if not tree:
+                        raise ValueError('END_GROUP without GROUP')
+                    tree.pop()
+                    if not tree:
+                        cur = None
+                else:
+                    if key == 'MAIN' or key == '[':
+                        gnm = 'MAIN'
+                        tree = [gnm]
+                    else:
+                        tree.append(name)
+                        gnm = ':'.join(tree)
+                    if gnm in names:
+                        raise ValueError('group name %s is doubling' % gnm)
+                    names.add(gnm)
+            elif kind == 'joint':
+                key, name, ratio = val
+                if cur is None:
+                    raise ValueError('{0} needs a preceding cell'.format(key))
+                db = cur[1][-1]
+                if key in ('BRANCH', 'VALVE_OUT', '<', 'MERGE', 'VALVE_IN', '>', 'SPLIT', 'TONEHOLE', '|'):
+                    if not name or ratio is None:
+                        raise ValueError('{0} requires name and ratio'.format(key))
+                    ct = 'BRANCH' if key in ('BRANCH', 'VALVE_OUT', '<') else 'MERGE' if key in ('MERGE', 'VALVE_IN', '>') else 'SPLIT'
+                    cell = (db, db, 0, ct, name, ratio)
+                elif key == 'INSERT' or key == '@':
+                    if not name:
+                        raise ValueError('{0} requires name'.format(key))
+                    cell = (db, db, 0, 'INSERT', name, 1)
+                elif key == 'OPEN_END':
+                    cell = (db, 0, 0, None, '', 1)
+                else:
+                    cell = (0, 0, 0, None, '', 1)
+                for lst, v in zip(cur, cell):
+                    lst.append(v)
+                if name:
+                    refs.setdefault(name, lineno)
+            else:
+                df, db, r, cmt = val
+                if not tree:
+                    raise ValueError('cell outside of MAIN or GROUP')
+                if cur is None:
+                    cur = [[], [], [], [], [], []]
+                    chains['MAIN' if tree[0] == 'MAIN' else gnm] = cur
+                for lst, v in zip(cur, (df*0.001, db*0.001, r*0.001, None, '', 1)):
+                    lst.append(v)
+        except ValueError as e:
+            raise MensurSyntaxError(str(e), lineno, path)
+    if 'MAIN' not in chains:
+        raise MensurSyntaxError('MAIN is not defined', None, path)
+
+    def expand(name, inserting):
+        """cells of chain name with INSERT groups joined, as resolve_child_mensur does for MAIN"""
+        if name not in chains:
+            raise MensurSyntaxError('group {0} is not defined'.format(name), refs.get(name), path)
+        if name in inserting:
+            raise MensurSyntaxError('group {0} is inserted into itself'.format(name), refs.get(name), path)
+        c = chains[name]
+        out = [[], [], [], [], [], []]
+        for k in range(len(c[0])):
+            for lst, src in zip(out, c):
+                lst.append(src[k])
+            if c[3][k] == 'INSERT':
+                sub = expand(c[4][k], inserting + (name,))
+                for lst, src in zip(out, sub):
+                    lst.extend(src)
+        return out
+
+    # chains in the order of compile_mensur: MAIN, then child groups by first reference
+    order = [expand('MAIN', ())]
+    first = {}  # group name -> index of its top cell
+    pos = len(order[0][0])
+    for k, (ct, name) in enumerate(zip(order[0][3], order[0][4])):
+        if ct in ('SPLIT', 'BRANCH', 'MERGE') and name not in first:
+            if name not in chains:
+                raise MensurSyntaxError('group {0} is not defined'.format(name), refs.get(name), path)
+            first[name] = pos
+            order.append(chains[name])
+            pos += len(chains[name][0])
+
+    ma = MenArray(pos)
+    i = 0
+    for c in order:
+        n = len(c[0])
+        sl = slice(i, i + n)
+        ma.df[sl], ma.db[sl], ma.r[sl] = c[0], c[1], c[2]
+        ma.c_type[sl] = [C_TYPES.index(t) for t in c[3]]
+        ma.c_ratio[sl] = c[5]
+        ma.next[sl] = np.arange(i + 1, i + n + 1)
+        ma.next[i + n - 1] = -1
+        ma.prev[sl] = np.arange(i - 1, i + n - 1)
+        ma.prev[i] = -1
+        ma.end[sl] = i + n - 1
+        for k, name in enumerate(c[4]):
+            if name:
+                ma.c_name[i + k] = name
+        i += n
+    # connect children of MAIN chain, later connection overwrites parent
+    for k, (ct, name) in enumerate(zip(order[0][3], order[0][4])):
+        if ct in ('SPLIT', 'BRANCH', 'MERGE'):
+            top = first[name]
+            ch = ma.end[top] if ct == 'MERGE' else top
+            ma.child[k] = ch
+            ma.parent[ch] = k
+    for k in np.flatnonzero((ma.child >= 0) & (ma.c_type == C_TYPES.index('BRANCH'))):
+        p = ma.parent[ma.end[ma.child[k]]]
+        if p >= 0 and C_TYPES[ma.c_type[p]] == 'MERGE':
+            ma.joint[k] = p
+
+    return ma
+
+
+def read_mensur_array(path):
+    """Read mensur file into MenArray by build_mensur_array"""
+    with open(path, 'r') as f:
+        return build_mensur_array(f, path)